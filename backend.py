@@ -23,9 +23,9 @@
 import numpy
 from numpy.typing import NDArray
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict, deque
 
-from itertools import islice
+from itertools import islice, count
 
 import logging
 
@@ -34,14 +34,19 @@ import ctypes
 import sys, os
 from types import ModuleType
 import typing
-from typing import Callable, Any, NewType, Sequence, Optional, TypeAlias
+from typing import Callable, Any, Hashable, NewType, Sequence, Optional, TypeAlias
 
 import importlib.util
 import platform
 import json
+import hashlib
+import mmap
 
 import traceback
 
+import threading
+import asyncio
+
 from lib.datatypes import JsonDataType
 
 from lib import ExtensionPyABC, SpecialArch
@@ -144,6 +149,197 @@ PlProcCore.MultiCore.argtypes = [ThreadPoolCtxPtr,
     ctypes.c_size_t
 ]
 PlProcCore.MultiCore.restype = ctypes.c_int
+# 以下入口只在较新的PlProcCore中存在。未重新编译的旧版本(如预编译的Windows库)缺少它们时，只绑定存在的部分，
+# 调用处退回MultiCore/SingleCore：静态划分代替工作窃取与融合执行，作业同步执行，执行计划逐步从Python调用
+CORE_HAS_CLIENT = hasattr(PlProcCore, "ClientMultiCore")
+"""线程池客户端(ClientMultiCore等)"""
+CORE_HAS_RANGE = CORE_HAS_CLIENT and hasattr(PlProcCore, "MultiCoreRange") and hasattr(PlProcCore, "ClientMultiCoreRange")
+"""工作窃取调度(f1r)"""
+CORE_HAS_JOBS = CORE_HAS_CLIENT and hasattr(PlProcCore, "ClientSubmitMultiCore")
+"""异步作业"""
+CORE_HAS_FUSED = CORE_HAS_RANGE and hasattr(PlProcCore, "ClientMultiCoreFused")
+"""融合执行"""
+CORE_HAS_PLAN = CORE_HAS_RANGE and CORE_HAS_FUSED and hasattr(PlProcCore, "ClientRunPlan")
+"""在C中执行整条执行计划"""
+CORE_HAS_PROFILING = hasattr(PlProcCore, "ThreadPoolTakeTaskTimes")
+"""线程池任务耗时记录"""
+if hasattr(PlProcCore, "MultiCoreRange"):
+    """
+    int MultiCoreRange(ThreadPoolCtx* ctx,
+        char* caller, void* func, void* args, int *ret,
+        uint8_t* in_buffer, uint8_t* out_buffer,
+        size_t in_shape[],
+        size_t total, size_t grain, size_t phases
+    )
+    """
+    PlProcCore.MultiCoreRange.argtypes = [ThreadPoolCtxPtr,
+        ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.POINTER(ctypes.c_int),
+        ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_size_t),
+        ctypes.c_size_t, ctypes.c_size_t, ctypes.c_size_t
+    ]
+    PlProcCore.MultiCoreRange.restype = ctypes.c_int
+ThreadPoolClientPtr: TypeAlias = ctypes.c_void_p
+if CORE_HAS_CLIENT:
+    """
+    ThreadPoolClient* NewThreadPoolClient(ThreadPoolCtx* ctx)
+    """
+    PlProcCore.NewThreadPoolClient.argtypes = [ThreadPoolCtxPtr]
+    PlProcCore.NewThreadPoolClient.restype = ThreadPoolClientPtr
+    """
+    void DeleteThreadPoolClient(ThreadPoolCtx* ctx, ThreadPoolClient* client)
+    """
+    PlProcCore.DeleteThreadPoolClient.argtypes = [ThreadPoolCtxPtr, ThreadPoolClientPtr]
+    PlProcCore.DeleteThreadPoolClient.restype = None
+    """
+    int ClientMultiCore(ThreadPoolCtx* ctx, ThreadPoolClient* client, ...)
+    其余参数与MultiCore相同
+    """
+    PlProcCore.ClientMultiCore.argtypes = [ThreadPoolCtxPtr, ThreadPoolClientPtr, *PlProcCore.MultiCore.argtypes[1:]]
+    PlProcCore.ClientMultiCore.restype = ctypes.c_int
+if CORE_HAS_RANGE:
+    """
+    int ClientMultiCoreRange(ThreadPoolCtx* ctx, ThreadPoolClient* client,
+        char* caller, void* func, void* args, int *ret,
+        uint8_t* in_buffer, uint8_t* out_buffer,
+        size_t in_shape[],
+        size_t begin, size_t total, size_t grain, size_t phases
+    )
+    与MultiCoreRange相同，但只处理[begin, total)
+    """
+    PlProcCore.ClientMultiCoreRange.argtypes = [ThreadPoolCtxPtr, ThreadPoolClientPtr, *PlProcCore.MultiCoreRange.argtypes[1:8], ctypes.c_size_t, *PlProcCore.MultiCoreRange.argtypes[8:]]
+    PlProcCore.ClientMultiCoreRange.restype = ctypes.c_int
+PlProcJobPtr: TypeAlias = ctypes.c_void_p
+if CORE_HAS_JOBS:
+    """
+    PlProcJob* ClientSubmitMultiCore(ThreadPoolCtx* ctx, ThreadPoolClient* client, ...)
+    其余参数与ClientMultiCore相同。线程池未初始化时返回NULL
+    """
+    PlProcCore.ClientSubmitMultiCore.argtypes = PlProcCore.ClientMultiCore.argtypes
+    PlProcCore.ClientSubmitMultiCore.restype = PlProcJobPtr
+if CORE_HAS_JOBS and CORE_HAS_RANGE:
+    """
+    PlProcJob* ClientSubmitMultiCoreRange(ThreadPoolCtx* ctx, ThreadPoolClient* client, ...)
+    其余参数与ClientMultiCoreRange相同。线程池未初始化时返回NULL
+    """
+    PlProcCore.ClientSubmitMultiCoreRange.argtypes = PlProcCore.ClientMultiCoreRange.argtypes
+    PlProcCore.ClientSubmitMultiCoreRange.restype = PlProcJobPtr
+if CORE_HAS_FUSED:
+    """
+    int ClientMultiCoreFused(ThreadPoolCtx* ctx, ThreadPoolClient* client,
+        char* caller, size_t stages, void** funcs, void** args, size_t* phases, int *ret,
+        uint8_t** in_buffers, uint8_t** out_buffers,
+        size_t in_shape[],
+        size_t begin, size_t total, size_t grain
+    )
+    """
+    PlProcCore.ClientMultiCoreFused.argtypes = [ThreadPoolCtxPtr, ThreadPoolClientPtr,
+        ctypes.c_char_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_size_t), ctypes.POINTER(ctypes.c_int),
+        ctypes.POINTER(ctypes.POINTER(ctypes.c_uint8)), ctypes.POINTER(ctypes.POINTER(ctypes.c_uint8)),
+        ctypes.POINTER(ctypes.c_size_t),
+        ctypes.c_size_t, ctypes.c_size_t, ctypes.c_size_t
+    ]
+    PlProcCore.ClientMultiCoreFused.restype = ctypes.c_int
+if CORE_HAS_FUSED and CORE_HAS_JOBS:
+    """
+    PlProcJob* ClientSubmitMultiCoreFused(ThreadPoolCtx* ctx, ThreadPoolClient* client, ...)
+    其余参数与ClientMultiCoreFused相同。线程池未初始化时返回NULL
+    """
+    PlProcCore.ClientSubmitMultiCoreFused.argtypes = PlProcCore.ClientMultiCoreFused.argtypes
+    PlProcCore.ClientSubmitMultiCoreFused.restype = PlProcJobPtr
+if CORE_HAS_JOBS:
+    """
+    int PlProcJobPoll(PlProcJob* job)
+    """
+    PlProcCore.PlProcJobPoll.argtypes = [PlProcJobPtr]
+    PlProcCore.PlProcJobPoll.restype = ctypes.c_int
+    """
+    int PlProcJobWait(PlProcJob* job, int64_t timeout_ms)
+    """
+    PlProcCore.PlProcJobWait.argtypes = [PlProcJobPtr, ctypes.c_int64]
+    PlProcCore.PlProcJobWait.restype = ctypes.c_int
+    """
+    void PlProcJobCancel(PlProcJob* job)
+    """
+    PlProcCore.PlProcJobCancel.argtypes = [PlProcJobPtr]
+    PlProcCore.PlProcJobCancel.restype = None
+    """
+    void PlProcJobRelease(PlProcJob* job)
+    """
+    PlProcCore.PlProcJobRelease.argtypes = [PlProcJobPtr]
+    PlProcCore.PlProcJobRelease.restype = None
+if hasattr(PlProcCore, "PlProcIsCancelled"):
+    """
+    int PlProcIsCancelled(void)
+    不在Python中调用。其地址会被写入扩展导出的函数指针变量img2arr_is_cancelled
+    """
+    PlProcCore.PlProcIsCancelled.argtypes = []
+    PlProcCore.PlProcIsCancelled.restype = ctypes.c_int
+if hasattr(PlProcCore, "PlProcBarrierWait"):
+    """
+    void PlProcBarrierWait(void)
+    不在Python中调用。其地址会被写入扩展导出的函数指针变量img2arr_barrier_wait
+    """
+    PlProcCore.PlProcBarrierWait.argtypes = []
+    PlProcCore.PlProcBarrierWait.restype = None
+class PlProcTaskTime(ctypes.Structure):
+    """一个任务的耗时记录，见`ThreadPoolTakeTaskTimes`"""
+    _fields_ = [
+        ("caller", ctypes.c_char * 32),
+        ("job", ctypes.c_uint64),
+        ("phase", ctypes.c_uint32),
+        ("idx", ctypes.c_uint32),
+        ("worker", ctypes.c_uint32),
+        ("reserved", ctypes.c_uint32),
+        ("start_ns", ctypes.c_int64),
+        ("end_ns", ctypes.c_int64),
+    ]
+if CORE_HAS_PROFILING:
+    """
+    int ThreadPoolSetProfiling(ThreadPoolCtx* ctx, int enable)
+    """
+    PlProcCore.ThreadPoolSetProfiling.argtypes = [ThreadPoolCtxPtr, ctypes.c_int]
+    PlProcCore.ThreadPoolSetProfiling.restype = ctypes.c_int
+    """
+    size_t ThreadPoolTakeTaskTimes(ThreadPoolCtx* ctx, PlProcTaskTime* out, size_t cap)
+    """
+    PlProcCore.ThreadPoolTakeTaskTimes.argtypes = [ThreadPoolCtxPtr, ctypes.POINTER(PlProcTaskTime), ctypes.c_size_t]
+    PlProcCore.ThreadPoolTakeTaskTimes.restype = ctypes.c_size_t
+    """
+    int64_t PlProcNowNs(void)
+    """
+    PlProcCore.PlProcNowNs.argtypes = []
+    PlProcCore.PlProcNowNs.restype = ctypes.c_int64
+class PlProcPlanStep(ctypes.Structure):
+    """执行计划的一步，见`ClientRunPlan`与`ExecPlan`。mode为EXT_PATH_SINGLECORE/EXT_PATH_MULTICORE/EXT_PATH_MULTICORE_RANGE/PLAN_STEP_*"""
+    _fields_ = [
+        ("mode", ctypes.c_int32),
+        ("reserved", ctypes.c_uint32),
+        ("caller", ctypes.c_char_p),
+        ("func", ctypes.c_void_p),
+        ("args", ctypes.c_void_p),
+        ("ret", ctypes.POINTER(ctypes.c_int)),
+        ("in_buffer", ctypes.POINTER(ctypes.c_uint8)),
+        ("out_buffer", ctypes.POINTER(ctypes.c_uint8)),
+        ("in_shape", ctypes.POINTER(ctypes.c_size_t)),
+        ("tasks", ctypes.c_size_t),
+        ("begin", ctypes.c_size_t),
+        ("total", ctypes.c_size_t),
+        ("grain", ctypes.c_size_t),
+        ("phases", ctypes.c_size_t),
+        ("stages", ctypes.c_size_t),
+        ("funcs", ctypes.POINTER(ctypes.c_void_p)),
+        ("stage_args", ctypes.POINTER(ctypes.c_void_p)),
+        ("stage_phases", ctypes.POINTER(ctypes.c_size_t)),
+        ("in_buffers", ctypes.POINTER(ctypes.POINTER(ctypes.c_uint8))),
+        ("out_buffers", ctypes.POINTER(ctypes.POINTER(ctypes.c_uint8))),
+        ("bytes", ctypes.c_size_t),
+    ]
+if CORE_HAS_PLAN:
+    """
+    int ClientRunPlan(ThreadPoolCtx* ctx, ThreadPoolClient* client, PlProcPlanStep* steps, size_t n, int* rets)
+    """
+    PlProcCore.ClientRunPlan.argtypes = [ThreadPoolCtxPtr, ThreadPoolClientPtr, ctypes.POINTER(PlProcPlanStep), ctypes.c_size_t, ctypes.POINTER(ctypes.c_int)]
+    PlProcCore.ClientRunPlan.restype = ctypes.c_int
 """
 void DeleteThreadPoolCtx(ThreadPoolCtx* ctx)
 """
@@ -189,6 +385,12 @@ EXT_PATH_SINGLECORE = 0
 EXT_PATH_MULTICORE = 1
 EXT_PATH_OPENCL = 2
 EXT_PATH_CUDA = 3
+EXT_PATH_MULTICORE_RANGE = 4
+
+PLAN_STEP_FUSED = 16
+"""执行计划中融合执行的多个逐像素预处理，见`PlProcPlanStep`"""
+PLAN_STEP_COPY = 17
+"""执行计划中的复制，见`PlProcPlanStep`"""
 
 ExtMain = tuple[dict[str, str], ctypes.CDLL, ExtensionPyABC.abcExt | None, Any | None, None]
 
@@ -328,6 +530,11 @@ def _load_exts_cdll(file: str, regname_prefix: str, is_code_stage: bool = False)
         raise AttributeError(f"Cannot found function \"int io_GetOutInfo(void* args, size_t in_t, size_t in_h, size_t in_w, size_t* out_t, size_t* out_h, size_t* out_w, int* attr)\"")
     cdll.io_GetOutInfo.restype = ctypes.c_int
     cdll.io_GetOutInfo.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_size_t), ctypes.POINTER(ctypes.c_size_t), ctypes.POINTER(ctypes.c_int)]
+    # 可选的区域映射，用于局部重算：输入中的区域[y0, x0, y1, x1)变化时，输出中受影响的区域
+    # int io_GetOutRegion(void* args, size_t in_shape[], size_t in_region[4], size_t out_region[4])
+    if hasattr(cdll, "io_GetOutRegion"):
+        cdll.io_GetOutRegion.restype = ctypes.c_int
+        cdll.io_GetOutRegion.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_size_t), ctypes.POINTER(ctypes.c_size_t), ctypes.POINTER(ctypes.c_size_t)]
 
     # 对于code阶段，还需要io_GetViewOutInfo
     # int io_GetViewOutInfo(void* args, size_t in_shape[ ], size_t out_shape[ ])
@@ -366,6 +573,21 @@ def _load_exts_cdll(file: str, regname_prefix: str, is_code_stage: bool = False)
         if hasattr(cdll, "f1p"):
             cdll.f1p.restype = ctypes.c_int
             cdll.f1p.argtypes = [ctypes.c_size_t, ctypes.c_size_t, ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_size_t)]
+    # 可选的区间版本，用于工作窃取调度：
+    # int f1r(size_t phase, size_t start, size_t end, void* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[])
+    # 处理in_shape[0]方向上的[start, end)。若扩展导出了size_t img2arr_f1r_phases，则按阶段依次调用，阶段间由核心同步
+    if hasattr(cdll, "f1r"):
+        cdll.f1r.restype = ctypes.c_int
+        cdll.f1r.argtypes = [ctypes.c_size_t, ctypes.c_size_t, ctypes.c_size_t, ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_uint8), ctypes.POINTER(ctypes.c_size_t)]
+    # 可选的取消标志查询：扩展导出函数指针变量int (*img2arr_is_cancelled)(void)，这里将其指向核心的PlProcIsCancelled。
+    # 扩展在f1的耗时循环中调用它，返回非0时尽快返回
+    if hasattr(cdll, "img2arr_is_cancelled") and hasattr(PlProcCore, "PlProcIsCancelled"):
+        ctypes.c_void_p.in_dll(cdll, "img2arr_is_cancelled").value = ctypes.cast(PlProcCore.PlProcIsCancelled, ctypes.c_void_p).value
+    # 可选的屏障：扩展导出函数指针变量void (*img2arr_barrier_wait)(void)，这里将其指向核心的PlProcBarrierWait。
+    # f1需要两步计算时，在两步之间调用它，代替自己实现的自旋等待
+    # 核心不提供时保持NULL，扩展使用自己的同步方式
+    if hasattr(cdll, "img2arr_barrier_wait") and hasattr(PlProcCore, "PlProcBarrierWait"):
+        ctypes.c_void_p.in_dll(cdll, "img2arr_barrier_wait").value = ctypes.cast(PlProcCore.PlProcBarrierWait, ctypes.c_void_p).value
     if hasattr(cdll, "init"):
         # 初始化函数，启动时调用
         # int init(void)
@@ -387,10 +609,109 @@ def _load_exts_ctlext(file: str, cdll: ctypes.CDLL) -> ModuleType:
 
 import time
 
+class JOB_STATUS:
+    """作业状态enum"""
+    JOB_RUNNING = 0
+    JOB_DONE = 1
+    JOB_CANCELLED = 2
+    """被取消后结束。输出缓冲区的内容不完整"""
+
+class JobCancelled(Exception):
+    """作业被取消"""
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.index: int | None = None
+        """被取消的预处理索引。由`Pre_iter.next()`设置"""
+        self.pre_resized: bool | None = None
+        """被取消时pre的尺寸是否已经更新。由`Pre_iter.next()`设置"""
+
+class PlProcJob:
+    """异步作业句柄，由`PlProc.submit_f1()`等创建。  
+    作业结束前，参数与缓冲区必须保持有效：句柄会持有`keep`中的对象。  
+    可以在事件循环中`await`，见`wait_async()`。  
+    核心不支持异步作业时(见`CORE_HAS_JOBS`)，提交时已同步执行完毕，handle为None，status为其结束状态。"""
+    def __init__(self, handle: PlProcJobPtr | None, keep: tuple, status: int = JOB_STATUS.JOB_RUNNING):
+        self.handle: PlProcJobPtr | None = handle
+        self._keep = keep
+        self.status = status
+        """同步执行的作业的结束状态"""
+    def poll(self) -> int:
+        """查询状态，见`JOB_STATUS`"""
+        if self.status != JOB_STATUS.JOB_RUNNING:
+            return self.status
+        assert self.handle is not None, "作业句柄已释放"
+        return PlProcCore.PlProcJobPoll(self.handle)
+    def wait(self, timeout: Optional[float] = None) -> int:
+        """等待作业结束(会释放GIL)。timeout为秒，None表示一直等待。返回状态，超时返回`JOB_RUNNING`"""
+        if self.status != JOB_STATUS.JOB_RUNNING:
+            return self.status
+        assert self.handle is not None, "作业句柄已释放"
+        timeout_ms = -1 if timeout is None else max(int(timeout * 1000), 0)
+        return PlProcCore.PlProcJobWait(self.handle, timeout_ms)
+    def cancel(self):
+        """请求取消，立即返回。还没开始的任务不会再执行，正在执行的任务由扩展自行检查取消标志"""
+        if self.handle is not None:
+            PlProcCore.PlProcJobCancel(self.handle)
+    def done(self) -> bool:
+        return self.poll() != JOB_STATUS.JOB_RUNNING
+    def cancelled(self) -> bool:
+        return self.poll() == JOB_STATUS.JOB_CANCELLED
+    async def wait_async(self) -> int:
+        """在事件循环中等待作业结束。等待被取消时，作业也会被取消"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(None, self.wait)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+    def __await__(self):
+        return self.wait_async().__await__()
+    def release(self):
+        """释放句柄。若作业仍在运行，会先取消并等待其结束"""
+        if self.handle is not None:
+            PlProcCore.PlProcJobRelease(self.handle)
+            self.handle = None
+            self._keep = ()
+    def __del__(self):
+        self.release()
+
+class JobScope:
+    """一组可以一起取消的作业。取消后，正在运行的作业会被取消，之后在此范围内提交作业会直接抛出`JobCancelled`"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs: set[PlProcJob] = set()
+        self.is_cancelled = False
+    def check(self):
+        """若已取消，抛出`JobCancelled`"""
+        if self.is_cancelled:
+            raise JobCancelled()
+    def run(self, job: PlProcJob) -> int:
+        """等待作业结束并释放句柄。作业被取消时抛出`JobCancelled`"""
+        with self.lock:
+            self.jobs.add(job)
+            if self.is_cancelled:
+                job.cancel()
+        try:
+            status = job.wait()
+        finally:
+            with self.lock:
+                self.jobs.discard(job)
+            job.release()
+        if status == JOB_STATUS.JOB_CANCELLED:
+            raise JobCancelled()
+        return 0
+    def cancel(self):
+        with self.lock:
+            self.is_cancelled = True
+            jobs = list(self.jobs)
+        for job in jobs:
+            job.cancel()
+
 class PlProc:
     """最近一次调用`set_threads()`时指定的线程数。"""
     threads: int = 0
-    f1_is_running: bool = False
+    client: ThreadPoolClientPtr | None = None
+    """提交时使用的客户端。None表示使用线程池的默认客户端"""
     def __init__(self, threads: Optional[int] = None):
         self.ctx: ThreadPoolCtxPtr = PlProcCore.NewThreadPoolCtx()
         if threads is None:
@@ -398,7 +719,7 @@ class PlProc:
             return
         self.set_threads(threads)
     def set_threads(self, threads: int) -> int:
-        """设定线程数。也用于重新初始化线程池(会等待所有任务完成)。  
+        """设定线程数。也用于重新初始化线程池(会等待队列中的任务执行完)。不要与`f1()`同时调用。  
         返回值：实际线程数。有概率因系统原因会小于指定线程数`threads`"""
         real_threads = PlProcCore.InitThreadPool(self.ctx, threads)
         self.threads = threads
@@ -426,21 +747,140 @@ class PlProc:
            tasks: int
         ) -> int:
         """
-        并行计算。该函数会等待直到所有线程完成。  
+        并行计算。该函数会等待直到本次提交的所有任务完成。  
         如果在调用此函数时，线程池未初始化，会抛出异常。  
-        如果在调用此函数时，其他任务仍在执行，可能会出现异常。  
-        tasks: 任务数。如果为0，会使用线程池中的线程数。一般大于等于线程数。
+        可以在多个线程中同时调用：每次调用有独立的完成计数，各次调用的任务在线程池中交错执行。  
+        tasks: 任务数。如果为0，会使用线程池中的线程数。使用线程间同步的扩展要求不超过线程数。
+        """
+        if CORE_HAS_CLIENT:
+            ret = PlProcCore.ClientMultiCore(
+                self.ctx, self.client,
+                name, func_ptr, args, ret_ptr, 
+                inbuf_ptr, outbuf_ptr, shape_ptr,
+                tasks
+            )
+        else:
+            ret = PlProcCore.MultiCore(
+                self.ctx,
+                name, func_ptr, args, ret_ptr, 
+                inbuf_ptr, outbuf_ptr, shape_ptr,
+                tasks
+            )
+        if ret == -114514: # 线程池线程数为0
+            raise RuntimeError("线程池未初始化，或线程数被设为0。请先调用`set_threads()`")
+        return ret
+    def f1r(self,
+           name: bytes, func_ptr: ExtensionPyABC.CPointerArgType,
+           args: ExtensionPyABC.CPointerArgType, ret_ptr: ExtensionPyABC.CPointerArgType,
+           inbuf_ptr: ctypes._Pointer, outbuf_ptr: ctypes._Pointer,
+           shape_ptr: ctypes._Pointer | ctypes.Array,
+           total: int, grain: int = 0, phases: int = 1, begin: int = 0
+        ) -> int:
+        """
+        工作窃取调度的并行计算。该函数会等待直到所有阶段完成。  
+        [begin, total)被切成大小为grain的小块动态分配给各线程，计算量不均匀的扩展不会被最慢的线程拖累。  
+        ret_ptr的长度应为线程数。  
+        grain: 每块的大小。0表示自动选择。  
+        phases: 阶段数。  
+        begin: 起始位置。用于只重算一部分(见`Pre_iter`的局部重算)。  
+        与`f1()`一样可以在多个线程中同时调用。
         """
-        if self.f1_is_running:
-            logger.warning("线程池已经有正在运行的任务了。接下来可能会出现异常。")
-        self.f1_is_running = True
-        ret = PlProcCore.MultiCore(
-            self.ctx, 
+        ret = PlProcCore.ClientMultiCoreRange(
+            self.ctx, self.client,
+            name, func_ptr, args, ret_ptr, 
+            inbuf_ptr, outbuf_ptr, shape_ptr,
+            begin, total, grain, phases
+        )
+        if ret == -114514: # 线程池线程数为0
+            raise RuntimeError("线程池未初始化，或线程数被设为0。请先调用`set_threads()`")
+        return ret
+    def submit_f1(self,
+           name: bytes, func_ptr: ExtensionPyABC.CPointerArgType,
+           args: ExtensionPyABC.CPointerArgType, ret_ptr: ExtensionPyABC.CPointerArgType,
+           inbuf_ptr: ctypes._Pointer, outbuf_ptr: ctypes._Pointer,
+           shape_ptr: ctypes._Pointer | ctypes.Array,
+           tasks: int, keep: tuple = ()
+        ) -> PlProcJob:
+        """`f1()`的异步版本，立即返回作业句柄。  
+        keep: 作业结束前需要保持存活的对象(参数、返回值数组、缓冲区等)，由句柄持有"""
+        if not CORE_HAS_JOBS:
+            self.f1(name, func_ptr, args, ret_ptr, inbuf_ptr, outbuf_ptr, shape_ptr, tasks)
+            return PlProcJob(None, (), JOB_STATUS.JOB_DONE)
+        handle = PlProcCore.ClientSubmitMultiCore(
+            self.ctx, self.client,
             name, func_ptr, args, ret_ptr, 
             inbuf_ptr, outbuf_ptr, shape_ptr,
             tasks
         )
-        self.f1_is_running = False
+        if not handle:
+            raise RuntimeError("线程池未初始化，或线程数被设为0。请先调用`set_threads()`")
+        return PlProcJob(handle, (self, name, args, ret_ptr, inbuf_ptr, outbuf_ptr, shape_ptr, *keep))
+    def submit_f1r(self,
+           name: bytes, func_ptr: ExtensionPyABC.CPointerArgType,
+           args: ExtensionPyABC.CPointerArgType, ret_ptr: ExtensionPyABC.CPointerArgType,
+           inbuf_ptr: ctypes._Pointer, outbuf_ptr: ctypes._Pointer,
+           shape_ptr: ctypes._Pointer | ctypes.Array,
+           total: int, grain: int = 0, phases: int = 1, begin: int = 0, keep: tuple = ()
+        ) -> PlProcJob:
+        """`f1r()`的异步版本，立即返回作业句柄。工作窃取调度会在每块之间检查取消标志"""
+        if not CORE_HAS_JOBS:
+            self.f1r(name, func_ptr, args, ret_ptr, inbuf_ptr, outbuf_ptr, shape_ptr, total, grain, phases, begin)
+            return PlProcJob(None, (), JOB_STATUS.JOB_DONE)
+        handle = PlProcCore.ClientSubmitMultiCoreRange(
+            self.ctx, self.client,
+            name, func_ptr, args, ret_ptr, 
+            inbuf_ptr, outbuf_ptr, shape_ptr,
+            begin, total, grain, phases
+        )
+        if not handle:
+            raise RuntimeError("线程池未初始化，或线程数被设为0。请先调用`set_threads()`")
+        return PlProcJob(handle, (self, name, args, ret_ptr, inbuf_ptr, outbuf_ptr, shape_ptr, *keep))
+    def fused(self,
+           name: bytes, stages: int,
+           funcs_ptr: ctypes.Array, args_ptr: ctypes.Array, phases_ptr: ctypes.Array, ret_ptr: ExtensionPyABC.CPointerArgType,
+           inbufs_ptr: ctypes.Array, outbufs_ptr: ctypes.Array,
+           shape_ptr: ctypes._Pointer | ctypes.Array,
+           total: int, grain: int = 0, begin: int = 0
+        ) -> int:
+        """
+        融合调度的并行计算。stages个逐像素步骤合成一个作业，[begin, total)的每一块依次经过所有步骤。  
+        funcs_ptr, args_ptr, phases_ptr, inbufs_ptr, outbufs_ptr: 长度为stages的数组，第i项属于第i步。函数为f1r。  
+        ret_ptr的长度应为线程数。
+        """
+        ret = PlProcCore.ClientMultiCoreFused(
+            self.ctx, self.client,
+            name, stages, funcs_ptr, args_ptr, phases_ptr, ret_ptr,
+            inbufs_ptr, outbufs_ptr, shape_ptr,
+            begin, total, grain
+        )
+        if ret == -114514: # 线程池线程数为0
+            raise RuntimeError("线程池未初始化，或线程数被设为0。请先调用`set_threads()`")
+        return ret
+    def submit_fused(self,
+           name: bytes, stages: int,
+           funcs_ptr: ctypes.Array, args_ptr: ctypes.Array, phases_ptr: ctypes.Array, ret_ptr: ExtensionPyABC.CPointerArgType,
+           inbufs_ptr: ctypes.Array, outbufs_ptr: ctypes.Array,
+           shape_ptr: ctypes._Pointer | ctypes.Array,
+           total: int, grain: int = 0, begin: int = 0, keep: tuple = ()
+        ) -> PlProcJob:
+        """`fused()`的异步版本，立即返回作业句柄"""
+        if not CORE_HAS_JOBS:
+            self.fused(name, stages, funcs_ptr, args_ptr, phases_ptr, ret_ptr, inbufs_ptr, outbufs_ptr, shape_ptr, total, grain, begin)
+            return PlProcJob(None, (), JOB_STATUS.JOB_DONE)
+        handle = PlProcCore.ClientSubmitMultiCoreFused(
+            self.ctx, self.client,
+            name, stages, funcs_ptr, args_ptr, phases_ptr, ret_ptr,
+            inbufs_ptr, outbufs_ptr, shape_ptr,
+            begin, total, grain
+        )
+        if not handle:
+            raise RuntimeError("线程池未初始化，或线程数被设为0。请先调用`set_threads()`")
+        return PlProcJob(handle, (self, name, funcs_ptr, args_ptr, phases_ptr, ret_ptr, inbufs_ptr, outbufs_ptr, shape_ptr, *keep))
+
+    def run_plan(self, steps_ptr: ctypes._Pointer, n: int, rets_ptr: ctypes._Pointer) -> int:
+        """依次执行执行计划的n步(见`PlProcPlanStep`)。整条链在C中调度，期间不返回Python，也不持有GIL。  
+        rets_ptr的长度为n，写入各步的返回码"""
+        ret = PlProcCore.ClientRunPlan(self.ctx, self.client, steps_ptr, n, rets_ptr)
         if ret == -114514: # 线程池线程数为0
             raise RuntimeError("线程池未初始化，或线程数被设为0。请先调用`set_threads()`")
         return ret
@@ -448,6 +888,91 @@ class PlProc:
     def __del__(self):
         PlProcCore.DeleteThreadPoolCtx(self.ctx)
 
+class PlProcClient(PlProc):
+    """共享线程池的客户端，由`PlProcPool.acquire()`创建。接口与`PlProc`相同。  
+    线程池在各客户端之间公平轮转；客户端不拥有线程，`close()`只释放对线程池的引用。"""
+    def __init__(self, pool: "PlProcPool", ctx: ThreadPoolCtxPtr):
+        self.pool = pool
+        self.ctx = ctx
+        # 核心不支持客户端时直接使用线程池本身
+        self.client = PlProcCore.NewThreadPoolClient(ctx) if CORE_HAS_CLIENT else None
+        self.closed = False
+        self.threads = PlProcCore.ThreadPoolGetThreads(ctx)
+    def set_threads(self, threads: int) -> int:
+        """共享线程池的线程数由`PlProcPool.set_concurrency()`统一设定，这里只返回当前线程数"""
+        logger.warning("共享线程池的客户端不能单独设定线程数，请使用`SetPoolConcurrency()`")
+        return self.get_threads()
+    def close(self):
+        """释放客户端及对线程池的引用。调用者需保证没有正在进行的计算"""
+        if not self.closed:
+            if self.client is not None:
+                PlProcCore.DeleteThreadPoolClient(self.ctx, self.client)
+                self.client = None
+            self.closed = True
+            self.pool.release()
+    def __del__(self):
+        self.close()
+
+class PlProcPool:
+    """进程内所有管线共用的线程池，按引用计数管理。  
+    第一个客户端获取时创建线程，最后一个客户端释放时才结束线程，关闭一个标签页不会影响其他标签页。"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ctx: ThreadPoolCtxPtr | None = None
+        self.refs = 0
+        self.concurrency = 0
+        """全局并发上限，即线程池的线程数。0表示使用`threads`"""
+    def _threads(self) -> int:
+        return self.concurrency if self.concurrency > 0 else max(threads, 1)
+    def acquire(self) -> PlProcClient:
+        """获取一个客户端，引用计数+1"""
+        with self.lock:
+            if self.ctx is None:
+                self.ctx = PlProcCore.NewThreadPoolCtx()
+                real_threads = PlProcCore.InitThreadPool(self.ctx, self._threads())
+                if CORE_HAS_PROFILING:
+                    PlProcCore.ThreadPoolSetProfiling(self.ctx, profiler.enabled)
+                logger.info(f"创建共享线程池，{real_threads} 线程")
+            self.refs += 1
+            return PlProcClient(self, self.ctx)
+    def release(self):
+        """引用计数-1。由`PlProcClient.close()`调用"""
+        with self.lock:
+            self.refs -= 1
+            if self.refs == 0 and self.ctx is not None:
+                PlProcCore.DeleteThreadPoolCtx(self.ctx)
+                self.ctx = None
+                logger.info("共享线程池已结束")
+    def set_concurrency(self, n: int) -> int:
+        """设定全局并发上限(线程池的线程数)。0表示使用`threads`。  
+        若线程池已在运行，会立即重建线程，此时不应有正在进行的计算。返回实际线程数"""
+        with self.lock:
+            self.concurrency = n
+            if self.ctx is None:
+                return self._threads()
+            return PlProcCore.InitThreadPool(self.ctx, self._threads())
+    def get_threads(self) -> int:
+        with self.lock:
+            if self.ctx is None:
+                return self._threads()
+            return PlProcCore.ThreadPoolGetThreads(self.ctx)
+
+shared_pool = PlProcPool()
+"""全局共享线程池"""
+
+def _shared_pool_after_fork():
+    # fork出的子进程中没有线程池的线程，旧的ctx不能使用也不能删除(删除时会join不存在的线程)，直接丢弃
+    shared_pool.lock = threading.Lock()
+    shared_pool.ctx = None
+    shared_pool.refs = 0
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_shared_pool_after_fork)
+
+def SetPoolConcurrency(n: int) -> int:
+    """设定共享线程池的全局并发上限，见`PlProcPool.set_concurrency()`"""
+    return shared_pool.set_concurrency(n)
+
 
 threads = 0
 
@@ -462,6 +987,40 @@ def SetParallelThreads(thrs: int) -> int:
     threads = thrs
     return threads
 
+class SCHED_MODES:
+    """多线程调度方式enum"""
+    SCHED_STATIC = 0
+    """静态划分：每个线程处理固定的一段(f1)"""
+    SCHED_STEALING = 1
+    """工作窃取：切成小块动态分配(f1r)。扩展未提供f1r时退回静态划分"""
+
+sched_mode = SCHED_MODES.SCHED_STEALING
+
+def SetScheduleMode(mode: int) -> int:
+    """设置多线程调度方式，见SCHED_MODES"""
+    global sched_mode
+    sched_mode = mode
+    return sched_mode
+
+native_plan = True
+
+def SetNativePlan(enable: bool) -> bool:
+    """设置执行计划是否整条在C中执行(见`ExecPlan.run()`)。关闭时逐步从Python调用，便于调试"""
+    global native_plan
+    native_plan = enable
+    return native_plan
+
+FUSED_TILE_BYTES = 256 * 1024
+"""融合执行时每块的大致字节数。应能放进L2缓存"""
+
+pre_fusion = True
+
+def SetPreFusion(enable: bool) -> bool:
+    """设置是否融合执行连续的逐像素预处理(ATTR_POINTWISE)"""
+    global pre_fusion
+    pre_fusion = enable
+    return pre_fusion
+
 
 IMG_SHAPE_T = 0
 IMG_SHAPE_H = 1
@@ -474,15 +1033,51 @@ class PRE_ATTRS:
     """能够复用输入缓冲区。若指定定了该参数，in_buf和out_buf可能指向同一块内存。"""
     ATTR_READONLY = 2
     """只读取，不输出(REUSE的进阶)。若指定了该参数，out_buf一定为NULL。"""
+    ATTR_POINTWISE = 3
+    """逐像素(REUSE的进阶)。每个输出像素只取决于同一位置的输入像素，且输出形状与输入相同。  
+    若扩展还提供了f1r，连续的逐像素预处理会被融合执行：按块依次经过所有步骤，中间结果留在缓存中。其余同REUSE。"""
 
 class PRE_PIPE_MODES:
     """预处理链模式enum"""
     PIPE_MODE_DEFAULT = 0 
     """平衡性能和内存使用"""
     PIPE_MODE_SPEED = 1
-    """优先性能。这会独立创建每个预处理单元的输出"""
+    """优先性能。这会独立创建每个预处理单元的输出。只有这个模式支持局部重算(见`Img2arrPIPE.Pre()`的dirty)"""
     PIPE_MODE_MEMORY = 2
-    """优先内存使用。完全动态的创建和销毁输出，会产生内存创建和销毁的开销"""
+    """优先内存使用。每次刷新完成后都归还中间缓冲区，下一次刷新需从头计算"""
+
+class PRE_OUT:
+    """预处理一步的输出位置enum，见`pre_buffer_plan()`"""
+    OUT_NEW = 0
+    """新的中间缓冲区"""
+    OUT_IN = 1
+    """原地写入输入缓冲区"""
+    OUT_NONE = 2
+    """没有输出(只读扩展)，下一步的输入仍是这一步的输入"""
+    OUT_PRE = 3
+    """最后一步，写入pre"""
+    OUT_PRE_COPY = 4
+    """最后一步是只读扩展，没有输出，由调用者将输入复制到pre"""
+
+def pre_buffer_plan(out_attr: int, is_head: bool, is_tail: bool, mode: int) -> tuple[bool, int]:
+    """预处理一步使用哪些缓冲区，`Pre_iter`与`ExecPlan`共用。返回(输入是否为原图的副本, 输出位置PRE_OUT.*)  
+    链首的只读扩展读取原图的副本；ATTR_REUSE/ATTR_POINTWISE在链首之后原地写入输入缓冲区，
+    但性能模式下每一步都有自己的输出缓冲区(见`PRE_PIPE_MODES`)"""
+    head_copy = is_head and out_attr == PRE_ATTRS.ATTR_READONLY
+    if is_tail:
+        out = PRE_OUT.OUT_PRE_COPY if out_attr == PRE_ATTRS.ATTR_READONLY else PRE_OUT.OUT_PRE
+    elif out_attr in (PRE_ATTRS.ATTR_REUSE, PRE_ATTRS.ATTR_POINTWISE) and not is_head:
+        out = PRE_OUT.OUT_NEW if mode == PRE_PIPE_MODES.PIPE_MODE_SPEED else PRE_OUT.OUT_IN
+    elif out_attr == PRE_ATTRS.ATTR_READONLY:
+        out = PRE_OUT.OUT_NONE
+    else:
+        out = PRE_OUT.OUT_NEW
+    return head_copy, out
+
+def pre_fusable(dll: ctypes.CDLL | None, out_attr: int, in_shape: Sequence[int], out_shape: Sequence[int]) -> bool:
+    """这一步能否与相邻的逐像素步骤融合执行，见`PRE_ATTRS.ATTR_POINTWISE`"""
+    return (pre_fusion and CORE_HAS_FUSED and dll is not None and out_attr == PRE_ATTRS.ATTR_POINTWISE
+            and hasattr(dll, "f1r") and len(in_shape) > 0 and tuple(out_shape) == tuple(in_shape))
 
 class PIPENodeResult:
     """返回值"""
@@ -494,88 +1089,1060 @@ class PIPENodeResult:
     """总返回值"""
     ret: int
 
+PROFILE_EVENTS_LIMIT = 1 << 20
+"""性能剖析最多保留的事件数，超出时丢弃最早的"""
+
+PROFILE_WORKER_TID = 1 << 40
+"""Chrome trace中线程池线程的tid起点，与Python线程的tid区分"""
+
+class ProfileSpan:
+    """一段计时，由`Profiler.span()`创建，用作上下文管理器。  
+    args会写入事件，可以在计时期间补充。未启用性能剖析时profiler为None，不计时"""
+    __slots__ = ("profiler", "name", "cat", "args", "start")
+    def __init__(self, profiler: "Profiler | None", name: str, cat: str, args: dict[str, Any]):
+        self.profiler = profiler
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0
+    def __enter__(self) -> "ProfileSpan":
+        if self.profiler is not None:
+            self.start = time.perf_counter_ns()
+        return self
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if self.profiler is not None:
+            end = time.perf_counter_ns()
+            if exc_type is not None:
+                self.args["error"] = exc_type.__name__
+            self.profiler.add(self.name, self.cat, self.start, end, self.args)
+        return False
+
+class Profiler:
+    """性能剖析，所有管线共用。  
+    启用后记录管线各环节(预处理的每一步、编码预览、编码、输出)与每次扩展调用的耗时和输入/输出字节数，
+    线程池中每个任务的耗时(任务间的差异即负载不均衡)，以及中间缓冲区的分配。  
+    事件按Chrome trace格式保存，可以用`summary()`汇总，或用`export_chrome_trace()`导出后在Perfetto/chrome://tracing中查看。  
+    事件类别(cat)：pre 预处理的一步；code/out 编码预览、编码与输出；ext 一次扩展调用(融合执行时为一组)；
+    task 线程池中的一个任务；alloc 从`buffer_pool`申请内存块"""
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.events: deque[dict[str, Any]] = deque(maxlen=PROFILE_EVENTS_LIMIT)
+        self.thread_names: dict[int, str] = {}
+        self.offset_ns = 0
+        """perf_counter_ns()与PlProcNowNs()之差，用于对齐线程池记录的时间"""
+        self.task_buf = (PlProcTaskTime * 4096)()
+    def set_enabled(self, enable: bool):
+        if CORE_HAS_PROFILING:
+            self.offset_ns = time.perf_counter_ns() - PlProcCore.PlProcNowNs()
+        self.enabled = enable
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.thread_names.clear()
+    def span(self, name: str, cat: str, **args) -> ProfileSpan:
+        """计时一段代码。未启用时返回不计时的ProfileSpan"""
+        return ProfileSpan(self if self.enabled else None, name, cat, args)
+    def add(self, name: str, cat: str, start_ns: int, end_ns: int, args: dict[str, Any], tid: int | None = None):
+        """添加一个完整事件。时间为perf_counter_ns()"""
+        if tid is None:
+            tid = threading.get_ident()
+            if tid not in self.thread_names:
+                self.thread_names[tid] = threading.current_thread().name
+        self.events.append({"name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": tid,
+                            "ts": start_ns / 1000, "dur": (end_ns - start_ns) / 1000, "args": args})
+    def counter(self, name: str, **values: int):
+        """添加一个计数器事件"""
+        if self.enabled:
+            self.events.append({"name": name, "ph": "C", "pid": os.getpid(), "ts": time.perf_counter_ns() / 1000, "args": values})
+    def collect_tasks(self, ctx: ThreadPoolCtxPtr, caller: str | None = None) -> dict[str, Any]:
+        """取走线程池中的任务耗时记录，加入事件。  
+        caller: 若指定，返回最近一个名为caller的作业的任务统计：任务数、最长/平均任务耗时(毫秒)，
+        以及不均衡度(各阶段中最长任务与平均任务耗时之比的最大值，1表示完全均衡)"""
+        tasks: dict[int, dict[int, list[int]]] = {}
+        pid = os.getpid()
+        # 线程池只保存名称的前31字节
+        key = caller.encode("utf-8")[:31] if caller is not None else None
+        while CORE_HAS_PROFILING:
+            n = PlProcCore.ThreadPoolTakeTaskTimes(ctx, self.task_buf, len(self.task_buf))
+            for rec in islice(self.task_buf, n):
+                raw = rec.caller
+                name = raw.decode("utf-8", "replace")
+                tid = PROFILE_WORKER_TID + rec.worker
+                if tid not in self.thread_names:
+                    self.thread_names[tid] = f"PlProc worker {rec.worker}"
+                dur = rec.end_ns - rec.start_ns
+                self.events.append({"name": name, "cat": "task", "ph": "X", "pid": pid, "tid": tid,
+                                    "ts": (rec.start_ns + self.offset_ns) / 1000, "dur": dur / 1000,
+                                    "args": {"job": rec.job, "phase": rec.phase, "idx": rec.idx}})
+                if raw == key:
+                    tasks.setdefault(rec.job, {}).setdefault(rec.phase, []).append(dur)
+            if n < len(self.task_buf):
+                break
+        if not tasks:
+            return {}
+        phases = tasks[max(tasks)]
+        durs = [dur for phase in phases.values() for dur in phase]
+        return {"tasks": len(durs), "task_max_ms": max(durs) / 1e6, "task_mean_ms": sum(durs) / len(durs) / 1e6,
+                "imbalance": max(max(phase) * len(phase) / max(sum(phase), 1) for phase in phases.values())}
+    def summary(self) -> dict[str, dict[str, Any]]:
+        """按"类别/名称"汇总完整事件：次数、总耗时与最长耗时(毫秒)、输入/输出字节数，
+        以及扩展调用的最大不均衡度、内存块申请中新分配的次数"""
+        result: dict[str, dict[str, Any]] = {}
+        for event in list(self.events):
+            if event["ph"] != "X" or event["cat"] == "task":
+                continue
+            args = event["args"]
+            item = result.setdefault(f"{event['cat']}/{event['name']}", {
+                "count": 0, "total_ms": 0.0, "max_ms": 0.0, "bytes_in": 0, "bytes_out": 0, "imbalance": 0.0, "allocs": 0})
+            item["count"] += 1
+            item["total_ms"] += event["dur"] / 1000
+            item["max_ms"] = max(item["max_ms"], event["dur"] / 1000)
+            item["bytes_in"] += args.get("bytes_in", 0)
+            item["bytes_out"] += args.get("bytes_out", 0)
+            item["imbalance"] = max(item["imbalance"], args.get("imbalance", 0.0))
+            if event["cat"] == "alloc" and not args.get("reused", True):
+                item["allocs"] += 1
+        return result
+    def report(self) -> str:
+        """summary()的文本表格，按总耗时排序"""
+        lines = [f"{'类别/名称':<40}{'次数':>8}{'总耗时(ms)':>14}{'最长(ms)':>12}{'吞吐(MB/s)':>14}{'不均衡':>8}"]
+        for key, item in sorted(self.summary().items(), key=lambda kv: -kv[1]["total_ms"]):
+            bytes_io = item["bytes_in"] + item["bytes_out"]
+            throughput = bytes_io / 1e3 / item["total_ms"] if item["total_ms"] > 0 and bytes_io > 0 else 0.0
+            imbalance = f"{item['imbalance']:.2f}" if item["imbalance"] > 0 else "-"
+            lines.append(f"{key:<40}{item['count']:>8}{item['total_ms']:>14.2f}{item['max_ms']:>12.2f}{throughput:>14.1f}{imbalance:>8}")
+        return "\n".join(lines)
+    def export_chrome_trace(self, path: str):
+        """导出为Chrome trace(JSON)"""
+        pid = os.getpid()
+        meta = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                for tid, name in list(self.thread_names.items())]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": meta + list(self.events), "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+profiler = Profiler()
+"""全局性能剖析器"""
+
+def SetProfiling(enable: bool) -> bool:
+    """启用/停用性能剖析，见`Profiler`。停用时不清除已记录的事件"""
+    profiler.set_enabled(enable)
+    with shared_pool.lock:
+        if shared_pool.ctx is not None and CORE_HAS_PROFILING:
+            PlProcCore.ThreadPoolSetProfiling(shared_pool.ctx, enable)
+            if not enable:
+                profiler.collect_tasks(shared_pool.ctx)
+    return profiler.enabled
+
+def ExportChromeTrace(path: str):
+    """导出性能剖析记录为Chrome trace(JSON)"""
+    profiler.export_chrome_trace(path)
+
+BUFFER_ALIGN = 64
+"""中间缓冲区的对齐字节数，满足AVX-512的对齐加载"""
+
+HUGEPAGE_SIZE = 2 * 1024 * 1024
+HUGEPAGE_THRESHOLD = 4 * 1024 * 1024
+"""不小于此大小的数组使用透明大页(仅Linux)，减少大图的TLB缺失"""
+
+aligned_alloc = True
+hugepage_alloc = sys.platform.startswith("linux") and hasattr(mmap, "MADV_HUGEPAGE")
+
+def SetAlignedAlloc(enable: bool, hugepage: bool | None = None) -> tuple[bool, bool]:
+    """设置管线数组的分配方式。enable: 按BUFFER_ALIGN对齐；hugepage: 大数组使用透明大页(不支持的平台上总是False)。
+    只影响之后分配的数组。返回(enable, hugepage)"""
+    global aligned_alloc, hugepage_alloc
+    aligned_alloc = enable
+    if hugepage is not None:
+        hugepage_alloc = hugepage and sys.platform.startswith("linux") and hasattr(mmap, "MADV_HUGEPAGE")
+    return aligned_alloc, hugepage_alloc
+
+def aligned_empty(shape: int | Sequence[int], dtype: Any = numpy.uint8) -> NDArray:
+    """分配管线用的数组。对齐到BUFFER_ALIGN，大数组在Linux上对齐到大页并建议内核使用透明大页"""
+    dtype = numpy.dtype(dtype)
+    nbytes = int(numpy.prod(shape, dtype=numpy.int64)) * dtype.itemsize
+    if not aligned_alloc or nbytes == 0:
+        return numpy.empty(shape, dtype=dtype)
+    if hugepage_alloc and nbytes >= HUGEPAGE_THRESHOLD:
+        size = (nbytes + HUGEPAGE_SIZE - 1) // HUGEPAGE_SIZE * HUGEPAGE_SIZE
+        # 匿名映射只保证按页对齐，多映射一个大页以便对齐到大页边界。数组释放时映射随之释放
+        # 必须是私有映射，共享的匿名映射属于shmem，不受madvise控制
+        mm = mmap.mmap(-1, size + HUGEPAGE_SIZE, flags=mmap.MAP_PRIVATE)
+        raw = numpy.frombuffer(mm, dtype=numpy.uint8)
+        offset = -raw.ctypes.data % HUGEPAGE_SIZE
+        try:
+            mm.madvise(mmap.MADV_HUGEPAGE, offset, size)
+        except OSError:
+            pass # 内核未启用透明大页
+        return raw[offset:offset + nbytes].view(dtype).reshape(shape)
+    raw = numpy.empty(nbytes + BUFFER_ALIGN, dtype=numpy.uint8)
+    offset = -raw.ctypes.data % BUFFER_ALIGN
+    return raw[offset:offset + nbytes].view(dtype).reshape(shape)
+
+def aligned_resize(arr: NDArray, shape: Sequence[int]) -> NDArray:
+    """形状不同时重新分配(不保留内容)，否则返回arr"""
+    if arr.shape == tuple(shape):
+        return arr
+    return aligned_empty(shape, arr.dtype)
+
+def aligned_copy(arr: NDArray) -> NDArray:
+    """返回按BUFFER_ALIGN对齐的arr。arr已经对齐且连续时直接返回"""
+    if arr.flags.c_contiguous and (arr.ctypes.data % BUFFER_ALIGN == 0 or not aligned_alloc):
+        return arr
+    out = aligned_empty(arr.shape, arr.dtype)
+    numpy.copyto(out, arr)
+    return out
+
+BUFFER_POOL_BUDGET = 2 * 1024 * 1024 * 1024
+"""中间缓冲区池的默认内存预算(字节)"""
+
+class BufferPool:
+    """中间缓冲区分配器，所有管线共用。  
+    内存块按大小分级(每两倍之间分4级)，归还后留在空闲列表中，供之后相同级别的申请复用，避免反复申请大块内存。  
+    预算同时限制使用中与空闲的内存：超出时先释放空闲块；使用中的内存超出预算(`pressure()`)时，
+    管线刷新完成后会归还中间缓冲区，放弃增量刷新。
+    """
+    def __init__(self, budget: int = BUFFER_POOL_BUDGET):
+        self.budget = budget
+        self.free: dict[int, list[NDArray[numpy.uint8]]] = {}
+        self.used_bytes = 0
+        self.free_bytes = 0
+        self.reuses = 0
+        self.allocs = 0
+        self.lock = threading.Lock()
+    @staticmethod
+    def size_class(nbytes: int) -> int:
+        """nbytes所在级别的块大小"""
+        if nbytes <= 4096:
+            return 4096
+        step = 1 << (nbytes.bit_length() - 3)
+        return (nbytes + step - 1) // step * step
+    def acquire(self, nbytes: int) -> NDArray[numpy.uint8]:
+        """申请至少nbytes字节、按BUFFER_ALIGN对齐的一维uint8内存块"""
+        size = self.size_class(nbytes)
+        with profiler.span("alloc", "alloc", bytes=size, reused=True) as span:
+            with self.lock:
+                blocks = self.free.get(size)
+                if blocks:
+                    self.free_bytes -= size
+                    self.used_bytes += size
+                    self.reuses += 1
+                    block = blocks.pop()
+                else:
+                    self.used_bytes += size
+                    self.allocs += 1
+                    self._trim()
+                    block = None
+            if block is None:
+                span.args["reused"] = False
+                block = aligned_empty(size)
+        profiler.counter("buffer_pool", used=self.used_bytes, free=self.free_bytes)
+        return block
+    def release(self, block: NDArray[numpy.uint8]):
+        """归还内存块。调用者之后不能再使用它"""
+        size = block.size
+        with self.lock:
+            self.used_bytes -= size
+            if self.used_bytes + self.free_bytes + size <= self.budget:
+                self.free.setdefault(size, []).append(block)
+                self.free_bytes += size
+        profiler.counter("buffer_pool", used=self.used_bytes, free=self.free_bytes)
+    def _trim(self):
+        """释放空闲块，直到总量不超过预算。从最大的级别开始"""
+        for size in sorted(self.free, reverse=True):
+            blocks = self.free[size]
+            while blocks and self.used_bytes + self.free_bytes > self.budget:
+                blocks.pop()
+                self.free_bytes -= size
+            if not blocks:
+                del self.free[size]
+    def pressure(self) -> bool:
+        """使用中的内存是否超出预算"""
+        return self.used_bytes > self.budget
+    def set_budget(self, budget: int):
+        with self.lock:
+            self.budget = budget
+            self._trim()
+    def stats(self) -> dict[str, int]:
+        """使用中/空闲的字节数、空闲块数及复用次数"""
+        with self.lock:
+            return {"used": self.used_bytes, "free": self.free_bytes,
+                    "free_blocks": sum(len(blocks) for blocks in self.free.values()),
+                    "reuses": self.reuses, "allocs": self.allocs, "budget": self.budget}
+
+buffer_pool = BufferPool()
+"""所有管线共用的中间缓冲区池"""
+
+def SetBufferPoolBudget(budget: int) -> int:
+    """设置中间缓冲区池的内存预算(字节)"""
+    buffer_pool.set_budget(budget)
+    return buffer_pool.budget
+
 class MidBuffer:
-    def __init__(self, arr: NDArray):
+    def __init__(self, arr: NDArray, block: NDArray[numpy.uint8] | None = None):
         self.arr = arr
+        self.block = block
+        """arr所在的内存块，来自`buffer_pool`。None表示arr不是从池中申请的"""
         self.arrptr: ctypes._Pointer
         self.readers: list[int] = []
         self.writers: list[int] = []
+        self.valid_step: int | None = None
+        """最近一次完整写入该缓冲区的预处理索引，即缓冲区中是哪一步的结果。None表示内容无效。  
+        局部重算时，只有缓冲区中还是这一步上次的结果，才能只重算变化的部分"""
         self.update_ptr()
+    @classmethod
+    def pooled(cls, shape: Sequence[int]) -> "MidBuffer":
+        """从`buffer_pool`申请一个缓冲区"""
+        n = int(numpy.prod(shape, dtype=numpy.int64))
+        block = buffer_pool.acquire(n)
+        return cls(block[:n].reshape(shape), block)
     def update_ptr(self):
         self.arrptr = self.arr.ctypes.data_as(ctypes.POINTER(ctypes.c_uint8))
     def resize(self, shape: Sequence[int], refcheck=False):
-        self.arr.resize(shape, refcheck=refcheck)
+        if self.block is None:
+            self.arr.resize(shape, refcheck=refcheck)
+        else:
+            n = int(numpy.prod(shape, dtype=numpy.int64))
+            # 内存块够用且不会浪费一半以上时，直接复用
+            if n > self.block.size or n * 2 < self.block.size:
+                buffer_pool.release(self.block)
+                self.block = buffer_pool.acquire(n)
+            self.arr = self.block[:n].reshape(shape)
+        self.valid_step = None
         self.update_ptr()
-
-def call_processor(plproc: PlProc, tasks: int, name: str, dll: ctypes.CDLL, args: ExtensionPyABC.CPointerArgType, in_buf: MidBuffer, out_buf: MidBuffer | None, is_code_view: bool = False):
-    """调用处理"""
-    # 获取指针
-    inbuf_ptr = in_buf.arrptr
-    if out_buf is None:
-        outbuf_ptr = ctypes.cast(0, ctypes.POINTER(ctypes.c_uint8))
-    else: 
-        outbuf_ptr = out_buf.arrptr
-    # 获取输入的shape
-    # 修复：正确处理一维和多维数组的形状
-    if len(in_buf.arr.shape) == 1:
-        # 一维数组：形状就是数组长度
-        in_shape = in_buf.arr.shape
-    else:
-        # 多维数组：去掉最后一个维度（通常是通道维度）
-        in_shape = in_buf.arr.shape[:-1]
+    def release(self):
+        """将内存块归还`buffer_pool`。之后不能再使用该缓冲区"""
+        if self.block is not None:
+            buffer_pool.release(self.block)
+            self.block = None
+            self.arr = numpy.empty((0,), dtype=numpy.uint8)
+            self.valid_step = None
+            self.update_ptr()
+    def __del__(self):
+        self.release()
+
+Region: TypeAlias = tuple[int, int, int, int]
+"""图像中的矩形区域[y0, x0, y1, x1)"""
+
+def region_clip(region: Sequence[int], shape: Sequence[int]) -> Region:
+    """将区域限制在形状为shape(高, 宽)的图像内"""
+    y0, x0, y1, x1 = region
+    h, w = shape[0], shape[1]
+    return (min(max(y0, 0), h), min(max(x0, 0), w), min(max(y1, 0), h), min(max(x1, 0), w))
+
+PRE_CACHE_BUDGET = 256 * 1024 * 1024
+"""预处理结果缓存的默认内存预算(字节)"""
+
+class PreCache:
+    """预处理结果缓存(LRU)。  
+    键由输入的键、扩展名与参数字节串逐步哈希得到(见`pre_cache_key()`)，相同的输入经过相同参数的步骤，结果一定相同。
+    关闭再打开某一步、撤销参数修改时，直接复制之前的结果，不再计算。  
+    参数中的指针字段不参与计算键，与批处理的约定相同：依赖指针内容的扩展(提供了batch_update)不缓存。
+    """
+    def __init__(self, budget: int = PRE_CACHE_BUDGET):
+        self.budget = budget
+        """内存预算(字节)。0表示不缓存"""
+        self.entries: OrderedDict[bytes, NDArray[numpy.uint8]] = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    def get(self, key: bytes) -> NDArray[numpy.uint8] | None:
+        """查找结果。返回的数组只读，不要修改"""
+        with self.lock:
+            arr = self.entries.get(key)
+            if arr is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return arr
+    def put(self, key: bytes, arr: NDArray[numpy.uint8]):
+        """保存结果的副本。超出预算时淘汰最久未使用的结果"""
+        if arr.nbytes > self.budget:
+            return
+        copy = arr.copy()
+        copy.flags.writeable = False
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.entries[key] = copy
+            self.nbytes += copy.nbytes
+            self._evict()
+    def _evict(self):
+        while self.nbytes > self.budget and self.entries:
+            _, arr = self.entries.popitem(last=False)
+            self.nbytes -= arr.nbytes
+    def set_budget(self, budget: int):
+        with self.lock:
+            self.budget = budget
+            self._evict()
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+    def stats(self) -> dict[str, int]:
+        """命中/未命中次数、条目数及占用内存，用于调整预算"""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries),
+                    "nbytes": self.nbytes, "budget": self.budget}
+
+pre_cache = PreCache()
+"""所有管线共用的预处理结果缓存"""
+
+def SetPreCacheBudget(budget: int) -> int:
+    """设置预处理结果缓存的内存预算(字节)。0表示不缓存"""
+    pre_cache.set_budget(budget)
+    return pre_cache.budget
+
+_img_generation = count()
+
+def new_img_key() -> bytes:
+    """为新的原图分配一个键。原图内容不做哈希(太慢)，每次更换或修改原图都分配新的键"""
+    return b"img:%d" % next(_img_generation)
+
+def pre_cache_key(in_key: bytes, name: str, args: bytes) -> bytes:
+    """预处理步骤输出的键"""
+    h = hashlib.blake2b(in_key, digest_size=16)
+    h.update(name.encode("utf-8"))
+    h.update(b"\0")
+    h.update(args)
+    return h.digest()
+
+def downsample2(img: NDArray[numpy.uint8]) -> NDArray[numpy.uint8]:
+    """2x2平均，缩小为一半。奇数尺寸时舍去最后一行/列"""
+    h, w = img.shape[0] // 2, img.shape[1] // 2
+    out = aligned_empty((h, w, *img.shape[2:]))
+    # 分块计算，避免整张图的uint16临时数组
+    step = max(1, (4 << 20) // max(1, out[0].nbytes * 2))
+    for y in range(0, h, step):
+        src = img[2 * y:2 * min(h, y + step)]
+        acc = src[0::2, 0:2 * w:2].astype(numpy.uint16)
+        acc += src[0::2, 1:2 * w:2]
+        acc += src[1::2, 0:2 * w:2]
+        acc += src[1::2, 1:2 * w:2]
+        acc += 2
+        acc >>= 2
+        out[y:y + acc.shape[0]] = acc
+    return out
+
+def release_bufs(bufs: list[MidBuffer], start: int = 0):
+    """归还并移除bufs[start:]"""
+    for buf in islice(bufs, start, None):
+        buf.release()
+    del bufs[start:]
+
+def region_empty(region: Region) -> bool:
+    return region[0] >= region[2] or region[1] >= region[3]
+
+def map_region(dll: ctypes.CDLL | None, args: ExtensionPyABC.CPointerArgType, in_shape: Sequence[int], out_shape: Sequence[int], attr: int, region: Region) -> Region | None:
+    """输入中的区域region变化时，输出中受影响的区域。None表示未知(整张图)。  
+    扩展提供了io_GetOutRegion时使用它；逐像素与只读扩展、空扩展(dll为None)的区域不变；其余未知"""
+    if dll is not None and hasattr(dll, "io_GetOutRegion"):
         in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
-    in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
-    result = PIPENodeResult()
-    if not is_code_view:
-        f1_name = "f1"
-        f1_func = dll.f1 if hasattr(dll, "f1") else None
-        f0_name = "f0"
-        f0_func = dll.f0 if hasattr(dll, "f0") else None
-    else:
-        f1_name = "f1p"
-        f1_func = dll.f1p if hasattr(dll, "f1p") else None
-        f0_name = "f0p"
-        f0_func = dll.f0p if hasattr(dll, "f0p") else None
-    # 如果有多核，优先使用多核
-    if hasattr(dll, f1_name):
-        # logger.debug("Multi Core")
-        # 准备返回值列表，默认值全是0
-        ret_list = numpy.zeros(tasks if tasks > 0 else plproc.get_threads(), dtype=numpy.intc)
-        # 多核
-        # ret = PlProcCore.MultiCore(bytes(name, "utf-8"), f1_func, args, ret_list.ctypes.data_as(ctypes.POINTER(ctypes.c_int)), 
-        #                            inbuf_ptr, outbuf_ptr, in_shape_ct)
-        ret = plproc.f1(
-            bytes(name, "utf-8"), f1_func, args, ret_list.ctypes.data_as(ctypes.POINTER(ctypes.c_int)), 
-            inbuf_ptr, outbuf_ptr, in_shape_ct,
-            tasks # 使用线程数
-        )
-        result.proc_mode = EXT_PATH_MULTICORE
-        result.results = ret_list
+        in_region = (ctypes.c_size_t * 4)(*region)
+        out_region = (ctypes.c_size_t * 4)()
+        if dll.io_GetOutRegion(args, in_shape_ct, in_region, out_region) != 0:
+            return None
+        return region_clip(tuple(out_region), out_shape)
+    if dll is None or attr in (PRE_ATTRS.ATTR_POINTWISE, PRE_ATTRS.ATTR_READONLY):
+        return region_clip(region, out_shape)
+    return None
+
+def get_f1r_phases(dll: ctypes.CDLL) -> int:
+    """f1r的阶段数。扩展未导出img2arr_f1r_phases时为1"""
+    try:
+        return ctypes.c_size_t.in_dll(dll, "img2arr_f1r_phases").value
+    except ValueError:
+        return 1
+
+def arg_address(arg: ExtensionPyABC.CPointerArgType) -> int | None:
+    """获取参数指针指向的地址"""
+    obj = getattr(arg, "_obj", None) # byref()的返回值
+    if obj is not None:
+        return ctypes.addressof(obj)
+    if isinstance(arg, ctypes.c_void_p):
+        return arg.value
+    if isinstance(arg, ctypes._Pointer):
+        return ctypes.cast(arg, ctypes.c_void_p).value
+    return ctypes.addressof(arg)
+
+def io_bytes(in_buf: MidBuffer, out_buf: MidBuffer | None, rows: tuple[int, int] | None = None) -> dict[str, int]:
+    """一次调用读写的字节数(性能剖析用)。只计算一部分行时按比例估计"""
+    bytes_in = in_buf.arr.nbytes
+    bytes_out = out_buf.arr.nbytes if out_buf is not None else 0
+    if rows is not None and out_buf is not None and out_buf.arr.ndim > 1 and out_buf.arr.shape[0] > 0:
+        frac = max(rows[1] - rows[0], 0) / out_buf.arr.shape[0]
+        bytes_in = int(bytes_in * frac)
+        bytes_out = int(bytes_out * frac)
+    return {"bytes_in": bytes_in, "bytes_out": bytes_out}
+
+def select_path(dll: ctypes.CDLL, in_shape: Sequence[int], is_code_view: bool = False, rows: tuple[int, int] | None = None) -> int:
+    """选择调用扩展的方式，返回EXT_PATH_*  
+    有区间版本f1r且启用了工作窃取时优先使用它，只计算一部分(rows)时必须使用它；否则优先多核，最后单核"""
+    if not is_code_view and (sched_mode == SCHED_MODES.SCHED_STEALING or rows is not None) and hasattr(dll, "f1r") and CORE_HAS_RANGE and len(in_shape) > 0:
+        return EXT_PATH_MULTICORE_RANGE
+    if hasattr(dll, "f1p" if is_code_view else "f1"):
+        return EXT_PATH_MULTICORE
+    if rows is not None:
+        raise AttributeError("Cannot compute part of the output without f1r in ext")
+    if hasattr(dll, "f0p" if is_code_view else "f0"):
+        return EXT_PATH_SINGLECORE
+    raise AttributeError("Cannot found process function(f1 or f0) in ext")
+
+def fused_grain(in_shape: Sequence[int], threads: int, begin: int, end: int) -> int:
+    """融合执行时一块的行数。块太大放不进缓存，但也要保证每个线程能分到几块"""
+    row_bytes = max(1, int(numpy.prod(in_shape[1:], dtype=numpy.int64)) * 4)
+    return max(1, min(FUSED_TILE_BYTES // row_bytes, (end - begin) // max(1, threads * 4)))
+
+class PlanStep:
+    """执行计划中的一步，见`ExecPlan`。  
+    调用所需的ctypes对象在创建时准备好，可以反复执行；缓冲区的指针在执行时才从MidBuffer读取"""
+    name: str
+    rows: tuple[int, int] | None = None
+    def run(self, plproc: PlProc, scope: JobScope | None = None) -> PIPENodeResult | None:
+        """执行。scope同`call_processor()`。  
+        启用性能剖析时记录耗时、读写字节数与线程池中各任务的耗时，见`Profiler`"""
+        if not profiler.enabled:
+            return self._run(plproc, scope)
+        if CORE_HAS_PROFILING:
+            PlProcCore.ThreadPoolSetProfiling(plproc.ctx, 1)
+        with profiler.span(self.name, "ext", **self.io_bytes()) as span:
+            if self.rows is not None:
+                span.args["rows"] = list(self.rows)
+            result = self._run(plproc, scope)
+            if result is not None:
+                span.args["mode"] = result.proc_mode
+            span.args.update(profiler.collect_tasks(plproc.ctx, self.name))
+        return result
+    def _run(self, plproc: PlProc, scope: JobScope | None) -> PIPENodeResult | None:
+        raise NotImplementedError
+    def io_bytes(self) -> dict[str, int]:
+        raise NotImplementedError
+    def fill_native(self, native: PlProcPlanStep):
+        """填写`ClientRunPlan`使用的描述"""
+        raise NotImplementedError
+    def update_native(self, native: PlProcPlanStep):
+        """更新描述中可能变化的指针(参数与缓冲区)。每次执行前调用"""
+        raise NotImplementedError
+
+def result_code(result: PIPENodeResult | None) -> int:
+    """一次调用的返回码：调度失败时为调度的返回值，否则为各任务中第一个非0的返回值。与`ClientRunPlan`的rets相同"""
+    if result is None:
+        return 0
+    if result.ret != 0:
+        return result.ret
+    if isinstance(result.results, int):
+        return result.results
+    nonzero = numpy.flatnonzero(result.results)
+    return int(result.results[nonzero[0]]) if len(nonzero) > 0 else 0
+
+class ExtStep(PlanStep):
+    """一次扩展调用。参数变化但输出形状不变时，用`bind_args()`换上新的参数即可继续使用"""
+    def __init__(self, plproc: PlProc, tasks: int, name: str, dll: ctypes.CDLL, args: ExtensionPyABC.CPointerArgType, in_buf: MidBuffer, out_buf: MidBuffer | None, is_code_view: bool = False, rows: tuple[int, int] | None = None):
+        self.name = name
+        self.caller = bytes(name, "utf-8")
+        self.args = args
+        self.in_buf = in_buf
+        self.out_buf = out_buf
+        self.rows = rows
+        self.tasks = tasks
+        # 一维数组：形状就是数组长度；多维数组：去掉最后一个维度(通道)
+        in_shape = in_buf.arr.shape if in_buf.arr.ndim == 1 else in_buf.arr.shape[:-1]
+        self.in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
+        self.path = select_path(dll, in_shape, is_code_view, rows)
+        self.ret_main = ctypes.c_int(0)
+        self.ret_list = numpy.zeros(0, dtype=numpy.intc)
+        if self.path == EXT_PATH_MULTICORE_RANGE:
+            self.func = dll.f1r
+            self.phases = get_f1r_phases(dll)
+            self.begin, self.end = rows if rows is not None else (0, in_shape[0])
+            self.ret_list = numpy.zeros(plproc.get_threads(), dtype=numpy.intc)
+        elif self.path == EXT_PATH_MULTICORE:
+            self.func = dll.f1p if is_code_view else dll.f1
+            self.ret_list = numpy.zeros(tasks if tasks > 0 else plproc.get_threads(), dtype=numpy.intc)
+        else:
+            self.func = dll.f0p if is_code_view else dll.f0
+        if self.path == EXT_PATH_SINGLECORE:
+            self.ret_ptr = ctypes.pointer(self.ret_main)
+        else:
+            self.ret_ptr = self.ret_list.ctypes.data_as(ctypes.POINTER(ctypes.c_int))
+        self.func_addr = ctypes.cast(self.func, ctypes.c_void_p).value
+    def bind_args(self, args: ExtensionPyABC.CPointerArgType, index: int = 0):
+        """换上新的参数。调用者需保证输出形状不变。index只用于`FusedStep`"""
+        self.args = args
+    def io_bytes(self) -> dict[str, int]:
+        return io_bytes(self.in_buf, self.out_buf, self.rows)
+    def fill_native(self, native: PlProcPlanStep):
+        native.mode = self.path
+        native.caller = self.caller
+        native.func = self.func_addr
+        self.update_native(native)
+        native.in_shape = self.in_shape_ct
+        native.ret = self.ret_ptr
+        if self.path == EXT_PATH_MULTICORE_RANGE:
+            native.begin = self.begin
+            native.total = self.end
+            native.grain = 0
+            native.phases = self.phases
+        else:
+            native.tasks = self.tasks
+    def update_native(self, native: PlProcPlanStep):
+        native.args = arg_address(self.args)
+        native.in_buffer = self.in_buf.arrptr
+        native.out_buffer = self.out_buf.arrptr if self.out_buf is not None else None
+    def _run(self, plproc: PlProc, scope: JobScope | None) -> PIPENodeResult:
+        if scope is not None:
+            scope.check()
+        inbuf_ptr = self.in_buf.arrptr
+        if self.out_buf is None:
+            outbuf_ptr = ctypes.cast(0, ctypes.POINTER(ctypes.c_uint8))
+        else:
+            outbuf_ptr = self.out_buf.arrptr
+        result = PIPENodeResult()
+        result.proc_mode = self.path
+        if self.path == EXT_PATH_MULTICORE_RANGE:
+            f1r_args = (
+                self.caller, self.func, self.args, self.ret_ptr,
+                inbuf_ptr, outbuf_ptr, self.in_shape_ct,
+                self.end, 0, self.phases, self.begin
+            )
+            if scope is None:
+                ret = plproc.f1r(*f1r_args)
+            else:
+                ret = scope.run(plproc.submit_f1r(*f1r_args, keep=(self, self.in_buf, self.out_buf)))
+            result.results = self.ret_list
+        elif self.path == EXT_PATH_MULTICORE:
+            f1_args = (
+                self.caller, self.func, self.args, self.ret_ptr,
+                inbuf_ptr, outbuf_ptr, self.in_shape_ct,
+                self.tasks # 使用线程数
+            )
+            if scope is None:
+                ret = plproc.f1(*f1_args)
+            else:
+                ret = scope.run(plproc.submit_f1(*f1_args, keep=(self, self.in_buf, self.out_buf)))
+            result.results = self.ret_list
+        else:
+            ret = plproc.f0(
+                self.caller, self.func, self.args, self.ret_ptr,
+                inbuf_ptr, outbuf_ptr, self.in_shape_ct
+            )
+            result.results = self.ret_main.value
         result.ret = ret
-    # 否则，尝试单核
-    elif hasattr(dll, f0_name):
-        # logger.debug("Single Core")
-        ret_main = ctypes.c_int(0)
-        # ret = PlProcCore.SingleCore(bytes(name, "utf-8"), f0_func, args, ctypes.byref(ret_main), 
-        #                             inbuf_ptr, outbuf_ptr, in_shape_ct)
-        ret = plproc.f0(
-            bytes(name, "utf-8"), f0_func, args, ctypes.byref(ret_main), 
-            inbuf_ptr, outbuf_ptr, in_shape_ct
+        return result
+
+class FusedStep(PlanStep):
+    """融合执行的多个逐像素预处理，见`call_fused()`"""
+    def __init__(self, plproc: PlProc, stages: list[tuple[str, ctypes.CDLL, ExtensionPyABC.CPointerArgType, MidBuffer, MidBuffer]], rows: tuple[int, int] | None = None):
+        n = len(stages)
+        self.stages = stages
+        self.rows = rows
+        self.name = "+".join(stage[0] for stage in stages)
+        self.caller = bytes(self.name, "utf-8")
+        in_shape = stages[0][3].arr.shape[:-1]
+        self.in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
+        self.funcs = (ctypes.c_void_p * n)(*(ctypes.cast(dll.f1r, ctypes.c_void_p).value for _, dll, _, _, _ in stages))
+        self.args = (ctypes.c_void_p * n)(*(arg_address(arg) for _, _, arg, _, _ in stages))
+        self.phases = (ctypes.c_size_t * n)(*(get_f1r_phases(dll) for _, dll, _, _, _ in stages))
+        self.in_bufs = (ctypes.POINTER(ctypes.c_uint8) * n)()
+        self.out_bufs = (ctypes.POINTER(ctypes.c_uint8) * n)()
+        threads = plproc.get_threads()
+        self.begin, self.end = rows if rows is not None else (0, in_shape[0])
+        self.grain = fused_grain(in_shape, threads, self.begin, self.end)
+        self.ret_list = numpy.zeros(threads, dtype=numpy.intc)
+        self.ret_ptr = self.ret_list.ctypes.data_as(ctypes.POINTER(ctypes.c_int))
+    def bind_args(self, args: ExtensionPyABC.CPointerArgType, index: int = 0):
+        """换上第index步的新参数"""
+        name, dll, _, in_buf, out_buf = self.stages[index]
+        self.stages[index] = (name, dll, args, in_buf, out_buf)
+        self.args[index] = arg_address(args)
+    def io_bytes(self) -> dict[str, int]:
+        # 中间结果留在缓存中，只计算链首的读与链尾的写
+        return {**io_bytes(self.stages[0][3], self.stages[-1][4], self.rows), "stages": len(self.stages)}
+    def update_bufs(self):
+        for i, (_, _, _, in_buf, out_buf) in enumerate(self.stages):
+            self.in_bufs[i] = in_buf.arrptr
+            self.out_bufs[i] = out_buf.arrptr
+    def update_native(self, native: PlProcPlanStep):
+        # 指针数组本身不变，只更新其中的内容。参数由bind_args()更新
+        self.update_bufs()
+    def fill_native(self, native: PlProcPlanStep):
+        self.update_bufs()
+        native.mode = PLAN_STEP_FUSED
+        native.caller = self.caller
+        native.ret = self.ret_ptr
+        native.in_shape = self.in_shape_ct
+        native.begin = self.begin
+        native.total = self.end
+        native.grain = self.grain
+        native.stages = len(self.stages)
+        native.funcs = self.funcs
+        native.stage_args = self.args
+        native.stage_phases = self.phases
+        native.in_buffers = self.in_bufs
+        native.out_buffers = self.out_bufs
+    def _run(self, plproc: PlProc, scope: JobScope | None) -> PIPENodeResult:
+        if scope is not None:
+            scope.check()
+        self.update_bufs()
+        fused_args = (
+            self.caller, len(self.stages), self.funcs, self.args, self.phases, self.ret_ptr,
+            self.in_bufs, self.out_bufs, self.in_shape_ct,
+            self.end, self.grain, self.begin
         )
-        result.proc_mode = EXT_PATH_SINGLECORE
-        result.results = ret_main.value
+        if scope is None:
+            ret = plproc.fused(*fused_args)
+        else:
+            ret = scope.run(plproc.submit_fused(*fused_args, keep=(self,)))
+        result = PIPENodeResult()
+        result.proc_mode = EXT_PATH_MULTICORE_RANGE
+        result.results = self.ret_list
         result.ret = ret
-    # 如果都没有，抛出异常
-    else:
-        raise AttributeError("Cannot found process function(f1 or f0) in ext")
-    return result
+        return result
+
+class CopyStep(PlanStep):
+    """把输入复制到输出。用于空扩展，以及链首/链尾的只读扩展"""
+    def __init__(self, in_buf: MidBuffer, out_buf: MidBuffer):
+        self.name = "(复制)"
+        self.in_buf = in_buf
+        self.out_buf = out_buf
+    def run(self, plproc: PlProc, scope: JobScope | None = None) -> None:
+        if scope is not None:
+            scope.check()
+        numpy.copyto(self.out_buf.arr, self.in_buf.arr, "no")
+    def fill_native(self, native: PlProcPlanStep):
+        native.mode = PLAN_STEP_COPY
+        self.update_native(native)
+    def update_native(self, native: PlProcPlanStep):
+        assert self.out_buf.arr.shape == self.in_buf.arr.shape, "复制的输入输出形状不同"
+        native.in_buffer = self.in_buf.arrptr
+        native.out_buffer = self.out_buf.arrptr
+        native.bytes = self.in_buf.arr.nbytes
+
+def call_processor(plproc: PlProc, tasks: int, name: str, dll: ctypes.CDLL, args: ExtensionPyABC.CPointerArgType, in_buf: MidBuffer, out_buf: MidBuffer | None, is_code_view: bool = False, scope: JobScope | None = None, rows: tuple[int, int] | None = None) -> PIPENodeResult:
+    """调用处理  
+    scope: 若指定，多核计算以异步作业提交并登记到scope，可以从其他线程通过`scope.cancel()`取消，被取消时抛出`JobCancelled`  
+    rows: 若指定，只计算输出的[rows[0], rows[1])行。要求扩展提供f1r  
+    启用性能剖析时记录耗时、读写字节数与线程池中各任务的耗时，见`Profiler`  
+    需要反复调用时，可以创建`ExtStep`并多次执行
+    """
+    if scope is not None:
+        scope.check()
+    return ExtStep(plproc, tasks, name, dll, args, in_buf, out_buf, is_code_view, rows).run(plproc, scope)
+
+def call_fused(plproc: PlProc, stages: list[tuple[str, ctypes.CDLL, ExtensionPyABC.CPointerArgType, MidBuffer, MidBuffer]], scope: JobScope | None = None, rows: tuple[int, int] | None = None) -> PIPENodeResult:
+    """融合调用多个逐像素预处理。stages的每一项为(名称, 扩展, 参数, 输入缓冲区, 输出缓冲区)，形状都相同。  
+    图片按行切成约`FUSED_TILE_BYTES`大小的块，每块依次经过所有步骤。  
+    scope, rows: 同`call_processor()`
+    """
+    if scope is not None:
+        scope.check()
+    return FusedStep(plproc, stages, rows).run(plproc, scope)
+
+def get_out_info(dll: ctypes.CDLL, args: ExtensionPyABC.CPointerArgType, in_shape: Sequence[int], out_ndim: int) -> tuple[tuple[int, ...], int]:
+    """调用io_GetOutInfo协商输出形状，返回(输出形状, 属性)。in_shape原样传给扩展"""
+    if not hasattr(dll, "io_GetOutInfo"):
+        raise AttributeError("Cannot found function \"int io_GetOutInfo(void* args, size_t* in_shape, size_t* out_shape, int* attr)\" in ext")
+    in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
+    out_shape_ct = (ctypes.c_size_t * out_ndim)()
+    attr = ctypes.c_int(0)
+    ret = dll.io_GetOutInfo(args, in_shape_ct, out_shape_ct, ctypes.byref(attr))
+    if ret != 0:
+        raise RuntimeError(f"io_GetOutInfo返回错误码{ret}")
+    return tuple(out_shape_ct), attr.value
+
+def args_raw(args: ExtensionPyABC.CPointerArgType, arglen: int) -> bytes:
+    """参数结构体的原始内容(包括指针字段)，用于判断参数是否变化"""
+    if arglen <= 0:
+        return b""
+    return ctypes.string_at(arg_address(args), arglen)
+
+class PlanEntry:
+    """执行计划中处理链的一项"""
+    def __init__(self, stage: int, name: str, dll: ctypes.CDLL | None, args: ExtensionPyABC.CPointerArgType, in_buf: MidBuffer, in_shape: tuple[int, ...], out_info: tuple[tuple[int, ...], int]):
+        self.stage = stage
+        self.name = name
+        self.dll = dll
+        self.args = args
+        self.in_buf = in_buf
+        """这一项的输入"""
+        self.in_shape = in_shape
+        """协商时传给io_GetOutInfo的输入形状"""
+        self.out_info = out_info
+        """协商的结果(输出形状, 属性)"""
+        self.binds: list[tuple[ExtStep | FusedStep, int]] = []
+        """使用这一项参数的步骤，以及这一项在其中的位置"""
+
+class ExecPlan:
+    """执行计划：处理链(预处理、编码、输出)编译成的一串调用，由`Img2arrPIPE.Plan()`创建。  
+    编译时完成形状协商(io_GetOutInfo)、缓冲区分配与融合分组，之后对同样形状的输入和同样的参数反复执行，
+    不再协商形状，也不再创建ctypes数组与MidBuffer。预处理按平衡模式(PIPE_MODE_DEFAULT)使用缓冲区，
+    结果写入管线的pre、code_out与out。  
+    各项用`extend()`按顺序编译。参数依赖输入内容的项(提供了batch_update的扩展)要等前面的项执行后才能生成参数，
+    此时分段进行：`extend()`一段，`run()`这一段，再生成下一段的参数。
+    """
+    def __init__(self, pipe: "Img2arrPIPE", key: Hashable, prep_count: int):
+        self.key = key
+        self.pipe = pipe
+        self.prep_count = prep_count
+        """预处理的项数。最后一项预处理写入pre"""
+        self.input = MidBuffer(pipe.img)
+        self.cur: MidBuffer = self.input
+        """下一项的输入"""
+        self.entries: list[PlanEntry] = []
+        self.steps: list[PlanStep] = []
+        self.bufs: list[MidBuffer] = []
+        """计划自己申请的中间缓冲区"""
+        self.marks: dict[int, tuple[int, int, MidBuffer]] = {}
+        """每段第一项的索引 -> 编译这一段之前的(步骤数, 缓冲区数, 当前输入)"""
+        self.fused: list[tuple[str, ctypes.CDLL, ExtensionPyABC.CPointerArgType, MidBuffer, MidBuffer]] = []
+        """等待融合的逐像素步骤，同`Pre_iter.fused`"""
+        self.fused_entries: list[PlanEntry] = []
+        self.pre_shape: tuple[int, ...] | None = None
+        """编译时pre的形状"""
+        self.code_buf: MidBuffer | None = None
+        self.out_buf: MidBuffer | None = None
+        self.native: ctypes.Array[PlProcPlanStep] | None = None
+        """交给`ClientRunPlan`的各步描述。编译后第一次在C中执行时创建"""
+        self.rets = numpy.zeros(0, dtype=numpy.intc)
+        """上一次执行中各步的返回码"""
+
+    @property
+    def compiled(self) -> int:
+        """已编译的项数"""
+        return len(self.entries)
+
+    def valid(self) -> bool:
+        """管线的输出数组是否还是编译时的那些(界面等其他调用者可能重新分配过)"""
+        pipe = self.pipe
+        return (pipe is not None
+                and (self.pre_shape is None or pipe.pre_buf.arr.shape == self.pre_shape)
+                and (self.code_buf is None or self.code_buf.arr is pipe.code_out)
+                and (self.out_buf is None or self.out_buf.arr is pipe.out))
+
+    def bind_input(self, img: NDArray[numpy.uint8]):
+        """更换输入。形状必须与编译时相同"""
+        assert img.shape == self.input.arr.shape, "输入形状与执行计划不符"
+        self.input.arr = img
+        self.input.update_ptr()
+
+    def entry_input(self, index: int) -> NDArray[numpy.uint8]:
+        """第index项的输入(可以是下一项要编译的项)。供batch_update读取"""
+        if index < len(self.entries):
+            return self.entries[index].in_buf.arr
+        assert index == len(self.entries), "只能获取已编译的项或下一项的输入"
+        return self.cur.arr
+
+    def bind(self, index: int, args: ExtensionPyABC.CPointerArgType) -> bool:
+        """为已编译的第index项换上新参数。重新协商后输出形状或属性变化时返回False，此时需从这一项起重新编译"""
+        entry = self.entries[index]
+        if args is entry.args:
+            return True
+        if entry.dll is not None and get_out_info(entry.dll, args, entry.in_shape, len(entry.out_info[0])) != entry.out_info:
+            return False
+        entry.args = args
+        for step, pos in entry.binds:
+            step.bind_args(args, pos)
+        return True
+
+    def truncate(self, index: int):
+        """丢弃第index项及之后的编译结果。index必须是某一段的第一项"""
+        n_steps, n_bufs, cur = self.marks[index]
+        self.native = None
+        del self.steps[n_steps:]
+        release_bufs(self.bufs, n_bufs)
+        del self.entries[index:]
+        for k in [k for k in self.marks if k >= index]:
+            del self.marks[k]
+        self.cur = cur
+        if index <= self.prep_count:
+            self.code_buf = None
+        if index <= self.prep_count + 1:
+            self.out_buf = None
+
+    def extend(self, items: Sequence[tuple[int, str, ExtensionPyABC.CPointerArgType]]):
+        """编译一段。items的每一项为(阶段EXT_TYPE_*, 扩展名, 参数)，紧接在已编译的项之后"""
+        self.marks[len(self.entries)] = (len(self.steps), len(self.bufs), self.cur)
+        self.native = None
+        for stage, name, args in items:
+            if stage == EXT_TYPE_PREP:
+                self._add_prep(name, args)
+            else:
+                self._add_stage(stage, name, args)
+        # 每段结束时都是步骤的边界，之后可以单独执行或重新编译
+        self._flush()
+
+    def _new_buf(self, shape: Sequence[int]) -> MidBuffer:
+        buf = MidBuffer.pooled((*shape, 4))
+        self.bufs.append(buf)
+        return buf
+
+    def _resize_pre(self, shape: tuple[int, ...]):
+        if self.pipe.pre_buf.arr.shape != shape:
+            self.pipe.pre_buf.resize(shape, refcheck=False)
+        self.pre_shape = shape
+
+    def _flush(self):
+        if not self.fused:
+            return
+        stages, entries = self.fused, self.fused_entries
+        self.fused, self.fused_entries = [], []
+        step: ExtStep | FusedStep
+        if len(stages) == 1:
+            # 只有一步，融合没有意义
+            step = ExtStep(self.pipe.plproc, self.pipe.tasks, *stages[0])
+        else:
+            step = FusedStep(self.pipe.plproc, stages)
+        for pos, entry in enumerate(entries):
+            entry.binds.append((step, pos))
+        self.steps.append(step)
+
+    def _add_prep(self, name: str, args: ExtensionPyABC.CPointerArgType):
+        # 缓冲区的安排与`Pre_iter.next()`在平衡模式下相同，见`pre_buffer_plan()`
+        index = len(self.entries)
+        is_head = index == 0
+        is_tail = index == self.prep_count - 1
+        in_buf = self.cur
+        in_shape = in_buf.arr.shape[:-1]
+        if name == "":
+            dll = None
+            out_info = (in_shape, PRE_ATTRS.ATTR_REUSE)
+            out_shape, out_attr = out_info
+        else:
+            dll = self.pipe.extdc[EXT_TYPE_PREP]["img"][name][EXT_OP_CDLL]
+            out_info = get_out_info(dll, args, in_shape, 2)
+            out_shape, out_attr = out_info
+            if out_attr == PRE_ATTRS.ATTR_READONLY:
+                out_shape = in_shape
+        entry = PlanEntry(EXT_TYPE_PREP, name, dll, args, in_buf, in_shape, out_info)
+        self.entries.append(entry)
+        fusable = pre_fusable(dll, out_attr, in_shape, out_shape)
+        if not fusable:
+            self._flush()
+        head_copy, out_route = pre_buffer_plan(out_attr, is_head, is_tail, PRE_PIPE_MODES.PIPE_MODE_DEFAULT)
+        if head_copy:
+            in_buf = self._new_buf(in_shape)
+            self.steps.append(CopyStep(self.cur, in_buf))
+        out_buf: MidBuffer | None
+        if out_route in (PRE_OUT.OUT_PRE, PRE_OUT.OUT_PRE_COPY):
+            self._resize_pre((*out_shape, 4))
+            out_buf = self.pipe.pre_buf
+            if out_route == PRE_OUT.OUT_PRE_COPY:
+                out_buf = None
+                self.steps.append(CopyStep(in_buf, self.pipe.pre_buf))
+        elif out_route == PRE_OUT.OUT_IN:
+            out_buf = in_buf
+        elif out_route == PRE_OUT.OUT_NONE:
+            out_buf = None
+        else:
+            out_buf = self._new_buf(out_shape)
+        if dll is None:
+            # 空扩展，直接复制
+            if out_buf is not None and out_buf is not in_buf:
+                self.steps.append(CopyStep(in_buf, out_buf))
+        elif fusable:
+            self.fused.append((name, dll, args, in_buf, out_buf))
+            self.fused_entries.append(entry)
+        else:
+            step = ExtStep(self.pipe.plproc, self.pipe.tasks, name, dll, args, in_buf, out_buf)
+            entry.binds.append((step, 0))
+            self.steps.append(step)
+        self.cur = out_buf if out_buf is not None else in_buf
+        if is_tail:
+            self._flush()
+            self.cur = self.pipe.pre_buf
+
+    def _add_stage(self, stage: int, name: str, args: ExtensionPyABC.CPointerArgType):
+        self._flush()
+        pipe = self.pipe
+        dll = pipe.extdc[stage]["img"][name][EXT_OP_CDLL]
+        if stage == EXT_TYPE_CODE:
+            if self.prep_count == 0:
+                # 预处理链为空，pre就是原图
+                self._resize_pre(self.input.arr.shape)
+                self.steps.append(CopyStep(self.input, pipe.pre_buf))
+            in_buf = pipe.pre_buf
+        else:
+            assert self.code_buf is not None, "输出之前需先编译编码"
+            in_buf = self.code_buf
+        in_shape = in_buf.arr.shape
+        out_info = get_out_info(dll, args, in_shape, 1)
+        if stage == EXT_TYPE_CODE:
+            if pipe.code_out.shape != out_info[0]:
+                pipe.code_out = aligned_resize(pipe.code_out, out_info[0])
+            out_buf = self.code_buf = MidBuffer(pipe.code_out)
+        else:
+            if pipe.out.shape != out_info[0]:
+                pipe.out = aligned_resize(pipe.out, out_info[0])
+            out_buf = self.out_buf = MidBuffer(pipe.out)
+        entry = PlanEntry(stage, name, dll, args, in_buf, in_shape, out_info)
+        self.entries.append(entry)
+        step = ExtStep(pipe.plproc, pipe.tasks, name, dll, args, in_buf, out_buf)
+        entry.binds.append((step, 0))
+        self.steps.append(step)
+        self.cur = out_buf
+
+    def run(self, start: int = 0, stop: int | None = None, scope: JobScope | None = None) -> NDArray[numpy.intc]:
+        """执行第[start, stop)项，返回各步骤的返回码(见`result_code()`)。start与stop须是某一段的第一项(或已编译的项数)。  
+        没有指定scope、也没有启用性能剖析时，整段交给`ClientRunPlan`在C中执行，各步之间不返回Python；
+        否则逐步调用，以便取消与记录每一步的耗时"""
+        if stop is None:
+            stop = len(self.entries)
+        first = self.marks[start][0]
+        last = self.marks[stop][0] if stop < len(self.entries) else len(self.steps)
+        if start <= self.prep_count:
+            # pre中的内容不再对应Pre_iter记录的某一步
+            self.pipe.pre_buf.valid_step = None
+            self.pipe.pre_keys.clear()
+        if len(self.rets) != len(self.steps):
+            self.rets = numpy.zeros(len(self.steps), dtype=numpy.intc)
+        rets = self.rets[first:last]
+        plproc = self.pipe.plproc
+        with profiler.span("plan", "plan", entries=[start, stop], steps=last - first):
+            if scope is None and not profiler.enabled and native_plan and CORE_HAS_PLAN:
+                if self.native is None:
+                    self.native = (PlProcPlanStep * len(self.steps))()
+                    for step, native in zip(self.steps, self.native):
+                        step.fill_native(native)
+                else:
+                    for i in range(first, last):
+                        self.steps[i].update_native(self.native[i])
+                steps_ptr = ctypes.cast(ctypes.addressof(self.native) + first * ctypes.sizeof(PlProcPlanStep), ctypes.POINTER(PlProcPlanStep))
+                plproc.run_plan(steps_ptr, last - first, rets.ctypes.data_as(ctypes.POINTER(ctypes.c_int)))
+            else:
+                for i, step in enumerate(islice(self.steps, first, last)):
+                    rets[i] = result_code(step.run(plproc, scope))
+        return rets
+
+    def check(self, start: int, rets: NDArray[numpy.intc]):
+        """检查`run(start, ...)`返回的各步返回码。有非0的返回码时抛出RuntimeError，指明处理链中的项、扩展名与返回码。  
+        扩展出错时输出缓冲区的内容不可信，调用者不应再使用它"""
+        first = self.marks[start][0]
+        for i in numpy.flatnonzero(rets):
+            step = self.steps[first + i]
+            # 融合的步骤对应多项，无法区分是其中哪一项出错
+            entries = [(index, entry) for index, entry in enumerate(self.entries) if any(s is step for s, _ in entry.binds)]
+            where = "、".join(f"第{index + 1}项({ext_index_name_map[entry.stage]}扩展 {entry.name})" for index, entry in entries) or step.name
+            raise RuntimeError(f"处理链{where}返回错误码{int(rets[i])}")
+
+    def release(self):
+        """归还中间缓冲区。之后不能再使用该计划"""
+        release_bufs(self.bufs)
+        self.steps.clear()
+        self.entries.clear()
+        self.marks.clear()
+        self.fused.clear()
+        self.fused_entries.clear()
+        self.pipe = None
 
 class Img2arrPIPE:
     def __init__(self, img: NDArray[numpy.uint8], extdc: ExtList):
-        # 计算单元
-        self.plproc = PlProc(threads)
-        # 原图
-        self.img = img
+        # 计算单元。所有管线共用一个线程池
+        self.plproc: PlProc = shared_pool.acquire()
+        # 原图。扩展直接读取它，需要对齐
+        self.img = aligned_copy(img)
         # 设置self.img只读
         self.img.flags.writeable = False
         # reshape
@@ -583,140 +2150,273 @@ class Img2arrPIPE:
         self.extdc = extdc
         # 原图与预处理间的中间缓冲区
         self.img_pre_buf: list[MidBuffer] = []
-        # 预处理后的图片，copy原图
-        self.pre = self.img.copy()
+        # 预处理后的图片，copy原图。通过self.pre访问
+        self.pre_buf = MidBuffer.pooled(self.img.shape)
+        numpy.copyto(self.pre_buf.arr, self.img)
+        # 原图的键，以及上一次计算中每一步输出的键，用于查找缓存
+        self.img_key = new_img_key()
+        self.pre_keys: list[bytes | None] = []
+        # 预处理结果缓存。None表示不使用
+        self.cache: PreCache | None = pre_cache
+        # 代理预览：原图的金字塔(第1级起，每级缩小一半)，以及在其中一级上运行的管线
+        self.pyramid: list[NDArray[numpy.uint8]] = []
+        self.proxy: Img2arrPIPE | None = None
+        self.proxy_level = 0
         # 编码后预览图片
-        self.code_view = numpy.zeros_like(self.img)
+        self.code_view = aligned_empty(self.img.shape)
+        self.code_view.fill(0)
         # 编码输出
-        self.code_out = numpy.empty((0,), dtype=numpy.uint8)
+        self.code_out = aligned_empty((0,))
         # 输出
-        self.out = numpy.empty((0,), dtype=numpy.uint8)
+        self.out = aligned_empty((0,))
 
         # 并发任务数。0表示使用线程数。
         self.tasks = 0 # 不建议动。会导致某些扩展无法正常工作。
-        
 
-    def Pre(self, i: int, empty: bool = False):
+        # 整条处理链的执行计划，见Plan()
+        self.plan: ExecPlan | None = None
+        # 编码预览、编码、输出上一次的调用。扩展名、参数内容与输入输出都没变时直接复用，见stage_step()
+        self.stage_steps: dict[str, tuple[tuple, ExtStep]] = {}
+
+    @property
+    def pre(self) -> NDArray[numpy.uint8]:
+        """预处理后的图片。尺寸变化时会重新分配，不要长期持有"""
+        return self.pre_buf.arr
+
+    def set_img(self, img: NDArray[numpy.uint8]):
+        """更换原图。线程池与中间缓冲区保持不变，供批处理复用。
+        更换后需从头(i=0)调用`Pre()`。"""
+        self.img = aligned_copy(img)
+        self.img.flags.writeable = False
+        self.img_key = new_img_key()
+        self.pyramid.clear()
+        self.close_proxy()
+
+    def Proxy(self, view_shape: Sequence[int]) -> "Img2arrPIPE | None":
+        """代理预览。返回在原图的缩小版本上运行同一处理链的管线，用于参数变化时快速预览，不影响本管线的结果。  
+        view_shape: 预览的显示尺寸(高, 宽)，单位为像素。选择不小于它的最小一级金字塔  
+        原图缩小一半就比显示尺寸小时，代理没有意义，返回None。  
+        代理管线有自己的中间缓冲区，切换到另一级时会重新创建，需要从头(i=0)调用`Pre()`
+        """
+        view_h, view_w = view_shape[0], view_shape[1]
+        h, w = self.img.shape[0], self.img.shape[1]
+        level = 0
+        while h // 2 >= max(view_h, 1) and w // 2 >= max(view_w, 1):
+            h //= 2
+            w //= 2
+            level += 1
+        if level == 0:
+            self.close_proxy()
+            return None
+        while len(self.pyramid) < level:
+            self.pyramid.append(downsample2(self.pyramid[-1] if self.pyramid else self.img))
+        if self.proxy is None or self.proxy_level != level:
+            self.close_proxy()
+            self.proxy = Img2arrPIPE(self.pyramid[level - 1], self.extdc)
+            self.proxy.tasks = self.tasks
+            self.proxy.cache = self.cache
+            self.proxy_level = level
+        return self.proxy
+
+    def Plan(self, chain_key: Hashable, prep_count: int) -> ExecPlan:
+        """获取整条处理链的执行计划，见`ExecPlan`。  
+        chain_key: 描述处理链的各项(扩展名与参数内容)，由调用者给出  
+        prep_count: 预处理的项数  
+        处理链、原图形状与调度方式都与上次相同，且计划仍然有效时，换上当前原图后复用；否则返回一个空计划，由调用者编译
+        """
+        key = (chain_key, prep_count, self.img.shape, self.plproc.get_threads(), self.tasks, sched_mode, pre_fusion)
+        if self.plan is not None and self.plan.key == key and self.plan.valid():
+            self.plan.bind_input(self.img)
+            return self.plan
+        self.release_plan()
+        self.plan = ExecPlan(self, key, prep_count)
+        return self.plan
+
+    def release_plan(self):
+        """释放执行计划及其中间缓冲区"""
+        if self.plan is not None:
+            self.plan.release()
+            self.plan = None
+
+    def stage_step(self, stage: str, key: tuple, in_arr: NDArray[numpy.uint8], out_arr: NDArray[numpy.uint8]) -> ExtStep | None:
+        """上一次为stage创建的调用。key(扩展名、参数内容、调度方式等)与输入输出数组都没变时才能复用，否则返回None"""
+        cached = self.stage_steps.get(stage)
+        if cached is None or cached[0] != key:
+            return None
+        step = cached[1]
+        if step.in_buf.arr is not in_arr or step.out_buf is None or step.out_buf.arr is not out_arr:
+            return None
+        return step
+
+    def close_proxy(self):
+        """释放代理管线。调用者需保证它没有正在进行的计算"""
+        if self.proxy is not None:
+            self.proxy.close()
+            self.proxy = None
+            self.proxy_level = 0
+
+    def Pre(self, i: int, empty: bool = False, dirty: Region | None = None):
         """预处理。返回一个一次性迭代器  
         i: 预处理链索引。i=0，从头开始（但仍会保存用过且必要的缓冲区）；i!=0时，会启用增量刷新  
         empty: 处理链是否为空。若为空，则不进行任何操作，并且将img复制到pre。  
-        如果处理链为空，但empty=False，则不会把img复制到pre，画面不符合预期
+        如果处理链为空，但empty=False，则不会把img复制到pre，画面不符合预期  
+        dirty: 局部重算。第i步的输入(i=0时为原图)相对上一次计算只有这个区域发生了变化，且第i步及之后的参数都没有变。
+        之后的每一步只重算受影响的行(由扩展的io_GetOutRegion或ATTR_POINTWISE决定)，并只复制这些行到pre。
+        None表示整张图重算。只在性能模式(PIPE_MODE_SPEED)下生效
         """
-        it = Pre_iter(self.plproc, self.tasks, self.extdc, self.img, self.img_pre_buf, self.pre, i)
+        if dirty is not None:
+            # 输入被原地修改过，之前的键不再对应它的内容
+            if i == 0:
+                self.img_key = new_img_key()
+            elif i <= len(self.pre_keys):
+                self.pre_keys[i - 1] = None
+        it = Pre_iter(self.plproc, self.tasks, self.extdc, self.img, self.img_pre_buf, self.pre_buf, i, dirty)
+        it.cache = self.cache
+        it.img_key = self.img_key
+        it.keys = self.pre_keys
         if empty:
             # 检查pre尺寸是否需要更新
             if self.pre.shape != self.img.shape:
-                self.pre.resize(self.img.shape, refcheck=False)
+                self.pre_buf.resize(self.img.shape, refcheck=False)
                 it.pre_resized = True
             else:
                 it.pre_resized = False
             numpy.copyto(self.pre, self.img, casting="no")
+            self.pre_buf.valid_step = None
         return it
     def CodeView(self, name: str, args: ExtensionPyABC.CPointerArgType, argslen: int, in_arr: Optional[NDArray[numpy.uint8]] = None) -> tuple[PIPENodeResult, bool]:
         """编码预览图刷新。返回处理结果和code_view尺寸是否更新的标志。若未指定in_arr，则使用pre"""
-        assert name != "", "编码器名称不能为空"
-        view_updated = False
-        if in_arr is None:
-            in_arr = self.pre
-        # 获取对应名称编码器的动态链接库
-        dll = self.extdc[EXT_TYPE_CODE]["img"][name][EXT_OP_CDLL]
-        # 调用io_GetViewOutInfo获取输出尺寸
-        out_shape_ct = (ctypes.c_size_t * 2)()
-        in_shape = in_arr.shape[:-1]
-        in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
-        ret = dll.io_GetViewOutInfo(args, in_shape_ct, out_shape_ct)
-        if ret != 0: 
-            raise RuntimeError(f"io_GetViewOutInfo返回错误码{ret}")
-        out_shape = (out_shape_ct[0], out_shape_ct[1], 4)
-        # 是否需要resize code_view
-        if self.code_view.shape != out_shape:
-            self.code_view.resize(out_shape, refcheck=False)
-            view_updated = True
-        logger.debug(f"此次编码预览输出尺寸: {out_shape}")
-        logger.debug(f"{in_arr.shape} -> {self.code_view.shape}")
-        # 调用编码器
-        result = call_processor(self.plproc, self.tasks, name, dll, args, MidBuffer(in_arr), MidBuffer(self.code_view), is_code_view=True)
-        # 返回结果
-        return result, view_updated
+        with profiler.span(name, "code", stage="CodeView") as span:
+            assert name != "", "编码器名称不能为空"
+            view_updated = False
+            if in_arr is None:
+                in_arr = self.pre
+            # 获取对应名称编码器的动态链接库
+            dll = self.extdc[EXT_TYPE_CODE]["img"][name][EXT_OP_CDLL]
+            key = (name, args_raw(args, argslen), in_arr.shape, self.plproc.get_threads(), self.tasks)
+            step = self.stage_step("CodeView", key, in_arr, self.code_view)
+            if step is None:
+                # 调用io_GetViewOutInfo获取输出尺寸
+                out_shape_ct = (ctypes.c_size_t * 2)()
+                in_shape = in_arr.shape[:-1]
+                in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
+                ret = dll.io_GetViewOutInfo(args, in_shape_ct, out_shape_ct)
+                if ret != 0: 
+                    raise RuntimeError(f"io_GetViewOutInfo返回错误码{ret}")
+                out_shape = (out_shape_ct[0], out_shape_ct[1], 4)
+                # 是否需要resize code_view
+                if self.code_view.shape != out_shape:
+                    self.code_view = aligned_resize(self.code_view, out_shape)
+                    view_updated = True
+                logger.debug(f"此次编码预览输出尺寸: {out_shape}")
+                logger.debug(f"{in_arr.shape} -> {self.code_view.shape}")
+                step = ExtStep(self.plproc, self.tasks, name, dll, args, MidBuffer(in_arr), MidBuffer(self.code_view), is_code_view=True)
+                self.stage_steps["CodeView"] = (key, step)
+            else:
+                # 参数内容没变，输出尺寸也不会变
+                step.bind_args(args)
+            span.args.update(bytes_in=in_arr.nbytes, bytes_out=self.code_view.nbytes)
+            # 调用编码器
+            result = step.run(self.plproc)
+            # 返回结果
+            return result, view_updated
     def Code(self, name: str, args: ExtensionPyABC.CPointerArgType, argslen: int) -> PIPENodeResult:
         """编码。返回处理结果"""
-        assert name != "", "编码器名称不能为空"
-        # 获取对应名称编码器的动态链接库
-        dll = self.extdc[EXT_TYPE_CODE]["img"][name][EXT_OP_CDLL]
-        # 调用io_GetOutInfo获取输出尺寸
-        out_shape_ct = (ctypes.c_size_t * 1)()
-        in_shape = self.pre.shape
-        in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
-        attr = ctypes.c_int(0)
-        ret = dll.io_GetOutInfo(args, in_shape_ct, out_shape_ct, ctypes.byref(attr))
-        if ret != 0:
-            raise RuntimeError(f"io_GetOutInfo返回错误码{ret}")
-        # resize到输出尺寸（如果需要的话）
-        out_size = out_shape_ct[0]
-        if self.code_out.shape[0] != out_size:
-            self.code_out.resize((out_size,), refcheck=False)
-        # 调用编码器
-        result = call_processor(self.plproc, self.tasks, name, dll, args, MidBuffer(self.pre), MidBuffer(self.code_out))
-        # 返回结果
-        return result
+        with profiler.span(name, "code", stage="Code") as span:
+            assert name != "", "编码器名称不能为空"
+            # 获取对应名称编码器的动态链接库
+            dll = self.extdc[EXT_TYPE_CODE]["img"][name][EXT_OP_CDLL]
+            key = (name, args_raw(args, argslen), self.pre.shape, self.plproc.get_threads(), self.tasks, sched_mode)
+            step = self.stage_step("Code", key, self.pre, self.code_out)
+            if step is None:
+                # 调用io_GetOutInfo获取输出尺寸
+                out_shape, _ = get_out_info(dll, args, self.pre.shape, 1)
+                # resize到输出尺寸（如果需要的话）
+                if self.code_out.shape != out_shape:
+                    self.code_out = aligned_resize(self.code_out, out_shape)
+                step = ExtStep(self.plproc, self.tasks, name, dll, args, MidBuffer(self.pre), MidBuffer(self.code_out))
+                self.stage_steps["Code"] = (key, step)
+            else:
+                step.bind_args(args)
+            span.args.update(bytes_in=self.pre.nbytes, bytes_out=self.code_out.nbytes)
+            # 调用编码器
+            result = step.run(self.plproc)
+            # 返回结果
+            return result
     def Out(self, name: str, args: ExtensionPyABC.CPointerArgType, argslen: int) -> PIPENodeResult:
         """输出。返回处理结果"""
-        assert name != "", "输出器名称不能为空"
-        # 获取对应名称输出器的动态链接库
-        dll = self.extdc[EXT_TYPE_OUT]["img"][name][EXT_OP_CDLL]
-        # 调用io_GetOutInfo获取输出尺寸
-        out_shape_ct = (ctypes.c_size_t * 1)()
-        in_shape = self.code_out.shape
-        in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
-        attr = ctypes.c_int(0)
-        ret = dll.io_GetOutInfo(args, in_shape_ct, out_shape_ct, ctypes.byref(attr))
-        if ret != 0:
-            raise RuntimeError(f"io_GetOutInfo返回错误码{ret}")
-        # resize到输出尺寸（如果需要的话）
-        out_size = out_shape_ct[0]
-        logger.debug(f"此次输出数据量: {out_size}")
-        if self.out.shape[0] != out_size:
-            self.out.resize((out_size,), refcheck=False)
-        # 调用输出器
-        result = call_processor(self.plproc, self.tasks, name, dll, args, MidBuffer(self.code_out), MidBuffer(self.out))
-        # 返回结果
-        return result
+        with profiler.span(name, "out", stage="Out") as span:
+            assert name != "", "输出器名称不能为空"
+            # 获取对应名称输出器的动态链接库
+            dll = self.extdc[EXT_TYPE_OUT]["img"][name][EXT_OP_CDLL]
+            key = (name, args_raw(args, argslen), self.code_out.shape, self.plproc.get_threads(), self.tasks, sched_mode)
+            step = self.stage_step("Out", key, self.code_out, self.out)
+            if step is None:
+                # 调用io_GetOutInfo获取输出尺寸
+                out_shape, _ = get_out_info(dll, args, self.code_out.shape, 1)
+                # resize到输出尺寸（如果需要的话）
+                logger.debug(f"此次输出数据量: {out_shape[0]}")
+                if self.out.shape != out_shape:
+                    self.out = aligned_resize(self.out, out_shape)
+                step = ExtStep(self.plproc, self.tasks, name, dll, args, MidBuffer(self.code_out), MidBuffer(self.out))
+                self.stage_steps["Out"] = (key, step)
+            else:
+                step.bind_args(args)
+            span.args.update(bytes_in=self.code_out.nbytes, bytes_out=self.out.nbytes)
+            # 调用输出器
+            result = step.run(self.plproc)
+            # 返回结果
+            return result
     def resetPrePIPE(self):
         """重置预处理链"""
-        self.img_pre_buf.clear()
+        release_bufs(self.img_pre_buf)
+        self.release_plan()
+        if self.proxy is not None:
+            self.proxy.resetPrePIPE()
     def close(self):
         """显式释放资源，确保 C 线程池等被立即回收"""
+        if hasattr(self, 'plan'):
+            self.release_plan()
+            self.stage_steps.clear()
         if hasattr(self, 'plproc'):
+            if isinstance(self.plproc, PlProcClient):
+                self.plproc.close()
             del self.plproc
         if hasattr(self, 'img'):
             del self.img
-        if hasattr(self, 'pre'):
-            del self.pre
+        if hasattr(self, 'pre_buf'):
+            self.pre_buf.release()
+            del self.pre_buf
         if hasattr(self, 'code_view'):
             del self.code_view
         if hasattr(self, 'code_out'):
             del self.code_out
         if hasattr(self, 'out'):
             del self.out
-        self.img_pre_buf.clear()
+        release_bufs(self.img_pre_buf)
+        self.close_proxy()
+        self.pyramid.clear()
     def __del__(self):
         logger.info("管线被删除")
 
         
 class Pre_iter:
-    def __init__(self, plproc: PlProc, tasks: int, extdc: ExtList, img: NDArray[numpy.uint8], img_pre_buf: list[MidBuffer], pre: NDArray[numpy.uint8], i: int):
+    def __init__(self, plproc: PlProc, tasks: int, extdc: ExtList, img: NDArray[numpy.uint8], img_pre_buf: list[MidBuffer], pre: NDArray[numpy.uint8] | MidBuffer, i: int, dirty: Region | None = None):
         # print("----")
         self.plproc = plproc
         self.extdc = extdc
         self.tasks = tasks
         self.img = MidBuffer(img)
-        self.pre = MidBuffer(pre)
+        self.pre = pre if isinstance(pre, MidBuffer) else MidBuffer(pre)
 
         self.img_pre_buf = img_pre_buf
         self.i = self.get_avaliable_index(i)
         """
         索引。它在启动时，其值为保持管线顺利更新所需的尽可能大的索引。
         """
+        self.dirty: Region | None = dirty if self.i == i else None
+        """当前这一步的输入中发生变化的区域，见`Img2arrPIPE.Pre()`。None表示整张图。
+        若增量刷新需要从更早的一步开始，dirty描述的就不是那一步的输入了，只能整张图重算"""
         self.cur_buf_index = self.init_current_buf(self.i) # 当前中间缓冲区索引
         # print("Init buf index:", self.cur_buf_index)
         self.pre_resized: Optional[bool] = None 
@@ -731,8 +2431,58 @@ class Pre_iter:
             buf.readers.clear()
             buf.writers.clear()
         self.mode: int = PRE_PIPE_MODES.PIPE_MODE_DEFAULT
+        self.scope = JobScope()
+        """本次刷新的作业范围。`cancel()`后，正在进行和之后的计算都会抛出`JobCancelled`"""
+        self.fused: list[tuple[str, ctypes.CDLL, ExtensionPyABC.CPointerArgType, MidBuffer, MidBuffer]] = []
+        """等待融合执行的逐像素步骤，见`flush()`"""
+        self.fused_index = 0
+        """fused中第一步的索引"""
+        self.fused_steps: list[int] = []
+        """fused中每一步的索引"""
+        self.fused_rows: tuple[int, int] | None = None
+        """fused中各步要计算的行，None表示整张图"""
+        self.fused_keys: list[bytes | None] = []
+        """fused中每一步输出的键"""
+
+        self.cache: PreCache | None = None
+        """预处理结果缓存，由`Img2arrPIPE.Pre()`设置"""
+        self.img_key: bytes | None = None
+        """原图的键"""
+        self.keys: list[bytes | None] = []
+        """每一步输出的键。None表示不可缓存"""
+        self.span = profiler.span("", "pre")
+        """当前这一步的计时，见`next()`"""
+    def cancel(self):
+        """取消本次刷新(可以从其他线程调用)。被取消的那一步及之后的缓冲区内容不完整，需从`JobCancelled.index`或更早的位置重新刷新"""
+        self.scope.cancel()
     def __iter__(self):
         return self
+    def pending_index(self) -> int:
+        """还没有计算的第一步的索引"""
+        return self.fused_index if self.fused else self.i
+    def flush(self):
+        """执行等待融合的逐像素步骤。`next()`会在遇到不能融合的步骤前及最后一步时自动调用"""
+        if not self.fused:
+            return
+        stages, steps, keys = self.fused, self.fused_steps, self.fused_keys
+        self.fused, self.fused_steps, self.fused_keys = [], [], []
+        try:
+            if len(stages) == 1:
+                # 只有一步，融合没有意义
+                name, dll, args, in_buf, out_buf = stages[0]
+                call_processor(self.plproc, self.tasks, name, dll, args, in_buf, out_buf, scope=self.scope, rows=self.fused_rows)
+            else:
+                call_fused(self.plproc, stages, scope=self.scope, rows=self.fused_rows)
+        except JobCancelled as e:
+            self.invalidate()
+            e.index = self.fused_index
+            e.pre_resized = self.pre_resized
+            raise
+        for j, (stage, step, key) in enumerate(zip(stages, steps, keys)):
+            stage[4].valid_step = step
+            # 原地执行时，同一缓冲区中只剩最后一步的结果
+            if key is not None and all(later[4] is not stage[4] for later in stages[j + 1:]):
+                self.cache_put(key, stage[4])
     def set_index(self, i: int):
         """设置当前索引"""
         self.i = i
@@ -781,7 +2531,7 @@ class Pre_iter:
         shape_ = (*shape, 4)
         self.cur_buf_index += 1
         if self.cur_buf_index >= len(self.img_pre_buf):
-            self.img_pre_buf.append(MidBuffer(numpy.empty(shape_, dtype=numpy.uint8)))
+            self.img_pre_buf.append(MidBuffer.pooled(shape_))
         buf = self.img_pre_buf[self.cur_buf_index]
         arr = buf.arr
         # 如果shape对不上，则resize
@@ -791,7 +2541,7 @@ class Pre_iter:
         return buf
     def clear_buf(self):
         """移除之后的缓冲区"""
-        del self.img_pre_buf[self.cur_buf_index+1:]
+        release_bufs(self.img_pre_buf, self.cur_buf_index + 1)
 
     def get_avaliable_index(self, i: int):
         """当需要增量刷新时，刷新的最低索引。启动时调用一次。"""
@@ -815,12 +2565,24 @@ class Pre_iter:
         argsize: 参数大小  
         is_head: 是否是第一个预处理。相对于整个预处理链，而不是当前的起始点（考虑到增量刷新）。即，i==0时，is_head为True  
         is_tail: 是否是最后一个预处理  
-        *：有一个特殊的虚扩展""(空字符串)，它固有属性为ATTR_REUSE，且只负责将输入复制到输出（如果数组指针不同）。利用它能快速的实现扩展的禁用。
+        *：有一个特殊的虚扩展""(空字符串)，它固有属性为ATTR_REUSE，且只负责将输入复制到输出（如果数组指针不同）。利用它能快速的实现扩展的禁用。  
+        启用性能剖析时记录这一步的耗时，以及是否命中缓存、是否推迟到之后融合执行、局部重算的行
         """
+        with profiler.span(name if name != "" else "(空)", "pre", index=self.i) as span:
+            self.span = span
+            return self._next(name, args, argsize, is_head, is_tail)
 
+    def _next(self, name: str, args: ExtensionPyABC.CPointerArgType, argsize: int, is_head: bool, is_tail: bool):
         if name == "":
             logging.debug("Skip empty ext")
 
+        try:
+            self.scope.check()
+        except JobCancelled as e:
+            e.index = self.pending_index()
+            e.pre_resized = self.pre_resized
+            raise
+
         # 分配头缓冲区（很重要，后面要进行大小判断）
         # 如果是head，in_buf一定是img
         if is_head:
@@ -864,18 +2626,33 @@ class Pre_iter:
 
         else:
             raise AttributeError("name类型错误！")
+
+        # 可以融合的逐像素步骤先不计算，攒到下一个不能融合的步骤之前(或最后一步)再一起执行。
+        # 逐像素步骤之间没有跨像素的依赖，按块依次执行所有步骤与逐步执行的结果相同
+        fusable = pre_fusable(dll, out_attr, in_shape, out_shape)
+        if not fusable and name != "":
+            self.flush()
+
+        # 局部重算：本步骤输出中需要重算的区域，None表示整张图。
+        # 只在性能模式下进行：每一步都有自己的输出缓冲区，其中保存着这一步上次的结果，只需覆盖变化的部分。
+        # 其他模式下多个步骤会原地写同一个缓冲区，区域外的内容已经不是某一步的输入了
+        region: Region | None = None
+        if self.dirty is not None and self.mode == PRE_PIPE_MODES.PIPE_MODE_SPEED:
+            region = map_region(dll, args, in_shape, out_shape, out_attr, self.dirty)
         
+        head_copy, out_route = pre_buffer_plan(out_attr, is_head, is_tail, self.mode)
         # 对于具有head的只读扩展，输入数组需要特殊处理
-        if is_head and out_attr == PRE_ATTRS.ATTR_READONLY:
+        if head_copy:
             # 申请一个buf，并将self.img复制过去
             in_buf = self.next_buf(in_shape)
             in_buf_name = str(self.cur_buf_index)
             numpy.copyto(in_buf.arr, self.img.arr, "no")
+            in_buf.valid_step = None
             self.add_buf_writer(self.i)
             self.add_buf_reader(self.i)
 
         # 如果是tail，out_buf一定是pre，并清理缓冲区
-        if is_tail:
+        if out_route in (PRE_OUT.OUT_PRE, PRE_OUT.OUT_PRE_COPY):
             # print("Tail")
             out_buf = self.pre
             out_buf_name = "pre" # 调试用，跟踪管线路径
@@ -888,20 +2665,20 @@ class Pre_iter:
             else:
                 self.pre_resized = False
             # 如果最后一项恰是只读扩展，则手动将current_buf复制到pre，且没有out_buf
-            if out_attr == PRE_ATTRS.ATTR_READONLY:
+            if out_route == PRE_OUT.OUT_PRE_COPY:
                 out_buf = None
-                numpy.copyto(self.pre.arr, self.current_buf().arr, "no")
+                if region is not None and self.pre.valid_step == self.i:
+                    numpy.copyto(self.pre.arr[region[0]:region[2]], self.current_buf().arr[region[0]:region[2]], "no")
+                else:
+                    numpy.copyto(self.pre.arr, self.current_buf().arr, "no")
+                self.pre.valid_step = self.i
         else:
             # print(f"Attr for {name}: {out_attr}")
-            if out_attr == PRE_ATTRS.ATTR_REUSE and not is_head:
-                # 输入可复用，在默认模式下直接使用输入缓冲区
-                if self.mode == PRE_PIPE_MODES.PIPE_MODE_SPEED: 
-                    out_buf = self.next_buf(out_shape)
-                    out_buf_name = str(self.cur_buf_index)
-                else:
-                    out_buf = in_buf
-                    out_buf_name = in_buf_name
-            elif out_attr == PRE_ATTRS.ATTR_READONLY:
+            if out_route == PRE_OUT.OUT_IN:
+                # 输入可复用，直接使用输入缓冲区
+                out_buf = in_buf
+                out_buf_name = in_buf_name
+            elif out_route == PRE_OUT.OUT_NONE:
                 # 只读，仅使用输入缓冲区
                 out_buf = None
                 out_buf_name = "NULL"
@@ -913,32 +2690,275 @@ class Pre_iter:
                 self.add_buf_writer(self.i)
         
         # logger.debug(f"Call pre index {self.i}, {in_buf_name} -> {out_buf_name}")
+
+        # 只重算受影响的行。要求输出缓冲区中还是这一步上次的结果；只读扩展(如统计)总是读取整张图。
+        # 多阶段的f1r只有逐像素时才能按行拆开
+        rows: tuple[int, int] | None = None
+        if (region is not None and out_buf is not None and out_buf.valid_step == self.i
+                and (dll is None or (hasattr(dll, "f1r") and CORE_HAS_RANGE and (out_attr == PRE_ATTRS.ATTR_POINTWISE or get_f1r_phases(dll) == 1)))):
+            rows = (region[0], region[2]) if not region_empty(region) else (0, 0)
+        # 下一步输入中变化的区域
+        self.dirty = region
+
+        # 结果缓存。空扩展与只读扩展的输出就是输入；依赖指针内容的扩展不缓存
+        in_key = self.in_key()
+        if name == "" or out_attr == PRE_ATTRS.ATTR_READONLY:
+            key = in_key
+        elif in_key is None or hasattr(ext[EXT_OP_EXT], "batch_update"):
+            key = None
+        else:
+            key = pre_cache_key(in_key, name, args_to_bytes(args, argsize))
+        self.set_key(key)
+        cached = None
+        if (rows is None and key is not None and name != "" and out_buf is not None
+                and self.cache is not None and self.cache.budget > 0):
+            cached = self.cache.get(key)
+            if cached is not None and cached.shape != out_buf.arr.shape:
+                cached = None
             
 
+        if rows is not None:
+            self.span.args["rows"] = list(rows)
+
         # 调用预处理
-        if name != "": # 默认逻辑
-            if dll is not None:
-                ret = call_processor(self.plproc, self.tasks, name, dll, args, in_buf, out_buf)
+        if cached is not None:
+            # 之前算过，直接复制。等待融合的步骤可能写同一个缓冲区，先执行
+            self.span.args["cached"] = True
+            self.flush()
+            numpy.copyto(out_buf.arr, cached, "no")
+            out_buf.valid_step = self.i
+            # 与缓冲区中上次的内容相比，哪里变了是未知的
+            self.dirty = None
+        elif rows is not None and rows[0] >= rows[1]:
+            # 没有受影响的行，输出保持上次的结果
+            pass
+        elif name != "": # 默认逻辑
+            if dll is not None and fusable:
+                if self.fused and self.fused_rows != rows:
+                    self.flush()
+                if not self.fused:
+                    self.fused_index = self.i
+                    self.fused_rows = rows
+                self.fused.append((name, dll, args, in_buf, out_buf))
+                self.span.args["fused"] = True
+                self.fused_steps.append(self.i)
+                self.fused_keys.append(key)
+            elif dll is not None:
+                try:
+                    ret = call_processor(self.plproc, self.tasks, name, dll, args, in_buf, out_buf, scope=self.scope, rows=rows)
+                except JobCancelled as e:
+                    self.invalidate()
+                    e.index = self.i
+                    e.pre_resized = self.pre_resized
+                    raise
+                if out_buf is not None:
+                    out_buf.valid_step = self.i
+                    self.cache_put(key, out_buf)
             else:
                 logger.error("预处理时，name不为空，但dll为None")
         else: # 空扩展，直接复制
             if out_buf is not None:
                 if in_buf.arrptr != out_buf.arrptr: # 开始复制
-                    numpy.copyto(out_buf.arr, in_buf.arr, "no")
+                    # 输入可能还在等待融合执行
+                    self.flush()
+                    if rows is not None:
+                        numpy.copyto(out_buf.arr[rows[0]:rows[1]], in_buf.arr[rows[0]:rows[1]], "no")
+                    else:
+                        numpy.copyto(out_buf.arr, in_buf.arr, "no")
+                    out_buf.valid_step = self.i
                 else: # 不用复制
                     pass
             else:
                 logger.error("空扩展，但out_buf为None")
             ret = None
 
+        if is_tail:
+            self.flush()
+            # 省内存模式，或内存紧张时，不再保留中间缓冲区。下一次刷新需从头开始
+            if self.mode == PRE_PIPE_MODES.PIPE_MODE_MEMORY or buffer_pool.pressure():
+                release_bufs(self.img_pre_buf)
+                self.reset_buf_index()
+
         self.i += 1
 
         return None, None # TODO: 处理返回值问题
 
+    def in_key(self) -> bytes | None:
+        """当前这一步输入的键"""
+        if self.i == 0:
+            return self.img_key
+        if self.i - 1 < len(self.keys):
+            return self.keys[self.i - 1]
+        return None
+
+    def set_key(self, key: bytes | None):
+        """记录当前这一步输出的键"""
+        if self.i >= len(self.keys):
+            self.keys.extend([None] * (self.i + 1 - len(self.keys)))
+        self.keys[self.i] = key
+
+    def cache_put(self, key: bytes | None, buf: MidBuffer):
+        if key is not None and self.cache is not None and self.cache.budget > 0:
+            self.cache.put(key, buf.arr)
+
+    def invalidate(self):
+        """计算被取消后，之后的各步骤没有基于新输入计算，缓冲区中的内容不能再用于局部重算"""
+        for buf in self.img_pre_buf:
+            buf.valid_step = None
+        self.pre.valid_step = None
+
     def __del__(self):
         """清理"""
         self.clear_buf()
-        
+
+
+# 批处理
+
+BATCH_CHAIN_VERSION = 1
+
+_PTR_TYPES = (ctypes._Pointer, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_wchar_p)
+
+def args_pointer_fields(args_type: type) -> list[tuple[int, int]]:
+    """参数结构体(或ctypes数组)类型中指针字段的(偏移, 大小)"""
+    if issubclass(args_type, ctypes.Structure):
+        return [(getattr(args_type, field[0]).offset, ctypes.sizeof(field[1]))
+                for field in args_type._fields_ if issubclass(field[1], _PTR_TYPES)]
+    if issubclass(args_type, ctypes.Array) and issubclass(args_type._type_, _PTR_TYPES):
+        return [(0, ctypes.sizeof(args_type))]
+    return []
+
+def check_batch_args(name: str, py: ExtensionPyABC.abcExt | None, arg: ExtensionPyABC.CPointerArgType | None = None):
+    """批处理链无法保存指针：参数中有指针字段的扩展必须提供`batch_update()`，否则抛出ValueError。  
+    arg: `UI.update()`返回的参数。为None时检查扩展的`UI.args_t`"""
+    if py is None or hasattr(py, "batch_update"):
+        return
+    if arg is not None:
+        args_type = type(getattr(arg, "_obj", arg))
+    else:
+        args_type = getattr(getattr(py, "UI", None), "args_t", None)
+    if isinstance(args_type, type) and args_pointer_fields(args_type):
+        raise ValueError(f"扩展 {name} 的参数含有指针，但没有提供batch_update，不能用于批处理")
+
+def args_to_bytes(arg: ExtensionPyABC.CPointerArgType, arglen: int) -> bytes:
+    """将`UI.update()`返回的参数转为可保存的字节串。
+    参数结构体中的指针字段会被置为NULL(指针在进程外没有意义)。
+    依赖指针字段的扩展应提供`batch_update()`，见`ExtensionPyABC`与`check_batch_args()`。
+    """
+    if arglen <= 0:
+        return b""
+    obj = getattr(arg, "_obj", arg) # byref()的返回值
+    data = bytearray(ctypes.string_at(ctypes.addressof(obj), arglen))
+    for offset, size in args_pointer_fields(type(obj)):
+        data[offset:offset + size] = bytes(size)
+    return bytes(data)
+
+def args_from_bytes(data: bytes) -> tuple[ExtensionPyABC.CPointerArgType | ctypes.Array, int]:
+    """`args_to_bytes()`的逆操作。返回(参数指针, 参数长度)"""
+    if len(data) == 0:
+        return NULLPTR, 0
+    buf = (ctypes.c_uint8 * len(data)).from_buffer_copy(data)
+    return buf, len(data)
+
+def load_batch_chain(path: str) -> dict[str, Any]:
+    """读取批处理链描述文件(JSON)。格式：
+    {
+        "version": 1,
+        "prep": [{"name": 扩展名, "args": 参数十六进制串, "save": 可选, 供batch_update使用}, ...],
+        "code": {"name": ..., "args": ..., "save": ...},
+        "out":  {"name": ..., "args": ..., "save": ...}
+    }
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        chain = json.load(f)
+    if chain.get("version", BATCH_CHAIN_VERSION) != BATCH_CHAIN_VERSION:
+        raise ValueError(f"不支持的批处理链版本: {chain.get('version')}")
+    for key in ("code", "out"):
+        if not isinstance(chain.get(key), dict) or not chain[key].get("name"):
+            raise ValueError(f"批处理链缺少{key}阶段")
+    chain.setdefault("prep", [])
+    return chain
+
+def save_batch_chain(path: str, chain: dict[str, Any]):
+    """保存批处理链描述文件"""
+    chain = {"version": BATCH_CHAIN_VERSION, **chain}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(chain, f, ensure_ascii=False, indent=4)
+
+class Img2arrBatch:
+    """无界面的批处理引擎。
+    所有图片共用同一个管线(即同一个`PlProc`线程池和同一组`MidBuffer`)，只在图片间更换原图。
+    """
+    def __init__(self, extdc: ExtList, chain: dict[str, Any]):
+        self.extdc = extdc
+        self.chain = chain
+        self.pipe: Img2arrPIPE | None = None
+        # 固定参数只解析一次
+        self.prep_args = [self._static_args(EXT_TYPE_PREP, step) for step in chain["prep"]]
+        self.code_args = self._static_args(EXT_TYPE_CODE, chain["code"])
+        self.out_args = self._static_args(EXT_TYPE_OUT, chain["out"])
+        # 处理链的各项：(阶段, 描述, 固定参数)，以及用作执行计划的键的参数内容
+        self.items = ([(EXT_TYPE_PREP, step, static) for step, static in zip(chain["prep"], self.prep_args)]
+                      + [(EXT_TYPE_CODE, chain["code"], self.code_args), (EXT_TYPE_OUT, chain["out"], self.out_args)])
+        self.chain_key = tuple((stage, step["name"], None if static is None else args_raw(*static)) for stage, step, static in self.items)
+
+    def _ext(self, stage: int, name: str) -> ExtMain:
+        try:
+            return self.extdc[stage]["img"][name]
+        except KeyError:
+            raise KeyError(f"未找到{ext_index_name_map[stage]}扩展: {name}")
+
+    def _static_args(self, stage: int, step: dict[str, Any]):
+        """解析固定参数。若扩展提供了batch_update，返回None，表示每张图片都需要重新生成参数"""
+        py = self._ext(stage, step["name"])[EXT_OP_EXT]
+        check_batch_args(step["name"], py)
+        if py is not None and hasattr(py, "batch_update"):
+            return None
+        return args_from_bytes(bytes.fromhex(step.get("args", "")))
+
+    def _args(self, stage: int, step: dict[str, Any], static, arr: NDArray[numpy.uint8]):
+        if static is not None:
+            return static
+        ext = self._ext(stage, step["name"])
+        threads = self.pipe.tasks if self.pipe.tasks > 0 else self.pipe.plproc.get_threads()
+        return ext[EXT_OP_EXT].batch_update(step.get("save"), arr, threads, ext[EXT_OP_CDLL])
+
+    def run(self, img: NDArray[numpy.uint8]) -> NDArray[numpy.uint8]:
+        """处理一张图片，返回输出数据。返回的数组会在下一次调用时被覆写。  
+        处理链编译成执行计划(见`ExecPlan`)，尺寸相同的图片直接复用，不再协商形状与分配缓冲区。
+        每个需要batch_update的项开始新的一段：前面的段执行完后，才用它的实际输入生成参数"""
+        if self.pipe is None:
+            self.pipe = Img2arrPIPE(img, self.extdc)
+            # 每张图片都不同，缓存不会命中
+            self.pipe.cache = None
+        else:
+            self.pipe.set_img(img)
+        pipe = self.pipe
+        items = self.items
+        plan = pipe.Plan(self.chain_key, len(self.chain["prep"]))
+        start = 0
+        while start < len(items):
+            stop = start + 1
+            while stop < len(items) and items[stop][2] is not None:
+                stop += 1
+            stage, step, static = items[start]
+            arg, _ = self._args(stage, step, static, plan.entry_input(start))
+            if start < plan.compiled and not plan.bind(start, arg):
+                # 新参数使输出形状变化，从这一项起重新编译
+                plan.truncate(start)
+            if start >= plan.compiled:
+                plan.extend([(stage, step["name"], arg)] + [(s, st["name"], a[0]) for s, st, a in items[start + 1:stop]])
+            plan.check(start, plan.run(start, stop))
+            start = stop
+        # 内存紧张时不保留计划的中间缓冲区
+        if buffer_pool.pressure():
+            pipe.release_plan()
+        return pipe.out
+
+    def close(self):
+        if self.pipe is not None:
+            self.pipe.close()
+            self.pipe = None
+
 def Close():
     """退出清理"""
     pass
\ No newline at end of file
@@ -0,0 +1,428 @@
+# Img2arr基准测试(无界面)
+# 用法：
+#     python bench.py ext [-s 256 1080p 4K] [-j 最大线程数] [-r 重复次数] [-e 用例...] [-o 结果.json] [-b 基线.json] [-t 容差]
+#         逐个扩展比较f0(单核)与f1/f1r(1/2/4/.../N线程)的耗时。结果可保存为JSON，并与之前保存的基线比较，
+#         有用例变慢超过容差时返回1。256尺寸下的耗时主要是线程池的调度开销
+#     python bench.py alloc [-s 1080p 4K] [-j 线程数] [-r 重复次数]
+#         比较管线数组的分配方式(numpy默认/按64字节对齐/对齐+透明大页)对每个预处理扩展的影响
+
+import argparse
+import ctypes
+import json
+import logging
+import os, sys
+import platform
+import statistics
+import time
+from typing import Any, Callable
+
+import numpy
+from numpy.typing import NDArray
+
+import backend
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+SIZES: dict[str, tuple[int, int]] = {
+    "256": (256, 256),
+    "1080p": (1080, 1920),
+    "4K": (2160, 3840),
+    "16K": (8640, 15360),
+}
+"""图片尺寸(高, 宽)"""
+
+ALLOC_MODES: dict[str, tuple[bool, bool]] = {
+    "numpy": (False, False),
+    "aligned": (True, False),
+    "hugepage": (True, True),
+}
+"""分配方式 -> `backend.SetAlignedAlloc()`的参数"""
+
+ArgsBuilder = Callable[[backend.ExtMain, tuple[int, int], int], tuple[Any, int]]
+
+def args_brightness(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    # uint8_t[op, absval, opr, opg, opb, opa]
+    arg = (ctypes.c_uint8 * 6)(0, 20, 1, 1, 1, 0)
+    return arg, 6
+
+def args_contrast(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    arg = ext[backend.EXT_OP_EXT].UI.arg_t(True, 130, 128, 128, 128)
+    return ctypes.byref(arg), ctypes.sizeof(arg)
+
+def args_hsv(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    dll = ext[backend.EXT_OP_CDLL]
+    dll.atomic_init_size_t.argtypes = [ctypes.POINTER(ctypes.c_size_t), ctypes.c_size_t]
+    dll.atomic_init_size_t.restype = ctypes.POINTER(ctypes.c_size_t)
+    h_buffer = (ctypes.c_float * (shape[0] * shape[1]))(numpy.nan)
+    h_buffer_sync = (ctypes.c_size_t * 1)()
+    dll.atomic_init_size_t(h_buffer_sync, threads)
+    arg = ext[backend.EXT_OP_EXT].UI.args_t(
+        H_change=0.1, S_change=0.2, V_change=0, exception_process=0, smart_fillH=False,
+        EXCEPT_SET_H_value=0.0, h_buffer=h_buffer, h_buffer_sync=h_buffer_sync, pre_write_h=False, step=1,
+        scan_8_ways=True, sample_times=5, mad_k=3.0, S_thr=-1.0, ignore_npixels=False)
+    return ctypes.byref(arg), ctypes.sizeof(arg)
+
+def args_histogram(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    n = 256 * threads if threads > 1 else 256
+    channels = [(ctypes.c_uint64 * n)() for _ in range(4)]
+    done = (ctypes.c_size_t * 1)()
+    # R、G、B、A与完成计数。ext.py需要QtCharts，这里直接按相同的布局构造
+    arg = (ctypes.c_void_p * 5)(*(ctypes.addressof(c) for c in (*channels, done)))
+    arg._keep = (channels, done)
+    return arg, ctypes.sizeof(arg)
+
+def args_hsv_smart_fill(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    """智能填充色相(8方向扫描)，先预计算h_buffer"""
+    dll = ext[backend.EXT_OP_CDLL]
+    dll.atomic_init_size_t.argtypes = [ctypes.POINTER(ctypes.c_size_t), ctypes.c_size_t]
+    dll.atomic_init_size_t.restype = ctypes.POINTER(ctypes.c_size_t)
+    h_buffer = (ctypes.c_float * (shape[0] * shape[1]))()
+    numpy.ctypeslib.as_array(h_buffer)[:] = numpy.nan
+    h_buffer_sync = (ctypes.c_size_t * 1)()
+    dll.atomic_init_size_t(h_buffer_sync, threads)
+    arg = ext[backend.EXT_OP_EXT].UI.args_t(
+        H_change=0.1, S_change=0.2, V_change=0, exception_process=0, smart_fillH=True,
+        EXCEPT_SET_H_value=0.0, h_buffer=h_buffer, h_buffer_sync=h_buffer_sync, pre_write_h=True, step=1,
+        scan_8_ways=True, sample_times=5, mad_k=3.0, S_thr=0.05, ignore_npixels=False)
+    return ctypes.byref(arg), ctypes.sizeof(arg)
+
+def args_hsv_pyramid(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    """智能填充色相(多尺度金字塔)"""
+    dll = ext[backend.EXT_OP_CDLL]
+    dll.hue_pyramid_size.argtypes = [ctypes.POINTER(ctypes.c_size_t)]
+    dll.hue_pyramid_size.restype = ctypes.c_size_t
+    ref, size = args_hsv_smart_fill(ext, shape, threads)
+    in_shape = (ctypes.c_size_t * 2)(*shape)
+    hue_pyramid = (ctypes.c_float * dll.hue_pyramid_size(in_shape))()
+    ref._obj.h_buffer = None
+    ref._obj.hue_pyramid = hue_pyramid
+    return ref, size
+
+_hsv_lut: Any = None
+
+def args_hsv_lut(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    """与args_hsv相同，并启用查找表。查找表在各次调用间复用，测得的是参数不变时重复计算的耗时"""
+    global _hsv_lut
+    if _hsv_lut is None:
+        _hsv_lut = ext[backend.EXT_OP_EXT].RgbLut(ext[backend.EXT_OP_CDLL], ())
+    ref, size = args_hsv(ext, shape, threads)
+    ref._obj.rgb_lut = _hsv_lut.ptr
+    return ref, size
+
+def args_zoom(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    dll = ext[backend.EXT_OP_CDLL]
+    dll.atomic_init_size_t.argtypes = [ctypes.POINTER(ctypes.c_size_t), ctypes.c_size_t]
+    dll.atomic_init_size_t.restype = ctypes.POINTER(ctypes.c_size_t)
+    thread_lock = (ctypes.c_size_t * 1)()
+    dll.atomic_init_size_t(thread_lock, threads)
+    # 双线性插值放大到1.5倍
+    arg = ext[backend.EXT_OP_EXT].UI.args_t(1.5, 1.5, 1, 0, 0, 0, 0, False, None, None, thread_lock)
+    return ctypes.byref(arg), ctypes.sizeof(arg)
+
+def args_zoom_lanczos(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    """Lanczos插值放大到1.5倍，卷积核[-3, 3]，启用LUT优化"""
+    dll = ext[backend.EXT_OP_CDLL]
+    dll.atomic_init_size_t.argtypes = [ctypes.POINTER(ctypes.c_size_t), ctypes.c_size_t]
+    dll.atomic_init_size_t.restype = ctypes.POINTER(ctypes.c_size_t)
+    thread_lock = (ctypes.c_size_t * 1)()
+    dll.atomic_init_size_t(thread_lock, threads)
+    out_h, out_w = round(shape[0] * 1.5), round(shape[1] * 1.5)
+    lut_x = (ctypes.c_float * (out_w * 7))()
+    lut_y = (ctypes.c_float * (out_h * 7))()
+    arg = ext[backend.EXT_OP_EXT].UI.args_t(1.5, 1.5, 3, -3, 3, -3, 3, True, lut_x, lut_y, thread_lock)
+    return ctypes.byref(arg), ctypes.sizeof(arg)
+
+def args_zoom_area(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    """区域平均缩小到1/8"""
+    arg = ext[backend.EXT_OP_EXT].UI.args_t(0.125, 0.125, 4, 0, 0, 0, 0, False, None, None, None)
+    return ctypes.byref(arg), ctypes.sizeof(arg)
+
+def args_none(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    """没有参数的扩展"""
+    return backend.args_from_bytes(b"")
+
+def args_single(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    # 取R通道
+    arg = (ctypes.c_uint * 1)(0)
+    return arg, ctypes.sizeof(arg)
+
+def args_common_format(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    # RGB565，不使用LUT
+    arg = ext[backend.EXT_OP_EXT].UI.args_t(mode=1, lut=None, use_lut_in_preview=False)
+    return ctypes.byref(arg), ctypes.sizeof(arg)
+
+def args_array(ext: backend.ExtMain, shape: tuple[int, int], threads: int):
+    # 与批处理相同的默认格式(十六进制，C数组)
+    return ext[backend.EXT_OP_EXT].batch_update(None, None, threads, ext[backend.EXT_OP_CDLL])
+
+PREP_ARGS: dict[str, ArgsBuilder] = {
+    "Brightness": args_brightness,
+    "Contrast": args_contrast,
+    "HSV": args_hsv,
+    "Histogram": args_histogram,
+    "Zoom": args_zoom,
+}
+"""预处理扩展的典型参数。每次调用前重新生成(部分扩展的参数中带有一次性的同步计数)"""
+
+CASES: dict[str, tuple[int, str, ArgsBuilder]] = {
+    "Brightness": (backend.EXT_TYPE_PREP, "Brightness", args_brightness),
+    "Contrast": (backend.EXT_TYPE_PREP, "Contrast", args_contrast),
+    "HSV": (backend.EXT_TYPE_PREP, "HSV", args_hsv),
+    "HSV-lut": (backend.EXT_TYPE_PREP, "HSV", args_hsv_lut),
+    "HSV-smartfill": (backend.EXT_TYPE_PREP, "HSV", args_hsv_smart_fill),
+    "HSV-pyramid": (backend.EXT_TYPE_PREP, "HSV", args_hsv_pyramid),
+    "Histogram": (backend.EXT_TYPE_PREP, "Histogram", args_histogram),
+    "Zoom-bilinear": (backend.EXT_TYPE_PREP, "Zoom", args_zoom),
+    "Zoom-lanczos": (backend.EXT_TYPE_PREP, "Zoom", args_zoom_lanczos),
+    "Zoom-area": (backend.EXT_TYPE_PREP, "Zoom", args_zoom_area),
+    "RGB": (backend.EXT_TYPE_CODE, "RGB", args_none),
+    "GRAY": (backend.EXT_TYPE_CODE, "GRAY", args_none),
+    "Single": (backend.EXT_TYPE_CODE, "Single", args_single),
+    "CommonFormat": (backend.EXT_TYPE_CODE, "Common Format Set", args_common_format),
+    "Array": (backend.EXT_TYPE_OUT, "Array", args_array),
+}
+"""`ext`子命令的用例：用例名 -> (扩展类型, 扩展名, 参数)。输出扩展的输入为随机的编码结果(每像素3字节)"""
+
+def get_out_info(dll: ctypes.CDLL, args: Any, in_shape: tuple[int, ...], out_ndim: int = 2) -> tuple[tuple[int, ...], int]:
+    """调用io_GetOutInfo，返回(输出形状, 属性)。预处理的输出为二维，编码与输出为一维"""
+    in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
+    out_shape_ct = (ctypes.c_size_t * out_ndim)()
+    attr = ctypes.c_int(0)
+    ret = dll.io_GetOutInfo(args, in_shape_ct, out_shape_ct, ctypes.byref(attr))
+    if ret != 0:
+        raise RuntimeError(f"io_GetOutInfo返回错误码{ret}")
+    return tuple(out_shape_ct), attr.value
+
+def bench_prep(plproc: backend.PlProc, ext: backend.ExtMain, name: str, img: NDArray[numpy.uint8],
+               threads: int, repeat: int) -> tuple[float, float]:
+    """在新分配的数组上运行预处理扩展，返回(首次耗时, 最短耗时)。首次耗时包含缺页开销"""
+    dll = ext[backend.EXT_OP_CDLL]
+    shape = (img.shape[0], img.shape[1])
+    in_arr = backend.aligned_empty(img.shape)
+    numpy.copyto(in_arr, img)
+    args, arglen = PREP_ARGS[name](ext, shape, threads)
+    out_shape, attr = get_out_info(dll, args, shape)
+    out_buf = None if attr == backend.PRE_ATTRS.ATTR_READONLY else backend.MidBuffer(backend.aligned_empty((*out_shape, 4)))
+    in_buf = backend.MidBuffer(in_arr)
+    times = []
+    for _ in range(repeat + 1):
+        args, arglen = PREP_ARGS[name](ext, shape, threads)
+        t = time.perf_counter()
+        backend.call_processor(plproc, 0, name, dll, args, in_buf, out_buf)
+        times.append(time.perf_counter() - t)
+    return times[0], min(times[1:])
+
+def cmd_alloc(sizes: list[str], threads: int, repeat: int, names: list[str] | None) -> int:
+    backend.SetParallelThreads(threads)
+    extdc = backend.load_exts(lambda _: None, lambda path, err: logger.error(f"加载扩展 {path} 失败: {err}"))
+    prep = extdc[backend.EXT_TYPE_PREP]["img"]
+    names = [name for name in (names or PREP_ARGS) if name in prep and name in PREP_ARGS]
+    plproc = backend.shared_pool.acquire()
+    n_threads = plproc.get_threads()
+    rng = numpy.random.default_rng(0)
+    try:
+        print(f"线程数 {n_threads}，透明大页阈值 {backend.HUGEPAGE_THRESHOLD // 1024} KiB")
+        print(f"{'扩展':<12}{'尺寸':<8}" + "".join(f"{mode + ' 首次/最短(ms)':>28}" for mode in ALLOC_MODES))
+        for size in sizes:
+            h, w = SIZES[size]
+            img = rng.integers(0, 256, (h, w, 4), dtype=numpy.uint8)
+            for name in names:
+                row = f"{name:<12}{size:<8}"
+                for aligned, hugepage in ALLOC_MODES.values():
+                    backend.SetAlignedAlloc(aligned, hugepage)
+                    first, best = bench_prep(plproc, prep[name], name, img, n_threads, repeat)
+                    row += f"{first * 1000:>18.2f} / {best * 1000:>7.2f}"
+                print(row)
+    finally:
+        backend.SetAlignedAlloc(True, True)
+        plproc.close()
+    return 0
+
+def thread_counts(n: int) -> list[int]:
+    """1, 2, 4, ...，最后一项为n"""
+    counts = []
+    t = 1
+    while t < n:
+        counts.append(t)
+        t *= 2
+    counts.append(n)
+    return counts
+
+def make_input(stage: int, shape: tuple[int, int], rng: numpy.random.Generator) -> backend.MidBuffer:
+    """随机输入。预处理与编码为(高, 宽, 4)的图片，输出为每像素3字节的编码结果"""
+    if stage == backend.EXT_TYPE_OUT:
+        arr = backend.aligned_empty((shape[0] * shape[1] * 3,))
+    else:
+        arr = backend.aligned_empty((*shape, 4))
+    arr[...] = rng.integers(0, 256, arr.shape, dtype=numpy.uint8)
+    return backend.MidBuffer(arr)
+
+def make_output(stage: int, dll: ctypes.CDLL, args: Any, in_buf: backend.MidBuffer) -> backend.MidBuffer | None:
+    """按io_GetOutInfo分配输出。只读的预处理没有输出"""
+    if stage == backend.EXT_TYPE_PREP:
+        out_shape, attr = get_out_info(dll, args, in_buf.arr.shape[:-1])
+        if attr == backend.PRE_ATTRS.ATTR_READONLY:
+            return None
+        return backend.MidBuffer(backend.aligned_empty((*out_shape, 4)))
+    in_shape = in_buf.arr.shape if stage == backend.EXT_TYPE_OUT else in_buf.arr.shape[:-1]
+    out_shape, _ = get_out_info(dll, args, in_shape, 1)
+    return backend.MidBuffer(backend.aligned_empty(out_shape))
+
+def run_path(plproc: backend.PlProc, path: str, name: str, dll: ctypes.CDLL, args: Any,
+             in_buf: backend.MidBuffer, out_buf: backend.MidBuffer | None) -> int:
+    """用指定的方式(f0/f1/f1r)调用一次扩展，返回第一个非0的返回值"""
+    in_shape = in_buf.arr.shape if in_buf.arr.ndim == 1 else in_buf.arr.shape[:-1]
+    in_shape_ct = (ctypes.c_size_t * len(in_shape))(*in_shape)
+    outbuf_ptr = out_buf.arrptr if out_buf is not None else ctypes.cast(0, ctypes.POINTER(ctypes.c_uint8))
+    caller = name.encode("utf-8")
+    if path == "f0":
+        ret = ctypes.c_int(0)
+        plproc.f0(caller, dll.f0, args, ctypes.byref(ret), in_buf.arrptr, outbuf_ptr, in_shape_ct)
+        return ret.value
+    ret_list = numpy.zeros(plproc.get_threads(), dtype=numpy.intc)
+    ret_ptr = ret_list.ctypes.data_as(ctypes.POINTER(ctypes.c_int))
+    if path == "f1":
+        plproc.f1(caller, dll.f1, args, ret_ptr, in_buf.arrptr, outbuf_ptr, in_shape_ct, 0)
+    else:
+        plproc.f1r(caller, dll.f1r, args, ret_ptr, in_buf.arrptr, outbuf_ptr, in_shape_ct,
+                   in_shape[0], 0, backend.get_f1r_phases(dll))
+    errors = ret_list[ret_list != 0]
+    return int(errors[0]) if errors.size else 0
+
+def bench_case(plproc: backend.PlProc, path: str, ext: backend.ExtMain, stage: int, name: str, build: ArgsBuilder,
+               in_buf: backend.MidBuffer, repeat: int) -> dict[str, Any]:
+    """预热一次后重复repeat次，返回最短/中位耗时(毫秒)与吞吐(输入+输出，MB/s)"""
+    dll = ext[backend.EXT_OP_CDLL]
+    shape = in_buf.arr.shape[:2] if in_buf.arr.ndim > 1 else (in_buf.arr.shape[0], 1)
+    threads = 1 if path == "f0" else plproc.get_threads()
+    args, _ = build(ext, shape, threads)
+    out_buf = make_output(stage, dll, args, in_buf)
+    times = []
+    for _ in range(repeat + 1):
+        # 参数中的同步计数是一次性的，每次重新生成
+        args, _ = build(ext, shape, threads)
+        t = time.perf_counter()
+        ret = run_path(plproc, path, name, dll, args, in_buf, out_buf)
+        times.append(time.perf_counter() - t)
+        # 编码与输出扩展的返回值没有约定(可能不返回)，只检查预处理
+        if ret != 0 and stage == backend.EXT_TYPE_PREP:
+            raise RuntimeError(f"{name} {path}返回错误码{ret}")
+    best, median = min(times[1:]), statistics.median(times[1:])
+    nbytes = in_buf.arr.nbytes + (out_buf.arr.nbytes if out_buf is not None else 0)
+    return {"best_ms": best * 1000, "median_ms": median * 1000, "mb_s": nbytes / best / 1e6}
+
+COMPARE_MIN_MS = 0.1
+"""比较基线时忽略绝对差值小于此值(毫秒)的变化，它们主要是计时噪声"""
+
+def result_key(result: dict[str, Any]) -> str:
+    return f"{result['case']}/{result['size']}/{result['path']}/{result['threads']}"
+
+def compare_baseline(results: list[dict[str, Any]], baseline: dict[str, Any], tolerance: float) -> int:
+    """与基线比较最短耗时，打印变化超过容差的用例，返回变慢的用例数"""
+    base = {result_key(r): r for r in baseline["results"]}
+    slower = 0
+    print(f"\n与基线比较(容差 {tolerance:.0%})：")
+    for result in results:
+        old = base.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result["best_ms"] / max(old["best_ms"], 1e-9)
+        if abs(result["best_ms"] - old["best_ms"]) < COMPARE_MIN_MS:
+            continue
+        if ratio > 1 + tolerance:
+            slower += 1
+            print(f"  变慢 {result_key(result):<40}{old['best_ms']:>10.2f} -> {result['best_ms']:>10.2f} ms  x{ratio:.2f}")
+        elif ratio < 1 / (1 + tolerance):
+            print(f"  变快 {result_key(result):<40}{old['best_ms']:>10.2f} -> {result['best_ms']:>10.2f} ms  x{ratio:.2f}")
+    missing = base.keys() - {result_key(r) for r in results}
+    if missing:
+        print(f"  基线中有 {len(missing)} 项本次没有运行")
+    print(f"  {slower} 项变慢" if slower else "  没有变慢的用例")
+    return slower
+
+def cmd_ext(sizes: list[str], max_threads: int, repeat: int, cases: list[str] | None,
+            out_path: str | None, baseline_path: str | None, tolerance: float) -> int:
+    backend.SetParallelThreads(max_threads)
+    extdc = backend.load_exts(lambda _: None, lambda path, err: logger.error(f"加载扩展 {path} 失败: {err}"))
+    baseline = None
+    if baseline_path is not None:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    selected = []
+    for case in cases or CASES:
+        stage, name, build = CASES[case]
+        ext = extdc[stage]["img"].get(name)
+        if ext is None:
+            logger.warning(f"扩展 {name} 未加载，跳过用例 {case}")
+            continue
+        selected.append((case, stage, name, build, ext))
+    plprocs = {t: backend.PlProc(t) for t in thread_counts(backend.threads)}
+    rng = numpy.random.default_rng(0)
+    results: list[dict[str, Any]] = []
+    print(f"{'用例':<16}{'尺寸':<8}{'方式':<6}{'线程':>6}{'最短(ms)':>12}{'中位(ms)':>12}{'MB/s':>10}{'加速比':>8}")
+    for size in sizes:
+        shape = SIZES[size]
+        inputs: dict[int, backend.MidBuffer] = {}
+        for case, stage, name, build, ext in selected:
+            if stage not in inputs:
+                inputs[stage] = make_input(stage, shape, rng)
+            dll = ext[backend.EXT_OP_CDLL]
+            runs = [("f0", 1)] if hasattr(dll, "f0") else []
+            for path in ("f1", "f1r"):
+                if hasattr(dll, path) and (path != "f1r" or backend.CORE_HAS_RANGE):
+                    runs += [(path, t) for t in plprocs]
+            f0_ms = None
+            for path, t in runs:
+                try:
+                    result = bench_case(plprocs[t], path, ext, stage, name, build, inputs[stage], repeat)
+                except Exception as e:
+                    logger.error(f"{case} {size} {path} x{t} 失败: {e}")
+                    continue
+                if path == "f0":
+                    f0_ms = result["best_ms"]
+                result = {"case": case, "ext": name, "size": size, "path": path, "threads": t, **result}
+                results.append(result)
+                speedup = f"{f0_ms / result['best_ms']:.2f}" if f0_ms is not None else "-"
+                print(f"{case:<16}{size:<8}{path:<6}{t:>6}{result['best_ms']:>12.2f}{result['median_ms']:>12.2f}{result['mb_s']:>10.0f}{speedup:>8}")
+        inputs.clear()
+    # 结束各线程池
+    plprocs.clear()
+    if out_path is not None:
+        meta = {"time": time.strftime("%Y-%m-%d %H:%M:%S"), "platform": platform.platform(), "machine": platform.machine(),
+                "cpus": os.cpu_count(), "max_threads": backend.threads, "python": platform.python_version(),
+                "numpy": numpy.__version__, "repeat": repeat}
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "results": results}, f, ensure_ascii=False, indent=1)
+        print(f"结果已保存到 {out_path}")
+    if baseline is not None and compare_baseline(results, baseline, tolerance) > 0:
+        return 1
+    return 0
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="bench", description="Img2arr 基准测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_ext = sub.add_parser("ext", help="比较各扩展单核(f0)与多核(f1/f1r)在不同线程数下的耗时")
+    p_ext.add_argument("-s", "--sizes", nargs="+", choices=SIZES, default=["256", "1080p", "4K"], help="图片尺寸")
+    p_ext.add_argument("-j", "--threads", type=int, default=0, help="最大线程数，测试1, 2, 4, ...直到它。0表示使用CPU核心数")
+    p_ext.add_argument("-r", "--repeat", type=int, default=5, help="重复次数(不含预热)")
+    p_ext.add_argument("-e", "--cases", nargs="+", choices=CASES, help="只运行这些用例")
+    p_ext.add_argument("-o", "--out", help="将结果保存为JSON，可作为之后比较的基线")
+    p_ext.add_argument("-b", "--baseline", help="与之前保存的结果比较，有用例变慢时返回1")
+    p_ext.add_argument("-t", "--tolerance", type=float, default=0.1, help="比较基线时允许的变慢比例")
+
+    p_alloc = sub.add_parser("alloc", help="比较管线数组的分配方式对各预处理扩展的影响")
+    p_alloc.add_argument("-s", "--sizes", nargs="+", choices=SIZES, default=["1080p", "4K"], help="图片尺寸")
+    p_alloc.add_argument("-j", "--threads", type=int, default=0, help="线程数。0表示使用CPU核心数")
+    p_alloc.add_argument("-r", "--repeat", type=int, default=5, help="重复次数(不含首次)")
+    p_alloc.add_argument("-e", "--exts", nargs="+", help="只测试这些预处理扩展")
+
+    args = parser.parse_args(argv)
+    if args.command == "ext":
+        return cmd_ext(args.sizes, args.threads, args.repeat, args.cases, args.out, args.baseline, args.tolerance)
+    if args.command == "alloc":
+        return cmd_alloc(args.sizes, args.threads, args.repeat, args.exts)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from numpy import uint8, zeros
+from numpy import uint8, zeros, array
 from numpy.typing import NDArray
 from ctypes import CDLL, c_int, c_uint8, c_bool, c_size_t, c_char_p, POINTER, Structure, cast, byref, sizeof
 import weakref
@@ -15,7 +15,24 @@ import logging, os.path
 
 logger = logging.getLogger(os.path.basename(os.path.dirname(__file__)))
 
-    
+def make_args(mode: int, lut: NDArray[uint8] | None, use_lut_in_preview: bool) -> "UI.args_t":
+    """lut为None时不使用LUT"""
+    args = UI.args_t(mode=mode)
+    if lut is None: args.lut = None
+    else:
+        args.lut = lut.ctypes.data_as(POINTER(c_uint8))
+        # 计算可能晚于下一次update，由参数持有LUT
+        args._lut = lut
+    args.use_lut_in_preview = use_lut_in_preview and lut is not None
+    return args
+
+def batch_update(save: dict | None, arr, threads: int, ext: CDLL):
+    """无界面批处理时生成参数。save为`UI.ui_save()`的返回值，LUT的内容保存在其中，不再读取LUT文件"""
+    save = save or {}
+    lut = save.get("lut") if save.get("use_lut") else None
+    args = make_args(save.get("mode", 1), None if lut is None else array(lut, dtype=uint8), save.get("lut_in_preview", False))
+    return byref(args), sizeof(args)
+
 class UI(abcExt.UI):
     def __init__(self):
         pass
@@ -183,16 +200,15 @@ class UI(abcExt.UI):
 
 
     def update(self, arr, threads: int):
-        fmt_enum = self.list.currentIndex()
-        # fmt_enum_ct = c_int(fmt_enum)
-        # return byref(fmt_enum_ct), sizeof(fmt_enum_ct)
-        args = UI.args_t(mode=fmt_enum)
-        args.mode = fmt_enum
-        if self.lut is None or not self.use_lut.isChecked(): args.lut = None
-        else: 
-            args.lut = self.lut.ctypes.data_as(POINTER(c_uint8))
-            print("使用LUT")
-        args.use_lut_in_preview = self.lut_in_preview.isChecked() and self.use_lut.isChecked()
+        use_lut = self.lut is not None and self.use_lut.isChecked()
+        if use_lut: print("使用LUT")
+        args = make_args(self.list.currentIndex(), self.lut if use_lut else None, self.lut_in_preview.isChecked())
         return byref(args), sizeof(args)
 
-
+    def ui_save(self) -> dict | None:
+        return {
+            "mode": self.list.currentIndex(),
+            "use_lut": self.use_lut.isChecked(),
+            "lut": None if self.lut is None else self.lut.tolist(),
+            "lut_in_preview": self.lut_in_preview.isChecked(),
+        }
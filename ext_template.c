@@ -44,7 +44,12 @@ enum ExtAttr{
         只读扩展。保证函数的输出缓冲区是NULL。
         Read-only extension. Ensure that the output buffer of the function is NULL.
     */
-    ATTR_READONLY = 2
+    ATTR_READONLY = 2,
+    /*
+        逐像素扩展(REUSE的进阶)。每个输出像素只取决于同一位置的输入像素，且输出形状与输入相同。若同时提供了`f1r`，连续的逐像素扩展会被融合执行。
+        Point-wise extension. Each output pixel depends only on the input pixel at the same position, and the output shape equals the input shape. If `f1r` is also provided, consecutive point-wise extensions are executed fused.
+    */
+    ATTR_POINTWISE = 3
 
 };
 
@@ -94,6 +99,27 @@ SHARED int io_GetOutInfo(args_t* args, size_t in_shape[ ], size_t out_shape[ ],
     return 0;
 }
 
+/**
+ * @brief 可选。输入中的矩形区域变化时，输出中受影响的区域。预处理管线据此只重算受影响的行(性能模式)。仅在预处理阶段扩展中有效。
+ * Optional. The region of the output affected when a rectangular region of the input changes. The preprocessing pipeline uses it to recompute only the affected rows (speed mode). Only valid in the preprocessing stage extension.
+ * @param args[in] 参数解析结构体。
+ * Parameter parsing structure.
+ * @param in_shape[in] 输入缓冲区形状。
+ * Input buffer shape.
+ * @param in_region[in] 输入中变化的区域`[y0, x0, y1, x1)`。
+ * The changed region of the input, `[y0, x0, y1, x1)`.
+ * @param out_region[out] 输出中受影响的区域`[y0, x0, y1, x1)`。
+ * The affected region of the output, `[y0, x0, y1, x1)`.
+ * @return 0表示成功；非0表示无法确定，此时整张图重算。
+ * 0 means success; non-0 means unknown, and the whole image will be recomputed.
+ * @note 没有此函数时，`ATTR_POINTWISE`与`ATTR_READONLY`扩展的区域不变，其余扩展整张图重算。
+ * Without this function, the region is unchanged for `ATTR_POINTWISE` and `ATTR_READONLY` extensions, and other extensions recompute the whole image.
+ */
+SHARED int io_GetOutRegion(args_t* args, size_t in_shape[ ], size_t in_region[4], size_t out_region[4]){
+    // Implement here.
+    return -1;
+}
+
 
 /**
  * @brief 主函数：多线程实现。
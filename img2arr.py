@@ -0,0 +1,280 @@
+# Img2arr的命令行部分
+# 无界面批处理：按照保存的批处理链，对一批图片依次执行 预处理 → 编码 → 输出
+
+import argparse
+import glob
+import logging
+import logging.config
+import json
+import os, sys
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.util import Finalize
+
+import numpy
+from numpy.typing import NDArray
+
+from PIL import Image
+
+# 设置Image不限大小加载图片
+Image.MAX_IMAGE_PIXELS = None
+
+import backend
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+self_dir = os.path.dirname(__file__)
+
+def setup_logging():
+    with open(os.path.join(self_dir, "logging_config.json"), "r", encoding="utf-8") as f:
+        logging.config.dictConfig(json.load(f))
+
+def expand_inputs(inputs: list[str]) -> list[str]:
+    """展开输入：目录(不递归)、通配符或文件"""
+    image_exts = set(Image.registered_extensions().keys())
+    files: list[str] = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                path = os.path.join(item, name)
+                if os.path.isfile(path) and os.path.splitext(name)[1].lower() in image_exts:
+                    files.append(path)
+        elif glob.has_magic(item):
+            files.extend(sorted(p for p in glob.glob(item, recursive=True) if os.path.isfile(p)))
+        else:
+            files.append(item)
+    # 去重，保持顺序
+    return list(dict.fromkeys(files))
+
+def output_paths(files: list[str], out_dir: str, suffix: str) -> list[str]:
+    """每张图片的输出路径：输出目录下的同名文件(去掉扩展名，加上后缀)。  
+    不同输入得到同一个输出路径时(如a/x.png与b/x.jpg)抛出ValueError，避免结果互相覆盖"""
+    out_paths = [os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + suffix) for path in files]
+    owners: dict[str, list[str]] = {}
+    for path, out_path in zip(files, out_paths):
+        owners.setdefault(os.path.normcase(os.path.abspath(out_path)), []).append(path)
+    collisions = [paths for paths in owners.values() if len(paths) > 1]
+    if collisions:
+        lines = "\n".join(", ".join(paths) for paths in collisions)
+        raise ValueError(f"以下输入的输出文件名相同，会互相覆盖。请分开处理或改名：\n{lines}")
+    return out_paths
+
+def load_img(path: str) -> NDArray[numpy.uint8]:
+    return numpy.array(Image.open(path).convert("RGBA"), dtype=numpy.uint8)
+
+# 调度
+# 小图(如大量32×32的字模)的单张计算量很小，单图内多线程的调用与排队开销会超过计算本身，因此改为按图片分派到多个进程，每个进程单线程；
+# 大图仍在主进程中逐张处理，单图内多线程。
+PROCESS_FANOUT_MAX_PIXELS = 256 * 256
+"""单张图片像素数不超过该值时，按图片分派到多个进程"""
+
+BATCH_MODE_AUTO = "auto"
+BATCH_MODE_THREADS = "threads"
+BATCH_MODE_PROCESSES = "processes"
+BATCH_MODES = (BATCH_MODE_AUTO, BATCH_MODE_THREADS, BATCH_MODE_PROCESSES)
+
+def img_pixels(path: str) -> int:
+    """只读取文件头获取像素数。无法读取时返回0(交给后续处理报错)"""
+    try:
+        with Image.open(path) as img:
+            return img.width * img.height
+    except Exception:
+        return 0
+
+def new_engine(chain: dict, threads: int) -> backend.Img2arrBatch:
+    """设置线程数，加载扩展并创建批处理引擎"""
+    backend.SetParallelThreads(threads)
+    def errf(path: str, err: Exception):
+        logger.error(f"加载扩展 {path} 失败: {err}")
+    # 控制台插件仍会被加载(可能需要其batch_update)，但不会创建UI
+    extdc = backend.load_exts(lambda _: None, errf)
+    return backend.Img2arrBatch(extdc, chain)
+
+def convert(engine: backend.Img2arrBatch, path: str, out_path: str) -> tuple[int, int]:
+    """处理一张图片并写出结果，返回(输入字节数, 输出字节数)"""
+    img = load_img(path)
+    out = engine.run(img)
+    out.tofile(out_path)
+    logger.debug(f"{path} -> {out_path}")
+    return img.nbytes, out.nbytes
+
+class BatchStats:
+    """批处理统计"""
+    def __init__(self):
+        self.done = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+    def add(self, ok: bool, bytes_in: int = 0, bytes_out: int = 0):
+        if ok:
+            self.done += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+        else:
+            self.failed += 1
+    def report(self, elapsed: float) -> str:
+        elapsed = max(elapsed, 1e-9)
+        return (f"完成 {self.done}/{self.done + self.failed} 张图片，耗时 {elapsed:.3f}s，"
+                f"吞吐 {self.done / elapsed:.1f} 张/s，"
+                f"输入 {self.bytes_in / elapsed / 1e6:.2f} MB/s，输出 {self.bytes_out / elapsed / 1e6:.2f} MB/s")
+
+# 工作进程中的引擎。每个工作进程只加载一次扩展
+_worker_engine: backend.Img2arrBatch | None = None
+# 各工作进程正在处理的图片索引(-1表示空闲)，以及本进程在其中的位置。工作进程崩溃时主进程据此报告是哪张图片
+_worker_slots = None
+_worker_slot = 0
+
+def _worker_init(chain: dict, slots, slot_counter):
+    global _worker_engine, _worker_slots, _worker_slot
+    # spawn启动的工作进程不会执行__main__中的日志配置
+    setup_logging()
+    with slot_counter.get_lock():
+        _worker_slot = slot_counter.value % len(slots)
+        slot_counter.value += 1
+    _worker_slots = slots
+    _worker_engine = new_engine(chain, 1)
+    # 工作进程以os._exit退出，不会执行atexit。Finalize在此之前执行，释放线程池
+    Finalize(None, _worker_exit, exitpriority=10)
+
+def _worker_exit():
+    global _worker_engine
+    if _worker_engine is not None:
+        _worker_engine.close()
+        _worker_engine = None
+
+def _worker_convert(job: tuple[int, str, str]) -> tuple[str, int, int, str | None]:
+    """工作进程中处理一张图片，返回(路径, 输入字节数, 输出字节数, 错误信息)"""
+    index, path, out_path = job
+    assert _worker_engine is not None and _worker_slots is not None
+    _worker_slots[_worker_slot] = index
+    try:
+        bytes_in, bytes_out = convert(_worker_engine, path, out_path)
+    except Exception:
+        return path, 0, 0, traceback.format_exc()
+    finally:
+        _worker_slots[_worker_slot] = -1
+    return path, bytes_in, bytes_out, None
+
+def batch_processes(chain: dict, files: list[str], out_paths: list[str], processes: int, stats: BatchStats):
+    """按图片分派到多个进程。  
+    工作进程崩溃(如扩展段错误)时进程池不可用：报告崩溃时正在处理的图片，尚未返回结果的图片都计为失败"""
+    processes = min(processes, len(files))
+    logger.info(f"{len(files)} 张图片分派到 {processes} 个进程")
+    # 分片：每个进程大约分到4片，兼顾负载均衡与进程间通信开销
+    chunksize = max(1, len(files) // (processes * 4))
+    jobs = [(index, path, out_path) for index, (path, out_path) in enumerate(zip(files, out_paths))]
+    slots = multiprocessing.Array("q", [-1] * processes)
+    slot_counter = multiprocessing.Value("q", 0)
+    received = 0
+    with ProcessPoolExecutor(processes, initializer=_worker_init, initargs=(chain, slots, slot_counter)) as executor:
+        try:
+            for path, bytes_in, bytes_out, err in executor.map(_worker_convert, jobs, chunksize=chunksize):
+                received += 1
+                if err is not None:
+                    logger.error(f"{path} 处理失败:\n{err}")
+                stats.add(err is None, bytes_in, bytes_out)
+        except BrokenProcessPool:
+            in_flight = [files[index] for index in slots[:] if index >= received]
+            if in_flight:
+                logger.error(f"工作进程异常退出，崩溃时正在处理: {', '.join(in_flight)}")
+            else:
+                logger.error("工作进程异常退出(可能在加载扩展时)")
+            logger.error(f"剩余 {len(files) - received} 张图片计为失败")
+            for _ in range(len(files) - received):
+                stats.add(False)
+
+def batch_threads(chain: dict, files: list[str], out_paths: list[str], threads: int, stats: BatchStats):
+    """在主进程中逐张处理，单图内多线程"""
+    engine = new_engine(chain, threads)
+    logger.info(f"{len(files)} 张图片在主进程中处理，{backend.threads} 线程")
+    try:
+        for path, out_path in zip(files, out_paths):
+            try:
+                bytes_in, bytes_out = convert(engine, path, out_path)
+            except Exception:
+                logger.error(f"{path} 处理失败:", exc_info=True)
+                stats.add(False)
+                continue
+            stats.add(True, bytes_in, bytes_out)
+    finally:
+        engine.close()
+
+def batch(chain_path: str, inputs: list[str], out_dir: str, suffix: str, threads: int,
+          processes: int = 0, mode: str = BATCH_MODE_AUTO, trace: str | None = None) -> int:
+    """执行批处理，返回失败的图片数。批处理链无效或输出文件名冲突时抛出ValueError
+    threads: 单图内的线程数。0表示使用CPU核心数
+    processes: 按图片分派时的进程数。0表示使用CPU核心数
+    mode: 调度方式，见BATCH_MODES。auto时按图片大小自动选择
+    trace: 若指定，启用性能剖析并将记录导出为Chrome trace。只能记录主进程，此时所有图片都在主进程中处理
+    """
+    chain = backend.load_batch_chain(chain_path)
+    files = expand_inputs(inputs)
+    out_paths = dict(zip(files, output_paths(files, out_dir, suffix)))
+    os.makedirs(out_dir, exist_ok=True)
+    if processes <= 0:
+        processes = os.cpu_count() or 1
+
+    if trace is not None:
+        mode = BATCH_MODE_THREADS
+        backend.SetProfiling(True)
+
+    if mode == BATCH_MODE_THREADS or processes == 1:
+        small, large = [], files
+    elif mode == BATCH_MODE_PROCESSES:
+        small, large = files, []
+    else:
+        small, large = [], []
+        for path in files:
+            (small if img_pixels(path) <= PROCESS_FANOUT_MAX_PIXELS else large).append(path)
+        # 只有一张小图时不值得启动进程池
+        if len(small) == 1:
+            large = small + large
+            small = []
+
+    stats = BatchStats()
+    time_start = time.perf_counter()
+    if small:
+        batch_processes(chain, small, [out_paths[path] for path in small], processes, stats)
+    if large:
+        batch_threads(chain, large, [out_paths[path] for path in large], threads, stats)
+    time_end = time.perf_counter()
+    logger.info(stats.report(time_end - time_start))
+    if trace is not None:
+        backend.SetProfiling(False)
+        backend.ExportChromeTrace(trace)
+        logger.info(f"各环节耗时：\n{backend.profiler.report()}")
+        logger.info(f"性能剖析记录已导出到 {trace}")
+    return stats.failed
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="img2arr", description="Img2arr 命令行")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_batch = sub.add_parser("batch", help="按批处理链批量转换图片")
+    p_batch.add_argument("chain", help="批处理链描述文件(JSON)，可在界面中导出")
+    p_batch.add_argument("inputs", nargs="+", help="输入图片、目录或通配符")
+    p_batch.add_argument("-o", "--out-dir", default=".", help="输出目录")
+    p_batch.add_argument("-s", "--suffix", default=".txt", help="输出文件后缀")
+    p_batch.add_argument("-j", "--threads", type=int, default=0, help="单图内的线程数。0表示使用CPU核心数")
+    p_batch.add_argument("-p", "--processes", type=int, default=0, help="按图片分派时的进程数。0表示使用CPU核心数")
+    p_batch.add_argument("-m", "--mode", choices=BATCH_MODES, default=BATCH_MODE_AUTO,
+                         help=f"调度方式：auto按图片大小自动选择(不超过{PROCESS_FANOUT_MAX_PIXELS}像素的图片分派到多个进程)，threads单图内多线程，processes按图片分派到多个进程")
+    p_batch.add_argument("--trace", metavar="PATH",
+                         help="启用性能剖析，结束后输出各环节耗时，并将记录导出为Chrome trace(JSON)。指定时所有图片都在主进程中处理")
+
+    args = parser.parse_args(argv)
+    if args.command == "batch":
+        try:
+            failed = batch(args.chain, args.inputs, args.out_dir, args.suffix, args.threads, args.processes, args.mode, args.trace)
+        except ValueError as e:
+            logger.error(e)
+            return 1
+        return 1 if failed else 0
+    return 0
+
+if __name__ == "__main__":
+    setup_logging()
+    sys.exit(main())
@@ -24,7 +24,7 @@ from PySide6.QtGui import (QCloseEvent,
 
 from PySide6.QtCore import Qt, QTimer, QObject, QMetaObject, QGenericArgument, Signal, QUrl, QRect, QRectF, Slot
 
-from threading import Thread, Condition, Event
+from threading import Thread, Condition, Event, Lock
 
 import queue
 
@@ -90,6 +90,11 @@ pipe_update_mode = backend.PRE_PIPE_MODES.PIPE_MODE_DEFAULT
 # True时，存在内存指针溢出问题
 view_realtime_update = False
 
+# 代理预览。原图远大于预处理预览区域时，参数变化期间先在缩小的原图上计算并显示，
+# 停止操作PROXY_IDLE_TIME秒后再计算原图。编码与输出始终使用原图的结果
+proxy_preview = True
+PROXY_IDLE_TIME = 0.3
+
 DEVICES_DEFAULT = [0, 1, 2, 3]
 
 defaultSetting: dict[str, JsonDataType] = {
@@ -454,12 +459,21 @@ class WinMain(QObject):
                     pipe_update_mode = backend.PRE_PIPE_MODES.PIPE_MODE_DEFAULT
                     logger.debug("切换为默认模式")
             cb.stateChanged.connect(cb_change)
+
+            cb_proxy = QCheckBox("代理预览")
+            cb_proxy.setToolTip("大图调整参数时，先在缩小的图片上计算预览，停止操作后再计算原图")
+            cb_proxy.setChecked(proxy_preview)
+            def cb_proxy_change(state: int):
+                global proxy_preview
+                proxy_preview = state == Qt.CheckState.Checked.value
+            cb_proxy.stateChanged.connect(cb_proxy_change)
                 
     
             # 使用addWidget的alignment参数直接实现居中
             layout.addWidget(in_widget, alignment=Qt.AlignmentFlag.AlignCenter)
             in_layout.addWidget(button)
             in_layout.addWidget(cb)
+            in_layout.addWidget(cb_proxy)
     
             # 添加一个标识，表示这是欢迎页面
             self.setObjectName("welcome")
@@ -635,6 +649,7 @@ class TabNewWindow(QMainWindow):
 class PageMain(QDebugWidget):
     PreOutViewUpdateSignal = Signal(tuple)
     CodeViewerOutViewUpdateSignal = Signal(tuple)
+    BatchChainExportedSignal = Signal(str, str)
     def __init__(self, parent: Optional[QWidget], win: QMainWindow, title: str, pipe: backend.Img2arrPIPE):
         super().__init__(parent)
         self.setObjectName(f"PageMain: {title}")
@@ -649,10 +664,22 @@ class PageMain(QDebugWidget):
         self._pre_stop = Event()
         self.pre_update_notify: Optional[Condition] = Condition()
         self.pre_update_index: int | None = None # 线程更新时的索引。None表示更新完毕。
+        self.pre_running_iter: backend.Pre_iter | None = None # 正在进行的预处理刷新。用于取消过时的计算
+        self.pre_full_index: int | None = None # 代理预览后，原图还需要从这个索引开始更新。None表示原图已是最新
+        self.pre_proxy: backend.Img2arrPIPE | None = None # 上一次使用的代理管线
+        self.pre_view_size: tuple[int, int] | None = None # pre_copy应显示的尺寸(宽, 高)。None表示pre_copy就是原图的结果
         # 预处理输出预览更新信号
         self.PreOutViewUpdateSignal.connect(lambda args: self.PreUpdateOutViewer(*args) if (self := self_ref()) else logger.error("资源管理错误: self_ref() 返回 None"))
         # 供给转码器的self.pipe.pre的副本。避免潜在的内存泄漏.
         self.pre_copy: NDArray | None = None
+        # 等待预处理线程导出的批处理链路径。None表示没有导出请求
+        self.pre_export_path: str | None = None
+        # 是否正在导出批处理链。只在界面线程中读写
+        self.batch_exporting = False
+        # 导出开始前预处理耗时标签的文本，导出结束后恢复
+        self.batch_export_last_text = ""
+        # 导出完成信号：(路径, 错误信息)。错误信息为空表示成功
+        self.BatchChainExportedSignal.connect(lambda path, err: self.BatchChainExported(path, err) if (self := self_ref()) else logger.error("资源管理错误: self_ref() 返回 None"))
         
         # 编码器名称。空字符串表示未选择编码器
         self.code_name = ""
@@ -662,6 +689,8 @@ class PageMain(QDebugWidget):
         self._code_stop = Event()
         self.code_update_notify: Optional[Condition] = Condition()
         self.code_is_need_update = False # 编码器是否需要更新。将在唤醒前同时将其赋值为True以表示需要更新
+        # 编码器与输出器控制台的update会修改控制台自身的状态。编码刷新线程与导出批处理链(在预处理线程中)都会调用，由它互斥
+        self.code_update_lock = Lock()
         # 编码预览输出预览更新信号（不是编码输出
         self.CodeViewerOutViewUpdateSignal.connect(lambda args: self.CodeUpdateOutViewer(*args) if (self := self_ref()) else logger.error("资源管理错误: self_ref() 返回 None"))
 
@@ -823,6 +852,9 @@ class PageMain(QDebugWidget):
             # 创建菜单项
             action1 = menu.addAction("重置预处理管线")
             action1.triggered.connect(lambda: self.Pre_Reset(True) if (self := self_ref()) else logger.error("资源管理错误: self_ref() 返回 None"))
+            action2 = menu.addAction("导出批处理链...")
+            action2.setEnabled(not self.batch_exporting)
+            action2.triggered.connect(lambda: self.ui_ExportBatchChain() if (self := self_ref()) else logger.error("资源管理错误: self_ref() 返回 None"))
             # 显示菜单
             menu.exec(event.globalPos())
         self.pre_top_widget.contextMenuEvent = top_contextMenuEvent
@@ -1317,62 +1349,122 @@ class PageMain(QDebugWidget):
         while not self._pre_stop.is_set():
             self.pre_args_thread_state = 'idle'
             with self.pre_update_notify:
-                self.pre_update_notify.wait()
+                if self.pre_export_path is None:
+                    self.pre_update_notify.wait()
             if self._pre_stop.is_set():
                 break
             self.pre_args_thread_state = 'run'
+            if self.pre_export_path is not None:
+                # 导出与预处理刷新都会调用各控制台的update，在同一线程中依次进行
+                path = self.pre_export_path
+                self.pre_export_path = None
+                self.PreExportBatchChain(path)
+                if self.pre_update_index is None and self.pre_full_index is None:
+                    continue
             resized = False
             self.PreOutViewUpdateSignal.emit((False, -1, None))
             time_calc_start, time_calc_end = 0, 0
-            while self.pre_update_index is not None and not self._pre_stop.is_set():
+            while (self.pre_update_index is not None or self.pre_full_index is not None) and not self._pre_stop.is_set():
                 # 如果更新之后没有再需要更新的，此时self.pre_update_index显然为None，自然结束
                 # 如果计算过程中拖动了，则self.pre_update_index会再次被赋值为需要更新的index，自然触发下一次更新
                 index = self.pre_update_index
                 self.pre_update_index = None
+                pipe = self.pipe
+                if index is not None:
+                    proxy = self.PreProxy()
+                    if proxy is not None:
+                        # 先在代理上计算，原图之后再从index更新
+                        self.pre_full_index = index if self.pre_full_index is None else min(index, self.pre_full_index)
+                        if proxy is not self.pre_proxy:
+                            # 新的代理管线，没有可用的中间结果
+                            self.pre_proxy = proxy
+                            index = 0
+                        pipe = proxy
+                    elif self.pre_full_index is not None:
+                        index = min(index, self.pre_full_index)
+                        self.pre_full_index = None
+                else:
+                    # 参数不再变化，等一会儿再计算原图
+                    with self.pre_update_notify:
+                        if self.pre_update_index is None:
+                            self.pre_update_notify.wait(PROXY_IDLE_TIME)
+                    if self.pre_update_index is not None:
+                        continue
+                    index = self.pre_full_index
+                    self.pre_full_index = None
                 if index is None: # 以防万一
                     continue
                 time_calc_start = time.perf_counter()
                 time_calc_end = time_calc_start  # 预先初始化为相同值
                 try:
-                    resized = self._Pre_Update(index) or resized # 任意一次需要更新尺寸，则最终需要更新
+                    resized = self._Pre_Update(index, pipe) or resized # 任意一次需要更新尺寸，则最终需要更新
+                except backend.JobCancelled as e:
+                    # 计算已过时，被新的更新取消。被取消的那一步的输出不完整，从它和新索引中较小的一个重新开始
+                    restart = index if e.index is None else e.index
+                    if pipe is self.pipe and self.pre_proxy is not None and proxy_preview:
+                        # 原图的计算被打断，等下一次空闲再继续
+                        self.pre_full_index = restart if self.pre_full_index is None else min(restart, self.pre_full_index)
+                    else:
+                        new_index = self.pre_update_index
+                        self.pre_update_index = restart if new_index is None else min(restart, new_index)
+                    resized = bool(e.pre_resized) or resized
+                    continue
                 except:
                     logger.error(f"预处理 {self.pre_list[index].name} 处理失败:", exc_info=True)
+                    self.pre_full_index = None
                     break
                 time_calc_end = time.perf_counter()
-                if view_realtime_update:
-                    # 为了确保下一次更新时不会因上一次的内存范围缩小而导致段错误，所以刷新界面显示务必先复制一层内存
-                    if self.pre_copy is None or resized:
-                        self.pre_copy = self.pipe.pre.copy()
-                    else:
-                        numpy.copyto(self.pre_copy, self.pipe.pre, 'no')
-                    self.PreOutViewUpdateSignal.emit((True, time_calc_end - time_calc_start, resized))
+                if view_realtime_update or pipe is not self.pipe:
+                    # 代理的结果总是立即显示
+                    self.PreEmitView(pipe, time_calc_end - time_calc_start, resized)
                     resized = False # 重置，防止多次更新
-                    # 刷新编码
-                    self.code_is_need_update = True
-                    if self.code_update_notify:
-                        with self.code_update_notify:
-                            self.code_update_notify.notify_all()
             else:
                 # 成功
 
                 if not view_realtime_update:
-                    if self.pre_copy is None or resized:
-                        self.pre_copy = self.pipe.pre.copy()
-                    else:
-                        numpy.copyto(self.pre_copy, self.pipe.pre, 'no')
-                    self.PreOutViewUpdateSignal.emit((True, time_calc_end - time_calc_start, resized))
-                    # 刷新编码
-                    self.code_is_need_update = True
-                    
-                    if self.code_update_notify:
-                        with self.code_update_notify:
-                            self.code_update_notify.notify_all()
+                    self.PreEmitView(self.pipe, time_calc_end - time_calc_start, resized)
                 continue
             # 失败
             if not view_realtime_update:
                 self.PreOutViewUpdateSignal.emit((False, "错误！", None))
         logger.info("预处理刷新线程 结束")
 
+    def PreProxy(self) -> backend.Img2arrPIPE | None:
+        """当前应使用的代理管线。不使用代理时返回None"""
+        if not proxy_preview or not hasattr(self, "pre_out_viewer"):
+            self.pre_proxy = None
+            return None
+        view_size = self.pre_out_viewer.view_size
+        if view_size[0] <= 0 or view_size[1] <= 0:
+            return None
+        proxy = self.pipe.Proxy(view_size)
+        if proxy is None:
+            self.pre_proxy = None
+        return proxy
+
+    def PreEmitView(self, pipe: backend.Img2arrPIPE, t: float, resized: bool):
+        """复制pipe的预处理结果并通知界面显示。pipe为原图的管线时，还会刷新编码"""
+        # 为了确保下一次更新时不会因上一次的内存范围缩小而导致段错误，所以刷新界面显示务必先复制一层内存
+        view_size = None
+        if pipe is not self.pipe:
+            # 按代理相对原图的缩小比例放大显示
+            img_h, img_w = self.pipe.img.shape[:2]
+            proxy_h, proxy_w = pipe.img.shape[:2]
+            view_size = (round(pipe.pre.shape[1] * img_w / proxy_w), round(pipe.pre.shape[0] * img_h / proxy_h))
+        if self.pre_copy is None or resized or self.pre_copy.shape != pipe.pre.shape or view_size != self.pre_view_size:
+            self.pre_copy = pipe.pre.copy()
+            resized = True
+        else:
+            numpy.copyto(self.pre_copy, pipe.pre, 'no')
+        self.pre_view_size = view_size
+        self.PreOutViewUpdateSignal.emit((True, t, resized))
+        if pipe is self.pipe:
+            # 刷新编码
+            self.code_is_need_update = True
+            if self.code_update_notify:
+                with self.code_update_notify:
+                    self.code_update_notify.notify_all()
+
     def PreUpdateOutViewer(self, update_view: bool, t: float | int | str, resized: bool):
         """更新预处理输出"""
         arr = self.pre_copy
@@ -1390,7 +1482,7 @@ class PageMain(QDebugWidget):
                 logger.error("update_view为True，但arr为None")
             elif resized:
                 # 数组尺寸发生变化，需要重新加载
-                self.pre_out_viewer.update_arr(arr)
+                self.pre_out_viewer.update_arr(arr, size=self.pre_view_size)
             else:
                 self.pre_out_viewer.update_()
         time_update_end = time.perf_counter()
@@ -1401,7 +1493,11 @@ class PageMain(QDebugWidget):
         for buf in self.pipe.img_pre_buf:
             mem_size += buf.arr.nbytes
         autofmt_memsize, autofmt_memsize_unit = AutoFmtSize(mem_size)
-        self.pre_top_widget.setToolTip(f"计算耗时：{t_str}\n更新耗时：{AutoFmtTime(time_update_end - time_update_start)}\n中间缓冲区：{mid_buf_len} 个, {autofmt_memsize:.2f} {autofmt_memsize_unit}")
+        # 所有标签页共用的缓冲区池
+        pool = backend.buffer_pool.stats()
+        pool_used, pool_used_unit = AutoFmtSize(pool["used"])
+        pool_free, pool_free_unit = AutoFmtSize(pool["free"])
+        self.pre_top_widget.setToolTip(f"计算耗时：{t_str}\n更新耗时：{AutoFmtTime(time_update_end - time_update_start)}\n中间缓冲区：{mid_buf_len} 个, {autofmt_memsize:.2f} {autofmt_memsize_unit}\n缓冲区池：使用 {pool_used:.2f} {pool_used_unit}, 空闲 {pool_free:.2f} {pool_free_unit}")
         # 如果self.out_name为空，解除self.pre_copy对数组副本的引用
         if not self.out_name:
             # self.pre_copy = None
@@ -1431,14 +1527,26 @@ class PageMain(QDebugWidget):
     def Pre_Update(self, index: int = 0):
         # 设置必要的参数
         self.pre_update_index = index
+        # 正在计算的这一步或之前的参数变了，当前的计算已经过时，直接取消
+        it = self.pre_running_iter
+        if it is not None and index <= it.i:
+            it.cancel()
         # 通知线程更新
         if self.pre_update_notify:
             with self.pre_update_notify:
                 self.pre_update_notify.notify_all()
-    def _Pre_Update(self, index: int = 0) -> bool:
-        """更新预处理管线"""
+    def _Pre_Update(self, index: int = 0, pipe: backend.Img2arrPIPE | None = None) -> bool:
+        """更新预处理管线。pipe: 要更新的管线，默认为原图的管线"""
         # print("Start")
-        it = self.pipe.Pre(index, len(self.pre_list) == 0)
+        if pipe is None:
+            pipe = self.pipe
+        it = pipe.Pre(index, len(self.pre_list) == 0)
+        self.pre_running_iter = it
+        try:
+            return self._Pre_Update_iter(it)
+        finally:
+            self.pre_running_iter = None
+    def _Pre_Update_iter(self, it: backend.Pre_iter) -> bool:
         # 设置工作模式
         it.mode = pipe_update_mode
         # 获取i的有效索引
@@ -1596,10 +1704,11 @@ class PageMain(QDebugWidget):
                     continue
                 time_calc_start = time.perf_counter()
                 try:
-                    if self.code_name != "":
-                        _, new_resized = self._CodeViewUpdate()
-                    else:
-                        new_resized = False
+                    with self.code_update_lock:
+                        if self.code_name != "":
+                            _, new_resized = self._CodeViewUpdate()
+                        else:
+                            new_resized = False
                     resized = resized or new_resized # 任意一次需要更新尺寸，则最终需要更新
                 except:
                     logger.error(f"编码器 {self.code_name} 更新失败，错误信息：", exc_info=True)
@@ -1607,13 +1716,15 @@ class PageMain(QDebugWidget):
                 time_calc_end = time.perf_counter()
                 if view_realtime_update:
                     self.CodeViewerOutViewUpdateSignal.emit((True, time_calc_end - time_calc_start, resized, self.pipe.code_view.copy()))
-                    self.OutPreUpdate()
+                    with self.code_update_lock:
+                        self.OutPreUpdate()
                     resized = False # 重置，防止多次更新
             else:
                 # 成功
                 if not view_realtime_update:
                     self.CodeViewerOutViewUpdateSignal.emit((True, time_calc_end - time_calc_start, resized, self.pipe.code_view.copy()))
-                    self.OutPreUpdate()
+                    with self.code_update_lock:
+                        self.OutPreUpdate()
                 continue
             # 失败
             if not view_realtime_update:
@@ -1782,6 +1893,86 @@ class PageMain(QDebugWidget):
         self.pipe.out.tofile(filepath)
 
 
+    def BatchChainStep(self, plan: backend.ExecPlan, stage: int, name: str, py: ExtensionPyABC.abcExt.UI | None) -> dict:
+        """生成批处理链中的一个步骤，并在plan中执行它，以便下一步拿到实际的输入"""
+        step: dict = {"name": name, "args": ""}
+        py_base = plan.pipe.extdc[stage]["img"][name][backend.EXT_OP_EXT]
+        index = plan.compiled
+        if py is not None and hasattr(py, "update"):
+            arg, arglen = py.update(plan.entry_input(index), plan.pipe.tasks if plan.pipe.tasks > 0 else plan.pipe.plproc.get_threads())
+        else:
+            arg, arglen = backend.NULLPTR, 0
+        backend.check_batch_args(name, py_base, arg if arglen > 0 else None)
+        if py_base is not None and hasattr(py_base, "batch_update"):
+            # 参数依赖指针，由扩展自己在批处理时重新生成
+            step["save"] = py.ui_save() if py is not None and hasattr(py, "ui_save") else None
+        else:
+            step["args"] = backend.args_to_bytes(arg, arglen).hex()
+        plan.extend([(stage, name, arg)])
+        plan.check(index, plan.run(index, index + 1))
+        return step
+
+    def ExportBatchChain(self, filepath: str, progress: Callable[[int, int], None] | None = None):
+        """将当前的预处理链、编码器和输出器导出为批处理链。  
+        在原图的副本上逐项重新执行一遍处理链：每一项都用它自己的实际输入生成参数(缩放等会改变之后各项的输入尺寸)。  
+        会调用各控制台的update，须在预处理线程中调用(见`PreExportBatchChain()`)。progress(已完成项数, 总项数)在每项开始前调用"""
+        if not self.code_name or not self.out_name:
+            raise ValueError("需要先选择编码器和输出器")
+        pre_objs = [obj for obj in self.pre_list if obj.enabled]
+        items = ([(backend.EXT_TYPE_PREP, obj.name, obj.py) for obj in pre_objs]
+                 + [(backend.EXT_TYPE_CODE, self.code_name, self.code_py), (backend.EXT_TYPE_OUT, self.out_name, self.out_py)])
+        pipe = backend.Img2arrPIPE(self.pipe.img, self.pipe.extdc)
+        try:
+            pipe.tasks = self.pipe.tasks
+            pipe.cache = None
+            plan = pipe.Plan(None, len(pre_objs))
+            steps = []
+            with self.code_update_lock:
+                for i, (stage, name, py) in enumerate(items):
+                    if progress is not None:
+                        progress(i, len(items))
+                    steps.append(self.BatchChainStep(plan, stage, name, py))
+        finally:
+            pipe.close()
+        chain = {"prep": steps[:-2], "code": steps[-2], "out": steps[-1]}
+        backend.save_batch_chain(filepath, chain)
+
+    def PreExportBatchChain(self, filepath: str):
+        """在预处理线程中导出批处理链，完成后通知界面"""
+        def progress(done: int, total: int):
+            self.PreOutViewUpdateSignal.emit((False, f"正在导出批处理链 {done + 1}/{total}…", None))
+        try:
+            self.ExportBatchChain(filepath, progress)
+        except Exception as e:
+            logger.error(f"导出批处理链失败：", exc_info=True)
+            self.BatchChainExportedSignal.emit(filepath, str(e) or type(e).__name__)
+            return
+        self.BatchChainExportedSignal.emit(filepath, "")
+
+    def ui_ExportBatchChain(self):
+        if self.batch_exporting:
+            return
+        path, _ = QFileDialog.getSaveFileName(self.win, "导出批处理链", "", "JSON Files (*.json)")
+        if not path:
+            return
+        # 整条处理链在原图上执行一遍，大图可能需要较长时间。交给预处理线程，界面保持响应
+        self.batch_exporting = True
+        self.batch_export_last_text = self.pre_calc_time.text()
+        QApplication.setOverrideCursor(Qt.CursorShape.BusyCursor)
+        self.pre_export_path = path
+        with self.pre_update_notify:
+            self.pre_update_notify.notify_all()
+
+    def BatchChainExported(self, filepath: str, err: str):
+        """导出结束，由BatchChainExportedSignal在界面线程中调用"""
+        self.batch_exporting = False
+        QApplication.restoreOverrideCursor()
+        self.pre_calc_time.setText(self.batch_export_last_text)
+        if err:
+            QMessageBox.critical(self.win, "错误", f"导出批处理链失败：{err}")
+        else:
+            QMessageBox.information(self.win, "提示", f"导出成功：{filepath}")
+
     def DestroyEvent(self) -> bool:
         """当即将被关闭标签页时调用
         返回是否允许关闭"""
@@ -1812,6 +2003,12 @@ class PageMain(QDebugWidget):
         except: pass
         try: self.CodeViewerOutViewUpdateSignal.disconnect()
         except: pass
+        try: self.BatchChainExportedSignal.disconnect()
+        except: pass
+        if self.batch_exporting:
+            # 导出尚未结束，不会再收到完成通知
+            self.batch_exporting = False
+            QApplication.restoreOverrideCursor()
         self.destroyed.connect(lambda: logger.info("主页面成功被destroyed()"))
         super().deleteLater()
     def __del__(self):
@@ -2018,6 +2215,19 @@ if __name__ == "__main__":
         threads_local = 0
     threads = int(threads_local)
     backend.SetParallelThreads(threads)
+    # 初始化共享线程池的全局并发上限。0表示与线程数相同
+    concurrency_local = GetSet("Parallel.Concurrency")
+    if not isinstance(concurrency_local, int) or concurrency_local < 0:
+        SetSet("Parallel.Concurrency", 0)
+        concurrency_local = 0
+    backend.SetPoolConcurrency(int(concurrency_local))
+    # 中间缓冲区池的内存预算(MB)。0表示使用默认值
+    pool_budget_local = GetSet("Memory.BufferPoolBudget")
+    if not isinstance(pool_budget_local, int) or pool_budget_local < 0:
+        SetSet("Memory.BufferPoolBudget", 0)
+        pool_budget_local = 0
+    if pool_budget_local > 0:
+        backend.SetBufferPoolBudget(pool_budget_local * 1024 * 1024)
     # 加载UI
     app = QApplication(sys.argv)
     
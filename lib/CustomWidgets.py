@@ -12,7 +12,7 @@ from PySide6.QtCore import (Qt, QObject, QRectF
 )
 
 from PySide6.QtGui import (QPixmap, QPainter, QImage, QColor, QBrush,
-                           QResizeEvent, QWheelEvent, QContextMenuEvent, QKeyEvent
+                           QResizeEvent, QWheelEvent, QContextMenuEvent, QKeyEvent, QTransform
 )
 
 import weakref
@@ -194,6 +194,8 @@ class CustomUI:
             self.gpview.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded) # 需要时显示滚动条(垂直)
             # 背景棋盘格
             self.gpview.setBackgroundBrush(CustomBrush.Chessboard())
+            # 显示区域的尺寸(高, 宽)，单位为物理像素。供其他线程读取，在界面线程中更新
+            self.view_size: tuple[int, int] = (0, 0)
             # 自动/手动缩放回调
             self.autoscale = True
             self.gpview.resizeEvent = lambda e: (self := self_ref()) and self.__gpview_resizeEvent(e)
@@ -248,6 +250,9 @@ class CustomUI:
                     off_x = (vrect.width() - srect.width()) / 2
                     off_y = (vrect.height() - srect.height()) / 2
                     self.gpview.translate(off_x, off_y)
+            ratio = self.gpview.devicePixelRatioF()
+            vsize = self.gpview.viewport().size()
+            self.view_size = (round(vsize.height() * ratio), round(vsize.width() * ratio))
             # 调用gpview的resizeEvent函数
             QGraphicsView.resizeEvent(self.gpview, e)
         # 手动缩放事件（生效，且会使autoscale为False）
@@ -291,17 +296,21 @@ class CustomUI:
             # if self is None: return
             if e.key() == Qt.Key.Key_C and e.modifiers() == Qt.KeyboardModifier.ControlModifier:
                 self.copy_img()
-        def update_arr(self, img: NDArray, format: QImage.Format = QImage.Format.Format_RGBA8888):
-            """更换数组"""
+        def update_arr(self, img: NDArray, format: QImage.Format = QImage.Format.Format_RGBA8888, size: tuple[int, int] | None = None):
+            """更换数组  
+            size: 图片应显示的尺寸(宽, 高)。用于代理预览：img是缩小的版本，放大到size显示。None表示img的实际尺寸
+            """
             # self.img = img
-            self.img_width = img.shape[IMG_SHAPE_W]
-            self.img_height = img.shape[IMG_SHAPE_H]
+            arr_width = img.shape[IMG_SHAPE_W]
+            arr_height = img.shape[IMG_SHAPE_H]
+            self.img_width, self.img_height = size if size is not None else (arr_width, arr_height)
             
-            self.qimage = QImage(img.data, self.img_width, self.img_height, format)
+            self.qimage = QImage(img.data, arr_width, arr_height, format)
             
             # 创建QPixmap
             self.qpixmap = QPixmap.fromImage(self.qimage)
             self.qpixmap_item.setPixmap(self.qpixmap)
+            self.qpixmap_item.setTransform(QTransform.fromScale(self.img_width / max(arr_width, 1), self.img_height / max(arr_height, 1)))
 
             # 更新场景矩形以确保尺寸正确
             self.scene.setSceneRect(QRectF(0, 0, self.img_width, self.img_height))
@@ -310,7 +319,10 @@ class CustomUI:
             self.gpview.resizeEvent(QResizeEvent(self.gpview.size(), self.gpview.size()))
 
             # 刷新文本
-            self.title.setText(f"{self.prefix}    {self.img_width}x{self.img_height}px")
+            if size is not None:
+                self.title.setText(f"{self.prefix}    {self.img_width}x{self.img_height}px (预览 {arr_width}x{arr_height}px)")
+            else:
+                self.title.setText(f"{self.prefix}    {self.img_width}x{self.img_height}px")
     
         def update_(self):
             """更新画面"""
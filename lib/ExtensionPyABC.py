@@ -28,6 +28,16 @@ _CArgObject: TypeAlias = type(byref(c_void_p(0))) # type: ignore
 CPointerArgType: TypeAlias = _CArgObject | _Pointer
 
 class abcExt(ModuleType):
+    @staticmethod
+    def batch_update(save: dict | None, arr: NDArray[uint8], threads: int, ext: CDLL) -> tuple[CPointerArgType, int]:
+        """可选的模块级函数。无界面批处理时代替`UI.update`生成参数。
+        批处理链通常直接保存参数结构体的字节，但其中的指针字段无法保存；参数中有指针字段的扩展必须提供此函数，否则不能用于批处理。
+        save: 批处理链中该步骤的"save"字段，一般来自`UI.ui_save()`。
+        arr: 这一步的实际输入。
+        ext: 自己的动态链接库扩展。批处理时不会调用`UI.ui_init`，用到的导出函数需要在这里设置argtypes。
+        返回值与`UI.update`相同。
+        """
+        ...
     #@staticmethod
     class UI():
         """UI的抽象类"""
@@ -63,6 +73,7 @@ class abcExt(ModuleType):
             """当img2arr需要刷新计算时调用。可能在别的线程中调用，因此请使用线程安全的方法在此函数修改UI。
             应返回一个元组，第一个元素为传参的指针，第二个元素为传参的长度
             threads: 此次的线程数。1表示单线程，0表示使用了OpenCL，其余表示多线程的线程数。
+            arr: 本步骤的输入。若前面是被融合执行的逐像素预处理(ATTR_POINTWISE)，它们此时可能还没有计算，arr中只有形状是可靠的。
             """
             ...
         def update_end(self, arg: CPointerArgType, arglen: int) -> None:
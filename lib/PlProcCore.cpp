@@ -3,14 +3,18 @@
 #include <cstdio>
 #include <thread>
 
-#include <queue>
+#include <deque>
+#include <vector>
+#include <memory>
+#include <algorithm>
 #include <condition_variable>
-#include <semaphore>
+#include <chrono>
 #include <mutex>
 #include <atomic>
 
 #include <cstddef>
 #include <cstdint>
+#include <cstring>
 #include <system_error>
 
 #if defined(_WIN32) || defined(_WIN64)
@@ -25,6 +29,8 @@ volatile const char DEFINE[] = "This a custom library for parallel processing, u
 
 using SingleCoreFunc = int(*)(void* args, uint8_t* int_buf, uint8_t* out_buf, size_t in_shape[]); 
 using MultiCoreFunc = int(*)(size_t threads, size_t idx, void* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[]);
+// 区间版本：处理in_shape[0]方向(图像为行，数据为元素)的[start, end)。phase为当前阶段，阶段之间由核心同步
+using MultiCoreRangeFunc = int(*)(size_t phase, size_t start, size_t end, void* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[]);
 
 // 核心。返回值：
 // 对于单核，返回值恒返回0，ret[0]被设为func的返回值值
@@ -74,55 +80,506 @@ externc SHARED int MultiCore_old(char* caller, size_t threadnum, void* func, voi
 
 // 多线程部分大更新：自然任务管理，使用线程池，大幅提高速度和均衡性
 
+// 作业状态
+enum PlProcJobStatus{
+    JOB_RUNNING = 0,
+    JOB_DONE = 1,
+    JOB_CANCELLED = 2, // 被取消后结束。输出缓冲区的内容不完整
+};
+
+class ThreadPoolCtx;
+struct ThreadPoolClient;
+
+// 性能剖析：一个任务(PlProcJob::run的一次调用)的耗时记录
+static constexpr size_t PLPROC_CALLER_LEN = 32;
+struct PlProcTaskTime{
+    char caller[PLPROC_CALLER_LEN]; // 调用者名称(截断)，以'\0'结尾
+    uint64_t job;      // 作业序号，同一作业的任务相同
+    uint32_t phase;    // 阶段
+    uint32_t idx;      // 阶段内的任务索引
+    uint32_t worker;   // 执行该任务的线程在线程池中的序号
+    uint32_t reserved;
+    int64_t start_ns;  // 开始/结束时间，见PlProcNowNs
+    int64_t end_ns;
+};
+
+// 单调时钟，纳秒
+static inline int64_t NowNs(){
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now().time_since_epoch()).count();
+}
+
+// 一个作业：一次MultiCore/MultiCoreRange调用，由一个或多个阶段组成，每个阶段有若干任务。
+// 每个作业有自己的完成状态，多个调用者可以同时向同一个线程池提交，互不干扰；
+// 既可以同步等待，也可以异步提交后轮询/等待/取消。
+struct PlProcJob{
+    ThreadPoolCtx* ctx = nullptr;
+    ThreadPoolClient* client = nullptr;
+    std::atomic<bool> cancelled{false};
+    std::atomic<size_t> remaining{0}; // 当前阶段未完成的任务数
+    std::mutex mutex;
+    std::condition_variable cv;
+    bool finished = false;
+    uint64_t serial = 0; // 作业序号，性能剖析用
+    char caller[PLPROC_CALLER_LEN] = {};
+
+    virtual ~PlProcJob() = default;
+    void set_caller(const char* name){
+        if(name != nullptr){
+            strncpy(this->caller, name, PLPROC_CALLER_LEN - 1);
+        }
+    }
+    // 当前阶段。性能剖析用
+    virtual size_t current_phase(){
+        return 0;
+    }
+    // 执行当前阶段的第idx个任务
+    virtual void run(size_t idx) = 0;
+    // 当前阶段全部完成后调用。返回下一阶段的任务数，0表示作业结束
+    virtual size_t next_phase(){
+        return 0;
+    }
+    // 屏障，见PlProcBarrierWait。默认什么都不做
+    virtual void barrier(){}
+    int status_locked(){
+        if(!this->finished) return JOB_RUNNING;
+        return this->cancelled ? JOB_CANCELLED : JOB_DONE;
+    }
+    int poll(){
+        std::lock_guard<std::mutex> lock(this->mutex);
+        return this->status_locked();
+    }
+    // 等待作业结束。timeout_ms<0表示一直等待。返回作业状态
+    int wait(int64_t timeout_ms){
+        std::unique_lock<std::mutex> lock(this->mutex);
+        if(timeout_ms < 0){
+            this->cv.wait(lock, [this]{ return this->finished; });
+        }else{
+            this->cv.wait_for(lock, std::chrono::milliseconds(timeout_ms), [this]{ return this->finished; });
+        }
+        return this->status_locked();
+    }
+    void finish(){
+        // 持锁通知：等待者被唤醒后可能立即删除作业
+        std::lock_guard<std::mutex> lock(this->mutex);
+        this->finished = true;
+        this->cv.notify_all();
+    }
+};
+
+// 当前线程正在执行的作业。供扩展通过PlProcIsCancelled()查询取消标志
+thread_local PlProcJob* CurrentJob = nullptr;
+// 当前线程在线程池中的序号。不是线程池的线程时为UINT32_MAX
+thread_local uint32_t CurrentWorker = UINT32_MAX;
+
+// 一次提交：作业的一个阶段
+struct mtSubmission{
+    PlProcJob* job;
+    size_t tasks;
+    size_t next; // 下一个要取出的任务索引
+};
+
+// 线程池的客户端(一般是一个管线)。每个客户端有自己的提交队列，线程池在有任务的客户端之间轮转，
+// 一个客户端提交大量任务时，其他客户端不会被饿死
+struct ThreadPoolClient{
+    std::deque<mtSubmission> submissions;
+    bool active = false; // 是否在轮转队列中
+};
+
+// 经典调度：每个任务处理一段静态划分的数据
+struct StaticJob : PlProcJob{
+    size_t threads;
+    MultiCoreFunc func;
+    void* args;
+    size_t *in_shape;
+    uint8_t* in_buffer;
+    uint8_t* out_buffer;
+    int* ret;
+    // 屏障状态。所有任务(threads个)都到达后generation加1
+    std::mutex barrier_mutex;
+    std::condition_variable barrier_cv;
+    size_t barrier_arrived = 0;
+    size_t barrier_generation = 0;
+    void run(size_t idx) override{
+        // 将返回值存入ret
+        this->ret[idx] = this->func(this->threads, idx, this->args, this->in_buffer, this->out_buffer, this->in_shape);
+    }
+    void barrier() override;
+};
+
+// 工作窃取调度：数据被切成许多小块，每个工作者有自己的双端队列，
+// 自己从队首取(保持访存连续)，空了就从其他工作者的队尾窃取
+struct alignas(64) StealDeque{
+    std::mutex mutex;
+    std::deque<size_t> chunks;
+};
+struct RangeJob : PlProcJob{
+    size_t workers;
+    size_t chunks;
+    size_t phase;
+    size_t phases;
+    size_t begin;
+    size_t total;
+    size_t grain;
+    MultiCoreRangeFunc func;
+    void* args;
+    size_t *in_shape;
+    uint8_t* in_buffer;
+    uint8_t* out_buffer;
+    int* ret;
+    std::unique_ptr<StealDeque[]> deques;
+
+    // 每个工作者先分到连续的一段块
+    void fill(){
+        for(size_t w = 0; w < this->workers; w++){
+            for(size_t c = this->chunks * w / this->workers; c < this->chunks * (w + 1) / this->workers; c++){
+                this->deques[w].chunks.push_back(c);
+            }
+        }
+    }
+    bool pop(size_t idx, size_t& chunk){
+        // 先取自己的
+        {
+            StealDeque& own = this->deques[idx];
+            std::lock_guard<std::mutex> lock(own.mutex);
+            if(!own.chunks.empty()){
+                chunk = own.chunks.front();
+                own.chunks.pop_front();
+                return true;
+            }
+        }
+        // 再窃取别人的
+        for(size_t i = 1; i < this->workers; i++){
+            StealDeque& victim = this->deques[(idx + i) % this->workers];
+            std::lock_guard<std::mutex> lock(victim.mutex);
+            if(!victim.chunks.empty()){
+                chunk = victim.chunks.back();
+                victim.chunks.pop_back();
+                return true;
+            }
+        }
+        return false;
+    }
+    // 处理一块[start, end)
+    virtual int run_chunk(size_t start, size_t end){
+        return this->func(this->phase, start, end, this->args, this->in_buffer, this->out_buffer, this->in_shape);
+    }
+    void run(size_t idx) override{
+        size_t chunk;
+        // 每块之间检查取消标志，被取消后剩余的块直接丢弃
+        while(!this->cancelled.load(std::memory_order_relaxed) && this->pop(idx, chunk)){
+            size_t start = this->begin + chunk * this->grain;
+            size_t end = std::min(start + this->grain, this->total);
+            int ret = this->run_chunk(start, end);
+            // 只保留该工作者遇到的第一个错误
+            if(ret != 0 && this->ret[idx] == 0){
+                this->ret[idx] = ret;
+            }
+        }
+    }
+    size_t current_phase() override{
+        return this->phase;
+    }
+    size_t next_phase() override{
+        // 阶段之间由核心同步：上一阶段的所有块都完成后才开始下一阶段
+        if(++this->phase >= this->phases){
+            return 0;
+        }
+        this->fill();
+        return this->workers;
+    }
+};
+
+// 融合执行的一步
+struct FusedStage{
+    MultiCoreRangeFunc func;
+    void* args;
+    uint8_t* in_buffer;
+    uint8_t* out_buffer;
+    size_t phases;
+};
+// 融合调度：多个逐像素步骤合成一个作业。每一块依次经过所有步骤(及其所有阶段)后再处理下一块，
+// 块足够小时，中间结果一直留在缓存中，整条链只需读写一次内存
+struct FusedJob : RangeJob{
+    std::vector<FusedStage> stages;
+    int run_chunk(size_t start, size_t end) override{
+        for(const FusedStage& stage : this->stages){
+            for(size_t phase = 0; phase < stage.phases; phase++){
+                int ret = stage.func(phase, start, end, stage.args, stage.in_buffer, stage.out_buffer, this->in_shape);
+                if(ret != 0){
+                    return ret;
+                }
+            }
+        }
+        return 0;
+    }
+};
+
+// 执行计划中一步的调用方式。前三种与Python端的EXT_PATH_*相同
+enum PlProcPlanMode{
+    PLAN_SINGLECORE = 0, // SingleCore
+    PLAN_MULTICORE = 1,  // MultiCore，静态划分
+    PLAN_RANGE = 4,      // MultiCoreRange，工作窃取
+    PLAN_FUSED = 16,     // MultiCoreFused，融合执行多个逐像素步骤
+    PLAN_COPY = 17,      // 把in_buffer的前bytes字节复制到out_buffer
+};
+// 执行计划的一步，见ThreadPoolCtx::RunPlan。没有用到的字段忽略
+struct PlProcPlanStep{
+    int32_t mode;        // 见PlProcPlanMode
+    uint32_t reserved;
+    char* caller;
+    void* func;          // 扩展函数(f0/f1/f1r)
+    void* args;
+    int* ret;            // 单核为1项；多核为tasks项(tasks为0时为线程数)；工作窃取与融合为线程数
+    uint8_t* in_buffer;
+    uint8_t* out_buffer;
+    size_t* in_shape;
+    size_t tasks;        // 多核的任务数
+    size_t begin;        // 工作窃取与融合处理[begin, total)
+    size_t total;
+    size_t grain;
+    size_t phases;       // 工作窃取的阶段数
+    size_t stages;       // 融合的步骤数。以下各数组长度为stages，含义同MultiCoreFused
+    void** funcs;
+    void** stage_args;
+    size_t* stage_phases;
+    uint8_t** in_buffers;
+    uint8_t** out_buffers;
+    size_t bytes;        // 复制的字节数
+};
+
 class ThreadPoolCtx{
 // 创建参数结构体、队列和线程池函数
     struct mtTask{
-        size_t threads;
+        PlProcJob* job;
         size_t idx;
-        MultiCoreFunc func;
-        void* args;
-        size_t *in_shape;
-        uint8_t* in_buffer;
-        uint8_t* out_buffer;
-        int* ret;
     };
 private:
     std::vector<std::thread> ThreadPool;
     std::atomic<bool> ThreadPool_Running{true};
     std::mutex TaskMutex;
-    std::queue<mtTask> TaskQueue;
-    std::counting_semaphore<> TaskQueueSemaphore{0}; //计数信号量
+    // 有待取任务的客户端，按轮转顺序排列
+    std::deque<ThreadPoolClient*> ActiveClients;
+    // 未指定客户端时使用
+    ThreadPoolClient DefaultClient;
     std::condition_variable TaskQueueCV;
+    // 性能剖析。开启后记录每个任务的耗时，由ThreadPoolTakeTaskTimes取走
+    std::atomic<bool> Profiling{false};
+    std::atomic<uint64_t> NextJobSerial{1};
+    std::mutex ProfileMutex;
+    std::vector<PlProcTaskTime> TaskTimes;
 
-    void ThreadPoolFunc(){
-        while(this->ThreadPool_Running){
-            // 若TaskQueue为空，则等待
+    // 取出下一个任务。需持有TaskMutex，且ActiveClients非空
+    // 轮转以提交为单位：队首客户端的队首提交的任务全部取出后，才轮到下一个客户端。
+    // 因此一次提交的所有任务总是连续地被取走，同一作业的任务尽量同时运行，在屏障处等待的时间更短
+    mtTask PopTask(){
+        ThreadPoolClient* client = this->ActiveClients.front();
+        mtSubmission& sub = client->submissions.front();
+        mtTask task{.job = sub.job, .idx = sub.next++};
+        if(sub.next == sub.tasks){
+            client->submissions.pop_front();
+            this->ActiveClients.pop_front();
+            if(client->submissions.empty()){
+                client->active = false;
+            }else{
+                this->ActiveClients.push_back(client);
+            }
+        }
+        return task;
+    }
+
+    // 取出指定作业的一个还未开始的任务。没有时返回false
+    bool PopTaskOf(PlProcJob* job, size_t& idx){
+        std::lock_guard<std::mutex> lock(this->TaskMutex);
+        ThreadPoolClient* client = job->client;
+        auto& subs = client->submissions;
+        auto it = std::find_if(subs.begin(), subs.end(), [job](const mtSubmission& sub){ return sub.job == job; });
+        if(it == subs.end()){
+            return false;
+        }
+        idx = it->next++;
+        if(it->next == it->tasks){
+            subs.erase(it);
+            if(subs.empty() && client->active){
+                client->active = false;
+                this->ActiveClients.erase(std::find(this->ActiveClients.begin(), this->ActiveClients.end(), client));
+            }
+        }
+        return true;
+    }
+    // 执行一个任务并完成记账
+    void RunTask(PlProcJob* job, size_t idx){
+        PlProcJob* outer = CurrentJob;
+        CurrentJob = job;
+        if(this->Profiling.load(std::memory_order_relaxed)){
+            PlProcTaskTime rec{};
+            memcpy(rec.caller, job->caller, PLPROC_CALLER_LEN);
+            rec.job = job->serial;
+            rec.phase = (uint32_t)job->current_phase();
+            rec.idx = (uint32_t)idx;
+            rec.worker = CurrentWorker;
+            rec.start_ns = NowNs();
+            job->run(idx);
+            rec.end_ns = NowNs();
+            this->AddTaskTime(rec);
+        }else{
+            job->run(idx);
+        }
+        CurrentJob = outer;
+        this->TaskDone(job);
+    }
+    void AddTaskTime(const PlProcTaskTime& rec){
+        std::lock_guard<std::mutex> lock(this->ProfileMutex);
+        // 没有被取走的记录过多时丢弃新的记录，避免忘记取走时内存无限增长
+        if(this->TaskTimes.size() < TASK_TIMES_LIMIT){
+            this->TaskTimes.push_back(rec);
+        }
+    }
+
+    void ThreadPoolFunc(uint32_t worker){
+        CurrentWorker = worker;
+        while(true){
+            // 若没有任务，则等待
             std::unique_lock<std::mutex> lock(this->TaskMutex);
-            // 如果队列为空且线程池仍在运行，才等待
-            if(this->TaskQueue.empty() && this->ThreadPool_Running){
-                TaskQueueCV.wait(lock, [this]{
-                    return !this->TaskQueue.empty() || !this->ThreadPool_Running;
-                });
-            }
-            if(!this->ThreadPool_Running){
-                // 该休息了
+            TaskQueueCV.wait(lock, [this]{
+                return !this->ActiveClients.empty() || !this->ThreadPool_Running;
+            });
+            if(this->ActiveClients.empty()){
+                // 该休息了。停止前会先执行完队列中剩余的任务，否则等待这些任务的调用者永远不会返回
                 // 自动解锁
                 return;
             }
             // 取出任务
-            mtTask task = this->TaskQueue.front();
-            this->TaskQueue.pop();
+            mtTask task = this->PopTask();
             // 解锁
             lock.unlock();
             // 执行任务
-            int ret = task.func(task.threads, task.idx, task.args, task.in_buffer, task.out_buffer, task.in_shape);
-            // 将返回值存入ret
-            task.ret[task.idx] = ret;
-            // 任务完成
-            this->TaskQueueSemaphore.release();
+            this->RunTask(task.job, task.idx);
+        }
+    }
+    // 一个任务完成。若是当前阶段的最后一个任务，则提交下一阶段或结束作业
+    void TaskDone(PlProcJob* job){
+        if(job->remaining.fetch_sub(1, std::memory_order_acq_rel) != 1){
+            return;
+        }
+        size_t tasks = job->cancelled ? 0 : job->next_phase();
+        if(tasks > 0){
+            this->Enqueue(job, tasks);
+        }else{
+            // 此后不能再访问job
+            job->finish();
         }
     }
+    // 将作业的一个阶段加入其客户端的队列
+    void Enqueue(PlProcJob* job, size_t tasks){
+        {
+            std::lock_guard<std::mutex> lock(this->TaskMutex);
+            job->remaining.store(tasks, std::memory_order_relaxed);
+            ThreadPoolClient* client = job->client;
+            client->submissions.push_back({.job = job, .tasks = tasks, .next = 0});
+            if(!client->active){
+                client->active = true;
+                this->ActiveClients.push_back(client);
+            }
+        }
+        // 唤醒
+        this->TaskQueueCV.notify_all();
+    }
+    // 结束所有线程。队列中剩余的任务会先被执行完
+    void StopThreads(){
+        {
+            // 持锁修改，避免线程在检查条件与进入等待之间错过唤醒
+            std::lock_guard<std::mutex> lock(this->TaskMutex);
+            this->ThreadPool_Running = false;
+        }
+        this->TaskQueueCV.notify_all();
+        for(auto& thread : this->ThreadPool){
+            thread.join();
+        }
+        this->ThreadPool.clear();
+    }
+    // 填写作业的公共部分并提交第一阶段。tasks为0时作业直接结束
+    void Submit(ThreadPoolClient* client, PlProcJob* job, size_t tasks){
+        job->ctx = this;
+        job->client = client == nullptr ? &this->DefaultClient : client;
+        job->serial = this->NextJobSerial.fetch_add(1, std::memory_order_relaxed);
+        if(tasks == 0){
+            job->finish();
+            return;
+        }
+        this->Enqueue(job, tasks);
+    }
+    StaticJob* NewStaticJob(char* caller, void* func, void* args, int *ret,
+        uint8_t* in_buffer, uint8_t* out_buffer,
+        size_t in_shape[],
+        size_t& tasks
+    )
+    {
+        if(tasks == 0){
+            tasks = this->ThreadPool.size();
+        }
+        size_t threads = this->ThreadPool.size();
+        if (threads == 0){
+            fprintf(stderr, "ThreadPoolCtx Error: On caller %s, No thread pool initialized. Please call InitThreadPool() first.\n", caller);
+            return nullptr;
+        }
+        StaticJob* job = new StaticJob();
+        job->set_caller(caller);
+        job->threads = tasks;
+        job->func = (MultiCoreFunc)func;
+        job->args = args;
+        job->in_shape = in_shape;
+        job->in_buffer = in_buffer;
+        job->out_buffer = out_buffer;
+        job->ret = ret;
+        return job;
+    }
+    // job为nullptr时新建RangeJob，否则填写传入的作业(如FusedJob)
+    RangeJob* NewRangeJob(char* caller, void* func, void* args, int *ret,
+        uint8_t* in_buffer, uint8_t* out_buffer,
+        size_t in_shape[],
+        size_t begin, size_t total, size_t grain, size_t phases,
+        size_t& tasks,
+        RangeJob* job = nullptr
+    )
+    {
+        size_t threads = this->ThreadPool.size();
+        if (threads == 0){
+            fprintf(stderr, "ThreadPoolCtx Error: On caller %s, No thread pool initialized. Please call InitThreadPool() first.\n", caller);
+            delete job;
+            return nullptr;
+        }
+        for(size_t i = 0; i < threads; i++){
+            ret[i] = 0;
+        }
+        if(job == nullptr){
+            job = new RangeJob();
+        }
+        job->set_caller(caller);
+        const size_t count = total > begin ? total - begin : 0;
+        if(grain == 0){
+            grain = std::max<size_t>(1, count / (threads * RANGE_OVERDECOMPOSE));
+        }
+        job->chunks = (count + grain - 1) / grain;
+        job->workers = std::min(threads, job->chunks);
+        job->phase = 0;
+        job->phases = phases;
+        job->begin = begin;
+        job->total = total;
+        job->grain = grain;
+        job->func = (MultiCoreRangeFunc)func;
+        job->args = args;
+        job->in_shape = in_shape;
+        job->in_buffer = in_buffer;
+        job->out_buffer = out_buffer;
+        job->ret = ret;
+        job->deques = std::make_unique<StealDeque[]>(job->workers);
+        job->fill();
+        tasks = phases > 0 ? job->workers : 0;
+        return job;
+    }
 public:
+    // 未被取走的任务耗时记录的上限
+    static constexpr size_t TASK_TIMES_LIMIT = 1 << 16;
     constexpr size_t get_threads(){
         return ThreadPool.size();
     }
@@ -131,29 +588,15 @@ public:
 
     size_t InitThreadPool(size_t threadnum){
         // 若还在运行，结束线程
-        if(this->ThreadPool_Running){
-            this->ThreadPool_Running = false;
-            this->TaskQueueCV.notify_all();
-            for(auto& thread : this->ThreadPool){
-                thread.join();
-            }
-            this->ThreadPool.clear();
-        }
-        // 清空任务队列和信号量
-        while(this->TaskQueueSemaphore.try_acquire()) {
-            // 清空所有pending的信号量计数
-        }
-        while(!this->TaskQueue.empty()){
-            this->TaskQueue.pop();
-        }
+        this->StopThreads();
         this->ThreadPool_Running = true;
         // 创建线程
         size_t real_threadnum = 0; // 实际创建的线程数
         this->ThreadPool.reserve(threadnum);
         for(size_t i = 0; i < threadnum; i++){
             try{
-                this->ThreadPool.emplace_back(std::thread([this]{
-                    this->ThreadPoolFunc();
+                this->ThreadPool.emplace_back(std::thread([this, i]{
+                    this->ThreadPoolFunc((uint32_t)i);
                 }));
                 real_threadnum++;
             }catch(std::system_error &e){
@@ -162,54 +605,259 @@ public:
         }
         return real_threadnum;
     }
-    // 当tasks=0时，表示tasks=threads
-    int MultiCore(
+    ThreadPoolClient* NewClient(){
+        return new ThreadPoolClient();
+    }
+    // 删除客户端。调用者需保证该客户端没有未完成的提交
+    void DeleteClient(ThreadPoolClient* client){
+        {
+            std::lock_guard<std::mutex> lock(this->TaskMutex);
+            if(client->active){
+                fprintf(stderr, "ThreadPoolCtx Error: Deleting a client with pending submissions.\n");
+                return;
+            }
+        }
+        delete client;
+    }
+    // 取消作业。还未开始的阶段会被直接移出队列；正在执行的任务需要扩展自行检查取消标志(见PlProcIsCancelled)，
+    // 工作窃取调度会在每块之间检查
+    void Cancel(PlProcJob* job){
+        job->cancelled.store(true, std::memory_order_relaxed);
+        size_t dropped = 0;
+        {
+            std::lock_guard<std::mutex> lock(this->TaskMutex);
+            ThreadPoolClient* client = job->client;
+            auto& subs = client->submissions;
+            for(auto it = subs.begin(); it != subs.end(); ++it){
+                // 只移除一个任务都还没被取走的提交：已经开始的提交必须完整执行，否则在屏障处等待的任务会永远等不到同伴
+                if(it->job == job && it->next == 0){
+                    dropped = it->tasks;
+                    subs.erase(it);
+                    break;
+                }
+            }
+            if(dropped > 0 && subs.empty() && client->active){
+                client->active = false;
+                this->ActiveClients.erase(std::find(this->ActiveClients.begin(), this->ActiveClients.end(), client));
+            }
+        }
+        if(dropped > 0 && job->remaining.fetch_sub(dropped, std::memory_order_acq_rel) == dropped){
+            job->finish();
+        }
+    }
+    // 静态作业的屏障。等待期间不自旋：若该作业还有未开始的任务，就在当前线程上嵌套执行它们，
+    // 因此任务数超过线程数、或线程池被其他作业占用时也不会死锁；没有可执行的任务时在条件变量上休眠。
+    // 嵌套执行的任务会压在等待者的栈上，所以每个任务在一次调用中最多只能等待一次屏障，需要多次同步的扩展应使用f1r的多阶段
+    void Barrier(StaticJob* job){
+        std::unique_lock<std::mutex> lock(job->barrier_mutex);
+        const size_t generation = job->barrier_generation;
+        if(++job->barrier_arrived == job->threads){
+            // 最后一个到达，放行所有等待者
+            job->barrier_arrived = 0;
+            job->barrier_generation++;
+            job->barrier_cv.notify_all();
+            return;
+        }
+        while(job->barrier_generation == generation){
+            lock.unlock();
+            size_t idx;
+            bool got = this->PopTaskOf(job, idx);
+            if(got){
+                this->RunTask(job, idx);
+            }
+            lock.lock();
+            if(!got){
+                // 所有任务都已开始，只需等待它们到达。此后不会再有新任务出现
+                job->barrier_cv.wait(lock, [job, generation]{ return job->barrier_generation != generation; });
+            }
+        }
+    }
+    // 当tasks=0时，表示tasks=threads。client为nullptr时使用默认客户端
+    int MultiCore(ThreadPoolClient* client,
         char* caller, void* func, void* args, int *ret,
         uint8_t* in_buffer, uint8_t* out_buffer,
         size_t in_shape[],
         size_t tasks
     )
     {   
-        if(tasks == 0){
-            tasks = this->ThreadPool.size();
+        PlProcJob* job = this->SubmitMultiCore(client, caller, func, args, ret, in_buffer, out_buffer, in_shape, tasks);
+        if(job == nullptr){
+            return -114514;
         }
-        // 添加至队列
-        size_t threads = this->ThreadPool.size();
-        if (threads == 0){
-            fprintf(stderr, "ThreadPoolCtx Error: On caller %s, No thread pool initialized. Please call InitThreadPool() first.\n", caller);
+        job->wait(-1);
+        delete job;
+        return 0;
+    }
+    // 异步版本。返回作业句柄，需用PlProcJobRelease释放。线程池未初始化时返回nullptr
+    PlProcJob* SubmitMultiCore(ThreadPoolClient* client,
+        char* caller, void* func, void* args, int *ret,
+        uint8_t* in_buffer, uint8_t* out_buffer,
+        size_t in_shape[],
+        size_t tasks
+    )
+    {
+        StaticJob* job = this->NewStaticJob(caller, func, args, ret, in_buffer, out_buffer, in_shape, tasks);
+        if(job == nullptr){
+            return nullptr;
+        }
+        this->Submit(client, job, tasks);
+        return job;
+    }
+    // 工作窃取调度。将[begin, total)切成大小为grain的块，按阶段依次执行，每个阶段结束后才会开始下一阶段。
+    // grain=0时自动选择，使每个线程约分到RANGE_OVERDECOMPOSE块。
+    // ret的长度应为线程数，ret[i]为第i个工作者遇到的第一个非0返回值
+    static constexpr size_t RANGE_OVERDECOMPOSE = 16;
+    int MultiCoreRange(ThreadPoolClient* client,
+        char* caller, void* func, void* args, int *ret,
+        uint8_t* in_buffer, uint8_t* out_buffer,
+        size_t in_shape[],
+        size_t begin, size_t total, size_t grain, size_t phases
+    )
+    {
+        PlProcJob* job = this->SubmitMultiCoreRange(client, caller, func, args, ret, in_buffer, out_buffer, in_shape, begin, total, grain, phases);
+        if(job == nullptr){
             return -114514;
         }
-        for(size_t i = 0; i < tasks; i++){
-            TaskQueue.push({
-                .threads = tasks,
-                .idx = i,
-                .func = (MultiCoreFunc)func,
-                .args = args,
-                .in_shape = in_shape,
-                .in_buffer = in_buffer,
-                .out_buffer = out_buffer,
-                .ret = ret
+        job->wait(-1);
+        delete job;
+        return 0;
+    }
+    // 异步版本。返回作业句柄，需用PlProcJobRelease释放。线程池未初始化时返回nullptr
+    PlProcJob* SubmitMultiCoreRange(ThreadPoolClient* client,
+        char* caller, void* func, void* args, int *ret,
+        uint8_t* in_buffer, uint8_t* out_buffer,
+        size_t in_shape[],
+        size_t begin, size_t total, size_t grain, size_t phases
+    )
+    {
+        size_t tasks;
+        RangeJob* job = this->NewRangeJob(caller, func, args, ret, in_buffer, out_buffer, in_shape, begin, total, grain, phases, tasks);
+        if(job == nullptr){
+            return nullptr;
+        }
+        this->Submit(client, job, total <= begin ? 0 : tasks);
+        return job;
+    }
+
+    // 融合调度。stages个逐像素步骤，第i步为funcs[i](见MultiCoreRangeFunc)，处理in_buffers[i] -> out_buffers[i]，共phases[i]个阶段。
+    // 所有步骤的形状相同(in_shape)。[begin, total)被切成大小为grain的块，每块依次经过所有步骤。
+    // 只能用于逐像素的步骤：每块内各阶段之间没有同步，一个像素的结果不能依赖其他块
+    int MultiCoreFused(ThreadPoolClient* client,
+        char* caller, size_t stages, void** funcs, void** args, size_t* phases, int *ret,
+        uint8_t** in_buffers, uint8_t** out_buffers,
+        size_t in_shape[],
+        size_t begin, size_t total, size_t grain
+    )
+    {
+        PlProcJob* job = this->SubmitMultiCoreFused(client, caller, stages, funcs, args, phases, ret, in_buffers, out_buffers, in_shape, begin, total, grain);
+        if(job == nullptr){
+            return -114514;
+        }
+        job->wait(-1);
+        delete job;
+        return 0;
+    }
+    // 异步版本。返回作业句柄，需用PlProcJobRelease释放。线程池未初始化时返回nullptr
+    PlProcJob* SubmitMultiCoreFused(ThreadPoolClient* client,
+        char* caller, size_t stages, void** funcs, void** args, size_t* phases, int *ret,
+        uint8_t** in_buffers, uint8_t** out_buffers,
+        size_t in_shape[],
+        size_t begin, size_t total, size_t grain
+    )
+    {
+        FusedJob* fused = new FusedJob();
+        fused->stages.reserve(stages);
+        for(size_t i = 0; i < stages; i++){
+            fused->stages.push_back({
+                .func = (MultiCoreRangeFunc)funcs[i],
+                .args = args[i],
+                .in_buffer = in_buffers[i],
+                .out_buffer = out_buffers[i],
+                .phases = phases[i],
             });
-            // printf("Run %s in thread %zu, total %zu\n", caller, i, tasks);
         }
-        // 唤醒并等待全部任务完成
-        this->TaskQueueCV.notify_all();
-        for(size_t i = 0; i < tasks; i++){
-            this->TaskQueueSemaphore.acquire();
+        size_t tasks;
+        RangeJob* job = this->NewRangeJob(caller, nullptr, nullptr, ret, nullptr, nullptr, in_shape, begin, total, grain, 1, tasks, fused);
+        if(job == nullptr){
+            return nullptr;
+        }
+        this->Submit(client, job, total <= begin || stages == 0 ? 0 : tasks);
+        return job;
+    }
+
+    // 依次执行执行计划的n步。在调用者线程中调度(由ctypes调用时不持有GIL)，各步内部仍使用线程池。
+    // rets[i]为第i步的返回码：该步各任务中第一个非0的返回值(单核为func的返回值)。
+    // 返回0；线程池未初始化时返回-114514，之后的步骤不再执行
+    int RunPlan(ThreadPoolClient* client, PlProcPlanStep* steps, size_t n, int* rets){
+        for(size_t i = 0; i < n; i++){
+            PlProcPlanStep& step = steps[i];
+            int ret = 0;
+            size_t count = 0; // step.ret的项数
+            switch(step.mode){
+            case PLAN_SINGLECORE:
+                ret = SingleCore(step.caller, step.func, step.args, step.ret, step.in_buffer, step.out_buffer, step.in_shape);
+                count = 1;
+                break;
+            case PLAN_MULTICORE:
+                ret = this->MultiCore(client, step.caller, step.func, step.args, step.ret, step.in_buffer, step.out_buffer, step.in_shape, step.tasks);
+                count = step.tasks == 0 ? this->get_threads() : step.tasks;
+                break;
+            case PLAN_RANGE:
+                ret = this->MultiCoreRange(client, step.caller, step.func, step.args, step.ret, step.in_buffer, step.out_buffer, step.in_shape,
+                    step.begin, step.total, step.grain, step.phases);
+                count = this->get_threads();
+                break;
+            case PLAN_FUSED:
+                ret = this->MultiCoreFused(client, step.caller, step.stages, step.funcs, step.stage_args, step.stage_phases, step.ret,
+                    step.in_buffers, step.out_buffers, step.in_shape, step.begin, step.total, step.grain);
+                count = this->get_threads();
+                break;
+            case PLAN_COPY:
+                if(step.out_buffer != step.in_buffer){
+                    memcpy(step.out_buffer, step.in_buffer, step.bytes);
+                }
+                break;
+            default:
+                fprintf(stderr, "[PlProcCore] RunPlan: unknown mode %d at step %zu\n", step.mode, i);
+                break;
+            }
+            if(ret != 0){
+                rets[i] = ret;
+                return ret;
+            }
+            rets[i] = 0;
+            for(size_t j = 0; j < count; j++){
+                if(step.ret[j] != 0){
+                    rets[i] = step.ret[j];
+                    break;
+                }
+            }
         }
         return 0;
     }
 
+    // 开启/关闭性能剖析，返回之前的状态。关闭时不清除未取走的记录
+    bool SetProfiling(bool enable){
+        return this->Profiling.exchange(enable);
+    }
+    // 取走最早的至多cap条任务耗时记录，返回条数
+    size_t TakeTaskTimes(PlProcTaskTime* out, size_t cap){
+        std::lock_guard<std::mutex> lock(this->ProfileMutex);
+        size_t n = std::min(cap, this->TaskTimes.size());
+        std::copy(this->TaskTimes.begin(), this->TaskTimes.begin() + n, out);
+        this->TaskTimes.erase(this->TaskTimes.begin(), this->TaskTimes.begin() + n);
+        return n;
+    }
+
     ~ThreadPoolCtx(){
-        this->ThreadPool_Running = false;
-        this->TaskQueueCV.notify_all();
-        for(auto& thread : this->ThreadPool){
-            thread.join();
-        }
-        this->ThreadPool.clear();
+        this->StopThreads();
     }
 };
 
+void StaticJob::barrier(){
+    this->ctx->Barrier(this);
+}
+
 externc SHARED ThreadPoolCtx* NewThreadPoolCtx(){
     return new ThreadPoolCtx();
 }
@@ -230,10 +878,157 @@ externc SHARED int MultiCore(ThreadPoolCtx* ctx,
     size_t tasks
 )
 {
-    ctx->MultiCore(caller, func, args, ret, in_buffer, out_buffer, in_shape, tasks);
-    return 0;
+    return ctx->MultiCore(nullptr, caller, func, args, ret, in_buffer, out_buffer, in_shape, tasks);
+}
+
+// 工作窃取调度，见ThreadPoolCtx::MultiCoreRange。处理[0, total)
+externc SHARED int MultiCoreRange(ThreadPoolCtx* ctx,
+    char* caller, void* func, void* args, int *ret,
+    uint8_t* in_buffer, uint8_t* out_buffer,
+    size_t in_shape[],
+    size_t total, size_t grain, size_t phases
+)
+{
+    return ctx->MultiCoreRange(nullptr, caller, func, args, ret, in_buffer, out_buffer, in_shape, 0, total, grain, phases);
+}
+
+// 客户端：多个管线共用一个线程池时，每个管线使用自己的客户端，线程池在客户端之间公平轮转
+externc SHARED ThreadPoolClient* NewThreadPoolClient(ThreadPoolCtx* ctx){
+    return ctx->NewClient();
+}
+
+externc SHARED void DeleteThreadPoolClient(ThreadPoolCtx* ctx, ThreadPoolClient* client){
+    ctx->DeleteClient(client);
+}
+
+// 以客户端的名义调用MultiCore。client可以为NULL
+externc SHARED int ClientMultiCore(ThreadPoolCtx* ctx, ThreadPoolClient* client,
+    char* caller, void* func, void* args, int *ret,
+    uint8_t* in_buffer, uint8_t* out_buffer,
+    size_t in_shape[],
+    size_t tasks
+)
+{
+    return ctx->MultiCore(client, caller, func, args, ret, in_buffer, out_buffer, in_shape, tasks);
+}
+
+// 以客户端的名义调用MultiCoreRange，只处理[begin, total)。client可以为NULL
+externc SHARED int ClientMultiCoreRange(ThreadPoolCtx* ctx, ThreadPoolClient* client,
+    char* caller, void* func, void* args, int *ret,
+    uint8_t* in_buffer, uint8_t* out_buffer,
+    size_t in_shape[],
+    size_t begin, size_t total, size_t grain, size_t phases
+)
+{
+    return ctx->MultiCoreRange(client, caller, func, args, ret, in_buffer, out_buffer, in_shape, begin, total, grain, phases);
+}
+
+// 异步提交。立即返回作业句柄，调用者需保证参数与缓冲区在作业结束前有效，并在之后调用PlProcJobRelease。
+// 线程池未初始化时返回NULL
+externc SHARED PlProcJob* ClientSubmitMultiCore(ThreadPoolCtx* ctx, ThreadPoolClient* client,
+    char* caller, void* func, void* args, int *ret,
+    uint8_t* in_buffer, uint8_t* out_buffer,
+    size_t in_shape[],
+    size_t tasks
+)
+{
+    return ctx->SubmitMultiCore(client, caller, func, args, ret, in_buffer, out_buffer, in_shape, tasks);
+}
+
+externc SHARED PlProcJob* ClientSubmitMultiCoreRange(ThreadPoolCtx* ctx, ThreadPoolClient* client,
+    char* caller, void* func, void* args, int *ret,
+    uint8_t* in_buffer, uint8_t* out_buffer,
+    size_t in_shape[],
+    size_t begin, size_t total, size_t grain, size_t phases
+)
+{
+    return ctx->SubmitMultiCoreRange(client, caller, func, args, ret, in_buffer, out_buffer, in_shape, begin, total, grain, phases);
+}
+
+// 融合调度，见ThreadPoolCtx::MultiCoreFused。client可以为NULL
+externc SHARED int ClientMultiCoreFused(ThreadPoolCtx* ctx, ThreadPoolClient* client,
+    char* caller, size_t stages, void** funcs, void** args, size_t* phases, int *ret,
+    uint8_t** in_buffers, uint8_t** out_buffers,
+    size_t in_shape[],
+    size_t begin, size_t total, size_t grain
+)
+{
+    return ctx->MultiCoreFused(client, caller, stages, funcs, args, phases, ret, in_buffers, out_buffers, in_shape, begin, total, grain);
+}
+
+externc SHARED PlProcJob* ClientSubmitMultiCoreFused(ThreadPoolCtx* ctx, ThreadPoolClient* client,
+    char* caller, size_t stages, void** funcs, void** args, size_t* phases, int *ret,
+    uint8_t** in_buffers, uint8_t** out_buffers,
+    size_t in_shape[],
+    size_t begin, size_t total, size_t grain
+)
+{
+    return ctx->SubmitMultiCoreFused(client, caller, stages, funcs, args, phases, ret, in_buffers, out_buffers, in_shape, begin, total, grain);
+}
+
+// 执行计划，见ThreadPoolCtx::RunPlan。client可以为NULL
+externc SHARED int ClientRunPlan(ThreadPoolCtx* ctx, ThreadPoolClient* client, PlProcPlanStep* steps, size_t n, int* rets){
+    return ctx->RunPlan(client, steps, n, rets);
+}
+
+// 查询作业状态，见PlProcJobStatus
+externc SHARED int PlProcJobPoll(PlProcJob* job){
+    return job->poll();
+}
+
+// 等待作业结束。timeout_ms<0表示一直等待。返回作业状态，超时返回JOB_RUNNING
+externc SHARED int PlProcJobWait(PlProcJob* job, int64_t timeout_ms){
+    return job->wait(timeout_ms);
+}
+
+// 请求取消作业，立即返回。作业结束后状态为JOB_CANCELLED
+externc SHARED void PlProcJobCancel(PlProcJob* job){
+    job->ctx->Cancel(job);
+}
+
+// 释放作业句柄。若作业仍在运行，会先取消并等待其结束
+externc SHARED void PlProcJobRelease(PlProcJob* job){
+    if(job->poll() == JOB_RUNNING){
+        job->ctx->Cancel(job);
+        job->wait(-1);
+    }
+    delete job;
+}
+
+// 当前线程正在执行的作业是否已被取消。供扩展在耗时的循环中检查，返回非0时应尽快返回。
+// 扩展导出函数指针变量int (*img2arr_is_cancelled)(void)，加载时会被设为本函数
+externc SHARED int PlProcIsCancelled(void){
+    PlProcJob* job = CurrentJob;
+    return job != nullptr && job->cancelled.load(std::memory_order_relaxed);
+}
+
+// 屏障：等待当前作业的所有任务都执行到这里。用于f1中需要两步计算的扩展(如先预计算共享的表，再使用它)。
+// 只对MultiCore有效；f1r的阶段之间已由核心同步，在其中调用、或不在线程池中调用(如f0)时直接返回。
+// 扩展导出函数指针变量void (*img2arr_barrier_wait)(void)，加载时会被设为本函数
+externc SHARED void PlProcBarrierWait(void){
+    PlProcJob* job = CurrentJob;
+    if(job != nullptr){
+        job->barrier();
+    }
+}
+
+// 性能剖析：开启后线程池记录每个任务的开始/结束时间、线程与阶段，用于观察任务之间的负载是否均衡。
+// 返回之前的状态(0/1)
+externc SHARED int ThreadPoolSetProfiling(ThreadPoolCtx* ctx, int enable){
+    return ctx->SetProfiling(enable != 0);
+}
+
+// 取走最早的至多cap条任务耗时记录(见PlProcTaskTime)，返回条数。
+// 未被取走的记录最多保留ThreadPoolCtx::TASK_TIMES_LIMIT条，之后的记录被丢弃
+externc SHARED size_t ThreadPoolTakeTaskTimes(ThreadPoolCtx* ctx, PlProcTaskTime* out, size_t cap){
+    return ctx->TakeTaskTimes(out, cap);
+}
+
+// 任务耗时记录所用的时钟(单调时钟，纳秒)。用于与调用者的时钟对齐
+externc SHARED int64_t PlProcNowNs(void){
+    return NowNs();
 }
 
 externc SHARED void DeleteThreadPoolCtx(ThreadPoolCtx* ctx){
     delete ctx;
-}
\ No newline at end of file
+}
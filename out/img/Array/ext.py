@@ -1,6 +1,6 @@
 from numpy import uint8
 from numpy.typing import NDArray
-from ctypes import CDLL, c_void_p, c_size_t, c_char_p, POINTER, Structure, cast, byref, sizeof
+from ctypes import CDLL, Array, c_void_p, c_size_t, c_char_p, POINTER, Structure, cast, byref, sizeof
 import string
 import weakref
 
@@ -29,6 +29,44 @@ def int2str(num: int, base: int = 62) -> str:
         res = BASE62[remainder] + res
     return res
 
+def make_lut(num_base: int) -> tuple[list[str], Array[c_char_p]]:
+    """生成0~255的数字字符串表，及其char *lut[]"""
+    lut: list[str] = []
+    max_strnum_len = len(int2str(255, num_base))
+    for i in range(256):
+        lut.append(int2str(i, num_base).zfill(max_strnum_len))
+    # char *lut[]
+    lut_ctypes = (c_char_p * len(lut))(*[s.encode('utf-8') for s in lut])
+    return lut, lut_ctypes
+
+def make_args(lut: list[str], lut_ctypes: Array[c_char_p],
+              arr_prefix: str, num_prefix: str, num_split: str, num_suffix: str, arr_suffix: str,
+              encoding: str = "utf-8") -> "UI.args_t":
+    args = UI.args_t()
+
+    args.num_str_len = len(lut[0])
+    args.lut = lut_ctypes
+    args.arr_prefix_len = len(arr_prefix)
+    args.arr_prefix = arr_prefix.encode(encoding)
+    args.num_prefix_len = len(num_prefix)
+    args.num_prefix = num_prefix.encode(encoding)
+    args.num_split_len = len(num_split)
+    args.num_split = num_split.encode(encoding)
+    args.num_suffix_len = len(num_suffix)
+    args.num_suffix = num_suffix.encode(encoding)
+    args.arr_suffix_len = len(arr_suffix)
+    args.arr_suffix = arr_suffix.encode(encoding)
+    return args
+
+def batch_update(save: dict | None, arr, threads: int, ext: CDLL):
+    """无界面批处理时生成参数。save为`UI.ui_save()`的返回值"""
+    save = save or {}
+    lut, lut_ctypes = make_lut(save.get("num_base", 16))
+    args = make_args(lut, lut_ctypes,
+                     save.get("arr_prefix", "{"), save.get("num_prefix", "0x"), save.get("num_split", ", "),
+                     save.get("num_suffix", ""), save.get("arr_suffix", "}"))
+    return (byref(args), sizeof(args))
+
 class SignalStr(QObject):
     signal = Signal(str)
     
@@ -183,12 +221,7 @@ class UI(abcExt.UI):
         layout.addStretch()
     
     def initLUT(self):
-        self.LUT: list[str] = []
-        max_strnum_len = len(int2str(255, self.num_base))
-        for i in range(256):
-            self.LUT.append(int2str(i, self.num_base).zfill(max_strnum_len))
-        # char *lut[]
-        self.LUT_ctypes = (c_char_p * len(self.LUT))(*[s.encode('utf-8') for s in self.LUT])
+        self.LUT, self.LUT_ctypes = make_lut(self.num_base)
 
     class args_t(Structure):
         # typedef struct {
@@ -228,23 +261,22 @@ class UI(abcExt.UI):
         _pack_ = 1
     
     def update(self, arr, threads: int):
-        args = self.args_t()
-
-        args.num_str_len = len(self.LUT[0])
-        args.lut = self.LUT_ctypes
-        args.arr_prefix_len = len(self.arr_prefix)
-        args.arr_prefix = self.arr_prefix.encode(self.string_encoding)
-        args.num_prefix_len = len(self.num_prefix)
-        args.num_prefix = self.num_prefix.encode(self.string_encoding)
-        args.num_split_len = len(self.num_split)
-        args.num_split = self.num_split.encode(self.string_encoding)
-        args.num_suffix_len = len(self.num_suffix)
-        args.num_suffix = self.num_suffix.encode(self.string_encoding)
-        args.arr_suffix_len = len(self.arr_suffix)
-        args.arr_suffix = self.arr_suffix.encode(self.string_encoding)
+        args = make_args(self.LUT, self.LUT_ctypes,
+                         self.arr_prefix, self.num_prefix, self.num_split, self.num_suffix, self.arr_suffix,
+                         self.string_encoding)
 
         return (byref(args), sizeof(args))
 
+    def ui_save(self) -> dict | None:
+        return {
+            "num_base": self.num_base,
+            "arr_prefix": self.arr_prefix,
+            "num_prefix": self.num_prefix,
+            "num_split": self.num_split,
+            "num_suffix": self.num_suffix,
+            "arr_suffix": self.arr_suffix,
+        }
+
     def UpdatePreviewText(self, text: str):
         if self.preview_textedit is None: 
             logger.error("preview_textedit 竟然神奇的是 None")
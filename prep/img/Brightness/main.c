@@ -79,7 +79,12 @@ enum ExtAttr{
         只读扩展。保证函数的输出缓冲区是NULL。
         Read-only extension. Ensure that the output buffer of the function is NULL.
     */
-    ATTR_READONLY = 2
+    ATTR_READONLY = 2,
+    /*
+        逐像素扩展(REUSE的进阶)。每个输出像素只取决于同一位置的输入像素，且输出形状与输入相同。若同时提供了`f1r`，连续的逐像素扩展会被融合执行。
+        Point-wise extension. Each output pixel depends only on the input pixel at the same position, and the output shape equals the input shape. If `f1r` is also provided, consecutive point-wise extensions are executed fused.
+    */
+    ATTR_POINTWISE = 3
 
 };
 
@@ -101,7 +106,7 @@ enum ExtAttr{
 SHARED int io_GetOutInfo(void* args, size_t in_shape[2], size_t out_shape[2], int* attr){
     out_shape[0] = in_shape[0]; // h
     out_shape[1] = in_shape[1]; // w
-    *attr = ATTR_REUSE;
+    *attr = ATTR_POINTWISE;
     return 0;
 }
 
@@ -173,6 +178,25 @@ SHARED int f1(size_t threads, size_t idx, args_t* args, uint8_t* in_buf, uint8_t
     return f1_func(threads, idx, args, in_buf, out_buf, in_shape);
 }
 
+/**
+ * @brief 区间实现，用于工作窃取调度与融合执行。
+ * Range implementation, used by work-stealing scheduling and fused execution.
+ * @param phase[in] 阶段。只有一个阶段。
+ * Phase. There is only one phase.
+ * @param row_start[in] 起始行。
+ * First row.
+ * @param row_end[in] 结束行(不含)。
+ * Last row (exclusive).
+ * @return 错误码，0表示成功，非0表示失败。
+ * Error code, 0 means success, non-0 means failure.
+ */
+SHARED int f1r(size_t phase, size_t row_start, size_t row_end, args_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[2]){
+    // 逐像素处理，只需把这几行当作一张小图
+    const size_t offset = row_start * in_shape[1] * 4;
+    size_t shape[2] = {row_end - row_start, in_shape[1]};
+    return f1_func(1, 0, args, in_buf + offset, out_buf + offset, shape);
+}
+
 static int f1_default(size_t threads, size_t idx, args_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[2]){
     bool op = args->op;
     uint8_t val = args->val;
@@ -15,12 +15,13 @@ enum{
     ATTR_NONE = 0, // 不指定任何属性。
     ATTR_REUSE = 1, // 能够复用输入缓冲区。若指定定了该参数，in_buf和out_buf可能指向同一块内存。
     ATTR_READONLY = 2, // 只读取，不输出(REUSE的进阶)。若指定了该参数，out_buf一定为NULL。
+    ATTR_POINTWISE = 3, // 逐像素(REUSE的进阶)。输出像素只取决于同一位置的输入像素。提供了f1r时，连续的逐像素扩展会被融合执行。
 };
 
 SHARED int io_GetOutInfo(void* args, size_t in_shape[2], size_t out_shape[2], int* attr){
     out_shape[0] = in_shape[0]; // h
     out_shape[1] = in_shape[1]; // w
-    *attr = ATTR_REUSE;
+    *attr = ATTR_POINTWISE;
     return 0;
 }
 
@@ -92,4 +93,11 @@ SHARED int f0(args_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[2
     
     return f1(1, 0, args, in_buf, out_buf, in_shape);
     
-}
\ No newline at end of file
+}
+
+// 区间版本：处理[row_start, row_end)行。用于工作窃取调度与融合执行
+SHARED int f1r(size_t phase, size_t row_start, size_t row_end, args_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[2]){
+    const size_t offset = row_start * in_shape[1] * 4;
+    size_t shape[2] = {row_end - row_start, in_shape[1]};
+    return f1(1, 0, args, in_buf + offset, out_buf + offset, shape);
+}
@@ -0,0 +1,84 @@
+#include <immintrin.h> // AVX2
+
+#include "main.h"
+
+// 与angle_normalize相同：a - floorf(a)
+static inline __m256 angle_normalize_ps(__m256 a){
+    return _mm256_sub_ps(a, _mm256_floor_ps(a));
+}
+
+// 与roundf相同(四舍五入，远离0)，要求0 <= x < 2^23
+static inline __m256i round_epi32(__m256 x){
+    const __m256i t = _mm256_cvttps_epi32(x);
+    const __m256 frac = _mm256_sub_ps(x, _mm256_cvtepi32_ps(t));
+    return _mm256_sub_epi32(t, _mm256_castps_si256(_mm256_cmp_ps(frac, _mm256_set1_ps(0.5f), _CMP_GE_OQ)));
+}
+
+// 处理8个像素
+static inline __m256i hsv_adjust_8(__m256i px, const hsv_adjust_t* params){
+    const __m256i mask8 = _mm256_set1_epi32(0xff);
+    const __m256 r = _mm256_cvtepi32_ps(_mm256_and_si256(px, mask8));
+    const __m256 g = _mm256_cvtepi32_ps(_mm256_and_si256(_mm256_srli_epi32(px, 8), mask8));
+    const __m256 b = _mm256_cvtepi32_ps(_mm256_and_si256(_mm256_srli_epi32(px, 16), mask8));
+    const __m256i alpha = _mm256_andnot_si256(_mm256_set1_epi32(0xffffff), px);
+
+    // rgb2hsv
+    const __m256 v = _mm256_max_ps(_mm256_max_ps(r, g), b);
+    const __m256 d = _mm256_sub_ps(v, _mm256_min_ps(_mm256_min_ps(r, g), b));
+    const __m256 gray = _mm256_cmp_ps(d, _mm256_setzero_ps(), _CMP_EQ_OQ);
+    __m256 s = _mm256_andnot_ps(gray, _mm256_div_ps(d, v));
+    // 与u8_max3_with_flag相同，相等时取靠前的通道
+    const __m256 r_max = _mm256_and_ps(_mm256_cmp_ps(r, g, _CMP_GE_OQ), _mm256_cmp_ps(r, b, _CMP_GE_OQ));
+    const __m256 g_max = _mm256_cmp_ps(g, b, _CMP_GE_OQ);
+    const __m256 h_r = _mm256_div_ps(_mm256_sub_ps(g, b), d);
+    const __m256 h_g = _mm256_add_ps(_mm256_set1_ps(2.0f), _mm256_div_ps(_mm256_sub_ps(b, r), d));
+    const __m256 h_b = _mm256_add_ps(_mm256_set1_ps(4.0f), _mm256_div_ps(_mm256_sub_ps(r, g), d));
+    __m256 h = _mm256_blendv_ps(_mm256_blendv_ps(h_b, h_g, g_max), h_r, r_max);
+    h = angle_normalize_ps(_mm256_div_ps(h, _mm256_set1_ps(6.0f)));
+    // 中性色：严格中性色，或饱和度低于阈值(阈值为NaN时比较结果恒为假)
+    const __m256 neutral = _mm256_or_ps(gray, _mm256_cmp_ps(s, _mm256_set1_ps(params->thr), _CMP_LT_OQ));
+    h = _mm256_blendv_ps(h, _mm256_set1_ps(params->set_h), neutral);
+    // set_h为NaN时中性色不调整，输出(v, v, v)
+    const __m256i active = _mm256_castps_si256(_mm256_cmp_ps(h, h, _CMP_EQ_OQ));
+
+    h = angle_normalize_ps(_mm256_add_ps(h, _mm256_set1_ps(params->H_change)));
+    s = _mm256_min_ps(_mm256_max_ps(_mm256_add_ps(s, _mm256_set1_ps(params->S_change)), _mm256_setzero_ps()), _mm256_set1_ps(1.0f));
+    const __m256 vf = _mm256_min_ps(_mm256_max_ps(_mm256_add_ps(v, _mm256_set1_ps(params->V_change)), _mm256_setzero_ps()), _mm256_set1_ps(255.0f));
+
+    // hsv2rgb
+    const __m256 one = _mm256_set1_ps(1.0f);
+    const __m256 h6 = _mm256_mul_ps(h, _mm256_set1_ps(6.0f));
+    const __m256 i_f = _mm256_floor_ps(h6);
+    const __m256i i = _mm256_cvttps_epi32(i_f);
+    const __m256 f = _mm256_sub_ps(h6, i_f);
+    const __m256i vi = _mm256_cvttps_epi32(vf);
+    const __m256i p = round_epi32(_mm256_mul_ps(vf, _mm256_sub_ps(one, s)));
+    const __m256i q = round_epi32(_mm256_mul_ps(vf, _mm256_sub_ps(one, _mm256_mul_ps(f, s))));
+    const __m256i t = round_epi32(_mm256_mul_ps(vf, _mm256_sub_ps(one, _mm256_mul_ps(_mm256_sub_ps(one, f), s))));
+    const __m256i i0 = _mm256_or_si256(_mm256_cmpeq_epi32(i, _mm256_setzero_si256()), _mm256_cmpeq_epi32(i, _mm256_set1_epi32(6)));
+    const __m256i i1 = _mm256_cmpeq_epi32(i, _mm256_set1_epi32(1));
+    const __m256i i2 = _mm256_cmpeq_epi32(i, _mm256_set1_epi32(2));
+    const __m256i i3 = _mm256_cmpeq_epi32(i, _mm256_set1_epi32(3));
+    const __m256i i4 = _mm256_cmpeq_epi32(i, _mm256_set1_epi32(4));
+    const __m256i i5 = _mm256_cmpeq_epi32(i, _mm256_set1_epi32(5));
+    // 0: v t p, 1: q v p, 2: p v t, 3: p q v, 4: t p v, 5: v p q
+    __m256i ro = _mm256_blendv_epi8(_mm256_blendv_epi8(_mm256_blendv_epi8(p, t, i4), q, i1), vi, _mm256_or_si256(i0, i5));
+    __m256i go = _mm256_blendv_epi8(_mm256_blendv_epi8(_mm256_blendv_epi8(p, q, i3), vi, _mm256_or_si256(i1, i2)), t, i0);
+    __m256i bo = _mm256_blendv_epi8(_mm256_blendv_epi8(_mm256_blendv_epi8(p, q, i5), vi, _mm256_or_si256(i3, i4)), t, i2);
+    ro = _mm256_blendv_epi8(vi, ro, active);
+    go = _mm256_blendv_epi8(vi, go, active);
+    bo = _mm256_blendv_epi8(vi, bo, active);
+    return _mm256_or_si256(_mm256_or_si256(ro, _mm256_slli_epi32(go, 8)), _mm256_or_si256(_mm256_slli_epi32(bo, 16), alpha));
+}
+
+size_t hsv_adjust_avx2(const uint8_t* in, uint8_t* out, size_t n, const hsv_adjust_t* params){
+    size_t i = 0;
+    // 每次处理16个像素
+    for(; i + 16 <= n; i += 16){
+        const __m256i a = _mm256_loadu_si256((const __m256i*)(in + i * 4));
+        const __m256i b = _mm256_loadu_si256((const __m256i*)(in + i * 4 + 32));
+        _mm256_storeu_si256((__m256i*)(out + i * 4), hsv_adjust_8(a, params));
+        _mm256_storeu_si256((__m256i*)(out + i * 4 + 32), hsv_adjust_8(b, params));
+    }
+    return i;
+}
@@ -0,0 +1,35 @@
+#!/bin/bash
+
+# 检查是否提供了输出文件名
+if [ -z "$1" ]; then
+    echo -e "\033[31m错误: 请提供输出文件名\033[0m"
+    echo "用法: $0 <输出文件名>"
+    exit 1
+fi
+# 第一个传入参数是输出文件名
+OUTPUT_FILE_NAME=$1
+
+# AVX2 编译
+echo "编译 AVX2 模块..."
+gcc avx2.c -fPIC -c -o avx2.o -mavx2 -O3
+if [ $? -ne 0 ]; then
+    echo -e "\033[31mAVX2 编译失败\033[0m"
+    exit 1
+fi
+
+# SSE2 编译
+echo "编译 SSE2 模块..."
+gcc sse2.c -fPIC -c -o sse2.o -msse2 -O3
+if [ $? -ne 0 ]; then
+    echo -e "\033[31mSSE2 编译失败\033[0m"
+    exit 1
+fi
+
+echo "链接主程序..."
+gcc main.c avx2.o sse2.o -shared -fPIC -O3 -o $OUTPUT_FILE_NAME -lm -lc -lgcc
+if [ $? -ne 0 ]; then
+    echo -e "\033[31m链接失败\033[0m"
+    exit 1
+fi
+
+echo -e "\033[32m编译完成: $OUTPUT_FILE_NAME\033[0m"
@@ -5,7 +5,7 @@ from lib.ExtensionPyABC import abcExt
 from numpy import nan, full, float32
 from ctypes import (
     CDLL,
-    c_float, c_int, c_uint16, c_bool, c_size_t, c_uint, 
+    c_float, c_int, c_uint16, c_bool, c_size_t, c_uint, c_void_p,
     Structure, POINTER,
     byref, sizeof
 )
@@ -18,14 +18,123 @@ def signal_format_int(i:int, format:str = "d"):
     else:
         return f"{i:+{format}}"
 
+class RgbLut:
+    """C端分配的RGB→RGB查找表。内存按需分配，对象销毁时释放"""
+    def __init__(self, ext: CDLL, key: tuple):
+        self.ext = ext
+        self.key = key # 生成查找表内容的参数，参数变化时需要换用新表
+        self.ptr = ext.rgb_lut_new()
+        if not self.ptr:
+            raise MemoryError("rgb_lut_new() failed")
+    def __del__(self):
+        self.ext.rgb_lut_free(self.ptr)
+
+def has_rgb_lut(ext: CDLL) -> bool:
+    """扩展是否支持查找表。旧版本的扩展(如未重新编译的预编译库)没有rgb_lut_new/rgb_lut_free"""
+    return hasattr(ext, "rgb_lut_new") and hasattr(ext, "rgb_lut_free")
+
+def has_hue_pyramid(ext: CDLL) -> bool:
+    """扩展是否支持金字塔算法。旧版本的扩展没有hue_pyramid_size，只能使用射线扫描"""
+    return hasattr(ext, "hue_pyramid_size")
+
+def bind(ext: CDLL):
+    """设置用到的导出函数的argtypes"""
+    # atomic_size_t* atomic_init_size_t(atomic_size_t* p, size_t v)
+    ext.atomic_init_size_t.argtypes = [POINTER(c_size_t), c_size_t]
+    ext.atomic_init_size_t.restype = POINTER(c_size_t)
+    if has_rgb_lut(ext):
+        # atomic_uint* rgb_lut_new(void)
+        ext.rgb_lut_new.argtypes = []
+        ext.rgb_lut_new.restype = c_void_p
+        # void rgb_lut_free(atomic_uint* lut)
+        ext.rgb_lut_free.argtypes = [c_void_p]
+        ext.rgb_lut_free.restype = None
+    if has_hue_pyramid(ext):
+        # size_t hue_pyramid_size(size_t in_shape[2])
+        ext.hue_pyramid_size.argtypes = [POINTER(c_size_t)]
+        ext.hue_pyramid_size.restype = c_size_t
+
+# 各设置的默认值，与界面控件的初始值相同。键与`UI.ui_save()`相同
+DEFAULTS = {
+    "h_change": 0, # °
+    "s_change": 0, # %
+    "v_change": 0,
+    "exception_process": 1, # EXCEPT_IGNORE_S_H
+    "smart_fillH": False,
+    "fill_algorithm": 0, # 0: 射线扫描，1: 多尺度金字塔
+    "EXCEPT_SET_H_value": 0.0, # °
+    "pre_write_h": True,
+    "step": 1,
+    "scan_8_ways": 1,
+    "sample_times": 8,
+    "mad_k": 3.0,
+    "fix": False,
+    "S_thr": 0.03,
+    "ignore_npixels": False,
+    "rgb_lut": True,
+}
+
+def make_args(ext: CDLL, save: dict | None, arr, threads: int, rgb_lut: RgbLut | None) -> tuple["UI.args_t", RgbLut | None]:
+    """由设置生成参数。rgb_lut为上一次使用的查找表，参数不变时沿用。返回(参数, 本次使用的查找表)"""
+    save = {**DEFAULTS, **(save or {})}
+    smart_fillH = save["smart_fillH"]
+    h_buffer_sync = (c_size_t * 1)()
+    ext.atomic_init_size_t(h_buffer_sync, threads)
+    if smart_fillH and save["fill_algorithm"] == 1 and has_hue_pyramid(ext):
+        # 金字塔算法不需要h_buffer。金字塔在每次计算时完整重建
+        h_buffer = None
+        in_shape = (c_size_t * 2)(arr.shape[0], arr.shape[1])
+        hue_pyramid = (c_float * ext.hue_pyramid_size(in_shape))()
+    else:
+        h_buffer = (c_float * (arr.shape[1] * arr.shape[0]))(nan)
+        hue_pyramid = None
+
+    arg = UI.args_t(H_change=save["h_change"] / 360.0,
+                    S_change=save["s_change"] / 100.0,
+                    V_change=save["v_change"],
+                    exception_process=save["exception_process"],
+                    smart_fillH=smart_fillH,
+                    EXCEPT_SET_H_value=save["EXCEPT_SET_H_value"] / 360.0,
+                    h_buffer=h_buffer,
+                    h_buffer_sync=h_buffer_sync,
+                    pre_write_h=save["pre_write_h"],
+                    step=save["step"],
+                    scan_8_ways=save["scan_8_ways"],
+                    sample_times=save["sample_times"],
+                    mad_k=save["mad_k"],
+                    S_thr=save["S_thr"] if save["fix"] else -1.0,
+                    ignore_npixels=save["ignore_npixels"],
+                    hue_pyramid=hue_pyramid
+    )
+    if save["rgb_lut"] and has_rgb_lut(ext):
+        # 查表结果取决于这些参数。参数不变时沿用已填充的表
+        lut_key = (arg.H_change, arg.S_change, arg.V_change, arg.exception_process, smart_fillH, arg.EXCEPT_SET_H_value, arg.S_thr)
+        if rgb_lut is None or rgb_lut.key != lut_key:
+            rgb_lut = RgbLut(ext, lut_key)
+        arg.rgb_lut = rgb_lut.ptr
+        # 计算可能晚于下一次update，由参数持有查找表，防止被提前释放
+        arg._rgb_lut = rgb_lut
+    else:
+        rgb_lut = None
+    return arg, rgb_lut
+
+_batch_rgb_lut: RgbLut | None = None
+"""批处理时各图片共用的查找表。参数相同，已填充的结果可以直接沿用"""
+
+def batch_update(save: dict | None, arr, threads: int, ext: CDLL):
+    """无界面批处理时生成参数。save为`UI.ui_save()`的返回值"""
+    global _batch_rgb_lut
+    bind(ext)
+    arg, _batch_rgb_lut = make_args(ext, save, arr, threads, _batch_rgb_lut)
+    return byref(arg), sizeof(arg)
+
 class UI(abcExt.UI):
     def __init__(self):
         ...
     def ui_init(self, widget: QWidget, ext: CDLL, save: dict | None):
-        # atomic_size_t* atomic_init_size_t(atomic_size_t* p, size_t v)
         self.ext = ext
-        ext.atomic_init_size_t.argtypes = [POINTER(c_size_t), c_size_t]
-        ext.atomic_init_size_t.restype = POINTER(c_size_t)
+        bind(ext)
+        self.rgb_lut: RgbLut | None = None
         layout = QVBoxLayout()
         widget.setLayout(layout)
 
@@ -119,10 +228,31 @@ class UI(abcExt.UI):
         self.smart_fillH_param_widget.setLayout(smart_fillH_param_layout)
         smart_fillH_param_layout.setContentsMargins(20, 0, 0, 0)
         layout.addWidget(self.smart_fillH_param_widget)
+        # 填充算法
+        algorithm_layout = QHBoxLayout()
+        smart_fillH_param_layout.addLayout(algorithm_layout)
+        algorithm_layout.addWidget(QLabel("算法："))
+        self.fill_algorithm = QComboBox()
+        algorithm_layout.addWidget(self.fill_algorithm)
+        self.fill_algorithm.addItem("射线扫描")
+        self.fill_algorithm.addItem("多尺度金字塔")
+        self.fill_algorithm.setToolTip("射线扫描：从每个中性色像素向四周扫描，中性色区域越大越慢\n多尺度金字塔：逐层平均周围的色相，速度与中性色区域的大小无关")
+        self.fill_algorithm.setCurrentIndex(0)
+        if not has_hue_pyramid(ext):
+            self.fill_algorithm.model().item(1).setEnabled(False)
+            self.fill_algorithm.setItemData(1, "当前扩展版本不支持金字塔算法，请重新编译扩展", Qt.ItemDataRole.ToolTipRole)
+        self.fill_algorithm.currentIndexChanged.connect(self.Update)
+        algorithm_layout.addStretch()
+        # 射线扫描参数
+        self.ray_param_widget = QWidget()
+        ray_param_layout = QVBoxLayout()
+        ray_param_layout.setContentsMargins(0, 0, 0, 0)
+        self.ray_param_widget.setLayout(ray_param_layout)
+        smart_fillH_param_layout.addWidget(self.ray_param_widget)
         # 步长
         step_layout = QHBoxLayout()
         step_layout.setContentsMargins(0, 0, 0, 0)
-        smart_fillH_param_layout.addLayout(step_layout)
+        ray_param_layout.addLayout(step_layout)
         step_layout.addWidget(QLabel("步长："))
         self.step = QSpinBox()
         self.step.setRange(1, INT32_MAX)
@@ -132,7 +262,7 @@ class UI(abcExt.UI):
         step_layout.addStretch()
         # 4/8方向扫描
         ways_layout = QHBoxLayout()
-        smart_fillH_param_layout.addLayout(ways_layout)
+        ray_param_layout.addLayout(ways_layout)
         ways_layout.addWidget(QLabel("扫描方向数："))
         self.scan_8_ways = QComboBox()
         ways_layout.addWidget(self.scan_8_ways)
@@ -143,7 +273,7 @@ class UI(abcExt.UI):
         ways_layout.addStretch()
         # 采样次数
         sample_times_layout = QHBoxLayout()
-        smart_fillH_param_layout.addLayout(sample_times_layout)
+        ray_param_layout.addLayout(sample_times_layout)
         sample_times_layout.addWidget(QLabel("采样次数："))
         self.sample_times = QSpinBox()
         sample_times_layout.addWidget(self.sample_times)
@@ -153,7 +283,7 @@ class UI(abcExt.UI):
         sample_times_layout.addStretch()
         # MAD去噪k值
         mad_k_layout = QHBoxLayout()
-        smart_fillH_param_layout.addLayout(mad_k_layout)
+        ray_param_layout.addLayout(mad_k_layout)
         mad_k_layout.addWidget(QLabel("MAD去噪k值："))
         self.mad_k = QDoubleSpinBox()
         mad_k_layout.addWidget(self.mad_k)
@@ -165,7 +295,7 @@ class UI(abcExt.UI):
         # 缓存回写
         self.pre_write_h_check = QCheckBox("缓存回写")
         self.pre_write_h_check.setChecked(True)
-        smart_fillH_param_layout.addWidget(self.pre_write_h_check)
+        ray_param_layout.addWidget(self.pre_write_h_check)
         self.pre_write_h_check.stateChanged.connect(self.Update)
         # 色彩修复
         color_fix_layout = QHBoxLayout()
@@ -186,6 +316,16 @@ class UI(abcExt.UI):
         self.transparent_as_neutral_check = QCheckBox("将透明像素视为中性色")
         layout.addWidget(self.transparent_as_neutral_check)
         self.transparent_as_neutral_check.stateChanged.connect(self.Update)
+        # 查找表
+        self.rgb_lut_check = QCheckBox("查找表加速")
+        self.rgb_lut_check.setChecked(True)
+        self.rgb_lut_check.setToolTip("缓存每种颜色的计算结果，参数不变时重复计算只需查表\n最多占用64MB内存，只有实际出现过的颜色才会占用\n不使用智能算法且CPU支持SSE2/AVX2时，直接使用更快的向量化实现")
+        layout.addWidget(self.rgb_lut_check)
+        if not has_rgb_lut(ext):
+            self.rgb_lut_check.setChecked(False)
+            self.rgb_lut_check.setEnabled(False)
+            self.rgb_lut_check.setToolTip("当前扩展版本不支持查找表，请重新编译扩展")
+        self.rgb_lut_check.stateChanged.connect(self.Update)
 
 
         self.smart_fillH_param_label.setVisible(False)
@@ -202,6 +342,7 @@ class UI(abcExt.UI):
             self.exception_process_text2.setVisible(True)
             self.smart_fillH_param_label.setVisible(True)
             self.smart_fillH_param_widget.setVisible(True)
+            self.ray_param_widget.setVisible(self.fill_algorithm.currentIndex() == 0)
         else:
             self.exception_process_text.setVisible(True)
             self.exception_process_text2.setVisible(False)
@@ -238,6 +379,10 @@ typedef struct {
     float mad_k; // MAD去噪时的k值
     float S_thr; //[色彩修复]调整中性色的明度判定阈值。若S_thr<0，则无效，严格判定中性色；否则，当颜色的S < S_thr时，就会判定为中性色，可以结合smart_fillH来完成色彩修复。
     bool ignore_npixels; // 仅当使用了smart_fillH有效。是否在预计算阶段将透明像素视为中性色并填充。若为false，则忽略透明通道。
+
+    atomic_uint *rgb_lut; // RGB→RGB查找表，由rgb_lut_new分配，计算时按需填充。若为NULL则不使用。参数(除智能算法参数外)变化后必须换用新表。
+
+    float *hue_pyramid; // 仅当使用了smart_fillH有效。色相向量金字塔，需要分配hue_pyramid_size()个float。不为NULL时改用金字塔算法填充色相，每个像素的计算量有上界；为NULL时使用上面的射线扫描算法。
 }__attribute__((packed)) args_t;
     """
     class args_t(Structure):
@@ -257,49 +402,30 @@ typedef struct {
             ("mad_k", c_float),
             ("S_thr", c_float),
             ("ignore_npixels", c_bool),
+            ("rgb_lut", c_void_p),
+            ("hue_pyramid", POINTER(c_float)),
         ]
         _pack_ = 1
     def update(self, arr, threads):
-        H_change = self.h_change.value() / 360.0
-        S_change = self.s_change.value() / 100.0
-        V_change = self.v_change.value()
-        exception_process = self.exception_process_group.checkedId()
-        smart_fillH = self.smart_fillH_check.isChecked() # 启用智能算法
-        EXCEPT_SET_H_value = self.EXCEPT_SET_H_value.value() / 360.0
-        pre_write_h = self.pre_write_h_check.isChecked()
-        step = self.step.value()
-        scan_8_ways = self.scan_8_ways.currentIndex()
-        sample_times = self.sample_times.value()
-        mad_k = self.mad_k.value()
-        ignore_npixels = self.transparent_as_neutral_check.isChecked()
-        # S_thr = self.S_thr.value()
-        if self.fix_switch.isChecked():
-            S_thr = self.S_thr.value()
-        else:
-            S_thr = -1.0
-        if True:
-            h_buffer = (c_float * (arr.shape[1] * arr.shape[0]))(nan)
-            h_buffer_sync = (c_size_t * 1)()
-            self.ext.atomic_init_size_t(h_buffer_sync, threads)
-        else:
-            h_buffer = None
-            h_buffer_sync = None
-
-        arg = self.args_t(H_change=H_change,
-                          S_change=S_change,
-                          V_change=V_change,
-                          exception_process=exception_process,
-                          smart_fillH=smart_fillH,
-                          EXCEPT_SET_H_value=EXCEPT_SET_H_value,
-                          h_buffer=h_buffer,
-                          h_buffer_sync=h_buffer_sync,
-                          pre_write_h=pre_write_h,
-                          step=step,
-                          scan_8_ways=scan_8_ways,
-                          sample_times=sample_times,
-                          mad_k=mad_k,
-                          S_thr=S_thr,
-                          ignore_npixels=ignore_npixels
-        )
+        arg, self.rgb_lut = make_args(self.ext, self.ui_save(), arr, threads, self.rgb_lut)
+        return byref(arg), sizeof(arg)
 
-        return byref(arg), sizeof(arg)
\ No newline at end of file
+    def ui_save(self) -> dict | None:
+        return {
+            "h_change": self.h_change.value(),
+            "s_change": self.s_change.value(),
+            "v_change": self.v_change.value(),
+            "exception_process": self.exception_process_group.checkedId(),
+            "smart_fillH": self.smart_fillH_check.isChecked(),
+            "fill_algorithm": self.fill_algorithm.currentIndex(),
+            "EXCEPT_SET_H_value": self.EXCEPT_SET_H_value.value(),
+            "pre_write_h": self.pre_write_h_check.isChecked(),
+            "step": self.step.value(),
+            "scan_8_ways": self.scan_8_ways.currentIndex(),
+            "sample_times": self.sample_times.value(),
+            "mad_k": self.mad_k.value(),
+            "fix": self.fix_switch.isChecked(),
+            "S_thr": self.S_thr.value(),
+            "ignore_npixels": self.transparent_as_neutral_check.isChecked(),
+            "rgb_lut": self.rgb_lut_check.isChecked(),
+        }
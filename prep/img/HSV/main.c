@@ -1,6 +1,7 @@
 // #include <required_standard_headers.h>
 #include <stdint.h>
 #include <stdlib.h>
+#include <stdbool.h>
 #include <stddef.h>
 #include <math.h>
 #include <stdatomic.h>
@@ -9,6 +10,7 @@
 // #include <required_project_headers.h>
 
 // #include <required_custom_headers.h>
+#include "main.h"
 
 #ifndef M_PI
 #define M_PI 3.14159265358979323846
@@ -52,10 +54,18 @@ enum ExtAttr{
         只读扩展。保证函数的输出缓冲区是NULL。
         Read-only extension. Ensure that the output buffer of the function is NULL.
     */
-    ATTR_READONLY = 2
+    ATTR_READONLY = 2,
+    /*
+        逐像素扩展(REUSE的进阶)。每个输出像素只取决于同一位置的输入像素，且输出形状与输入相同。若同时提供了`f1r`，连续的逐像素扩展会被融合执行。
+        Point-wise extension. Each output pixel depends only on the input pixel at the same position, and the output shape equals the input shape. If `f1r` is also provided, consecutive point-wise extensions are executed fused.
+    */
+    ATTR_POINTWISE = 3
 
 };
 
+// 向量化的逐像素调整。为NULL时全部使用原始实现
+static hsv_adjust_func_t hsv_adjust_func = NULL;
+
 /**
  * @brief 初始化函数。当扩展被加载时，会被调用一次，在重新加载前不会再次调用。
  * This function is called once when the extension is loaded, and it will not be called again before reloading.
@@ -65,10 +75,50 @@ enum ExtAttr{
  * @note No such function will not cause the extension to fail to load, but it cannot be customized to initialize.
  */
 SHARED int init(void){
-    // Implement here.
+    __builtin_cpu_init(); // 初始化CPU检测
+    if(__builtin_cpu_supports("avx2")){
+        hsv_adjust_func = hsv_adjust_avx2;
+    }
+    else if(__builtin_cpu_supports("sse2")){
+        hsv_adjust_func = hsv_adjust_sse2;
+    }
+    // 否则，使用原始实现
     return 0;
 }
 
+/**
+ * @brief 指定逐像素调整使用的实现，供verify.py逐一校验各实现与原始实现的结果逐位相同。
+ * Select the per-pixel adjustment implementation, so verify.py can check each one against the scalar path.
+ * @param level[in] 0: 原始实现，1: SSE2，2: AVX2。
+ * 0: scalar, 1: SSE2, 2: AVX2.
+ * @return 0表示成功；CPU不支持或level无效时返回1，此时不做改变。
+ * 0 on success; 1 if the CPU lacks the instruction set or level is invalid, in which case nothing changes.
+ */
+SHARED int hsv_adjust_select(int level){
+    __builtin_cpu_init();
+    switch(level){
+        case 0:
+            hsv_adjust_func = NULL;
+            return 0;
+        case 1:
+            if(!__builtin_cpu_supports("sse2")) return 1;
+            hsv_adjust_func = hsv_adjust_sse2;
+            return 0;
+        case 2:
+            if(!__builtin_cpu_supports("avx2")) return 1;
+            hsv_adjust_func = hsv_adjust_avx2;
+            return 0;
+        default:
+            return 1;
+    }
+}
+
+// 取消标志查询，加载时由img2arr设置。返回非0表示本次计算已被取消(结果会被丢弃)，应尽快返回
+SHARED int (*img2arr_is_cancelled)(void) = NULL;
+
+// 屏障，加载时由img2arr设置。本次计算的所有任务都调用后才返回，等待期间不占用CPU
+SHARED void (*img2arr_barrier_wait)(void) = NULL;
+
 SHARED atomic_size_t* atomic_init_size_t(atomic_size_t* p, size_t v){
     atomic_init(p, v);
     return p;
@@ -198,7 +248,7 @@ typedef struct {
     float EXCEPT_SET_H_value; // 当exception_process为EXCEPT_SET_H时，设定H的特定值。建议范围是[0, 1]对应[0, 360°]。
 
     float *h_buffer; // 用于预存储H通道的值来加速智能填充的速度。若为NULL则不使用。仅当使用了smart_fillH时有效。需要分配(width * height * sizeof(float))大小的内存。初始值应为NaN。
-    atomic_size_t *h_buffer_sync; //用于同步所有线程完成h_buffer的写入。其初始值应为线程数
+    atomic_size_t *h_buffer_sync; //用于同步所有线程完成h_buffer的写入。其初始值应为线程数。仅在img2arr_barrier_wait不可用时使用
 
     bool pre_write_h; //仅当使用了smart_fillH且启用缓存时有效。当某个线程完成了对色相的解算，是否将其结果提前写入到 h_buffer中。能够加速智能填充的速度，同时使结果更为平滑。
     unsigned int step; // 仅当使用了smart_fillH有效。指定步长。
@@ -208,8 +258,34 @@ typedef struct {
     float S_thr; //[色彩修复]调整中性色的明度判定阈值。若S_thr<0，则无效，严格判定中性色；否则，当颜色的S < S_thr时，就会判定为中性色，可以结合smart_fillH来完成色彩修复。
     bool ignore_npixels; // 仅当使用了smart_fillH有效。是否在预计算阶段将透明像素视为中性色并填充。若为false，则忽略透明通道。
 
+    atomic_uint *rgb_lut; // RGB→RGB查找表，由rgb_lut_new分配，计算时按需填充。若为NULL则不使用。参数(除智能算法参数外)变化后必须换用新表。
+
+    float *hue_pyramid; // 仅当使用了smart_fillH有效。色相向量金字塔，需要分配hue_pyramid_size()个float。不为NULL时改用金字塔算法填充色相，每个像素的计算量有上界；为NULL时使用上面的射线扫描算法。
+
 }__attribute__((packed)) args_t;
 
+// 查找表项：低24位为输出的RGB，高位为标志。0表示尚未计算
+#define RGB_LUT_SIZE (1u << 24)
+#define RGB_LUT_VALID (1u << 24) // 已计算，低24位有效
+
+/**
+ * @brief 分配RGB→RGB查找表。内存初始为0且按需分配物理页，只有实际出现过的颜色才会占用内存。
+ * Allocate the RGB->RGB lookup table. The memory is zeroed and committed lazily, so only colors that actually occur take up memory.
+ * @return 查找表。失败时为NULL。
+ * The lookup table, or NULL on failure.
+ */
+SHARED atomic_uint* rgb_lut_new(void){
+    return calloc(RGB_LUT_SIZE, sizeof(atomic_uint));
+}
+
+/**
+ * @brief 释放rgb_lut_new分配的查找表。
+ * Free a lookup table allocated by rgb_lut_new.
+ */
+SHARED void rgb_lut_free(atomic_uint* lut){
+    free(lut);
+}
+
 /**
  * @brief 获取输出数据信息。在调用`f0`或`f1`之前会被调用以确认输出缓冲区大小及其属性.
  * Get output data information. It will be called before calling `f0` or `f1` to confirm the size and attributes of the output buffer.
@@ -231,7 +307,8 @@ SHARED int io_GetOutInfo(args_t* args, size_t in_shape[2], size_t out_shape[2],
     const size_t width = in_shape[1];
     out_shape[0] = height;
     out_shape[1] = width;
-    *attr = ATTR_REUSE;
+    // 智能填充需要参考周围的像素，其余情况是逐像素的
+    *attr = args->smart_fillH ? ATTR_REUSE : ATTR_POINTWISE;
     // Other Implement here.
     return 0;
 }
@@ -344,31 +421,164 @@ inline float rdistancef(float x0, float y0, float x1, float y1){
 
 #include <stdio.h>
 
+// 预计算：将[start, end)像素的色相写入h_buffer。仅当使用了smart_fillH且启用缓存时有效
+static void hsv_fill_h_buffer(args_t* args, uint8_t* in_buf, size_t start, size_t end){
+    float *const h_buffer = args->h_buffer;
+    const float S_thr = args->S_thr;
+    const bool ignore_npixels = args->ignore_npixels;
+    float thr = NAN;
+    if(S_thr >= 0.0f) thr = S_thr;
+    for(size_t p = start * 4, i = start; i < end; p+=4, i++){
+        uint8_t r = in_buf[p], g = in_buf[p+1], b = in_buf[p+2], a = in_buf[p+3];
+        color_hsv_t hsv = rgb2hsv_withthr(r,g,b, thr);
+        if(ignore_npixels && a == 0) hsv.h = NAN;
+        h_buffer[i] = hsv.h;
+    }
+}
+
+/*
+色相向量金字塔：第k层(k>=1)的每个格子对应原图中2^k×2^k的区域，存储3个float：
+区域内有色相的像素数、这些像素色相单位向量的cos分量之和、sin分量之和。
+填充中性色像素时，从最细的一层开始，对当前像素所在位置做双线性插值，取第一个含有色相的层的平均方向。
+每个像素至多查询层数×4个格子，计算量与中性色区域的大小无关。
+*/
+#define PYRAMID_MAX_LEVELS 64
+
+typedef struct{
+    size_t levels; // 层数，不含原图
+    size_t h[PYRAMID_MAX_LEVELS], w[PYRAMID_MAX_LEVELS]; // 第i+1层的尺寸
+    size_t offset[PYRAMID_MAX_LEVELS]; // 第i+1层在缓冲区中的起始位置(float)
+    size_t size; // 缓冲区总大小(float)
+}pyramid_layout_t;
+
+static void pyramid_layout(size_t height, size_t width, pyramid_layout_t* layout){
+    size_t h = height, w = width, offset = 0, levels = 0;
+    while((h > 1 || w > 1) && levels < PYRAMID_MAX_LEVELS){
+        h = (h + 1) / 2;
+        w = (w + 1) / 2;
+        layout->h[levels] = h;
+        layout->w[levels] = w;
+        layout->offset[levels] = offset;
+        offset += h * w * 3;
+        levels++;
+    }
+    layout->levels = levels;
+    layout->size = offset;
+}
+
 /**
- * @brief 主函数：多线程实现。
- * Multi-threaded implementation.
- * @param threads[in] 任务数。
- * Number of tasks.
- * @param idx[in] 任务索引。
- * Task index.
- * @param args[in/out] 参数解析结构体。
- * Parameter parsing structure.
- * @param in_buf[in] 输入缓冲区，格式为`[*in_shape, 4]`。
- * Input buffer, format is `[*in_shape, 4]`.
- * @param out_buf[out] 输出缓冲区。大小由`io_GetOutInfo`指定。
- * Output buffer. The size is specified by `io_GetOutInfo`.
- * @param in_shape[in] 输入缓冲区形状。关于具体内容，参考下面的注释说明。
- * Input buffer shape. For specific content, refer to the comment description below.
- * @return 错误码，0表示成功，非0表示失败。若函数无返回，则可能返回随机值
- * Error code, 0 means success, non-0 means failure. If the function has no return, it may return a random value.
+ * @brief 获取色相向量金字塔需要的内存大小。
+ * Get the size of the hue vector pyramid.
+ * @param in_shape[in] 输入缓冲区形状。
+ * Input buffer shape.
+ * @return float的个数。
+ * Number of floats.
  */
-SHARED int f1(size_t threads, size_t idx, args_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[3]){
-    // 计算该线程处理的像素点范围。如果需要特殊需求，请自行修改。
-    // Calculate the pixel range processed by this thread. If you need special requirements, please modify it yourself.
-    const size_t size = in_shape[0] * in_shape[1];
-    const size_t start = (size * idx / threads);
-    const size_t end = (size * (idx + 1) / threads);
+SHARED size_t hue_pyramid_size(size_t in_shape[2]){
+    pyramid_layout_t layout;
+    pyramid_layout(in_shape[0], in_shape[1], &layout);
+    return layout.size;
+}
+
+// 金字塔第1层：计算[row_start, row_end)行格子，每个格子直接读取原图的2×2像素
+static void hue_pyramid_fill_base(args_t* args, uint8_t* in_buf, size_t in_shape[3], size_t row_start, size_t row_end){
+    const size_t height = in_shape[0];
+    const size_t width = in_shape[1];
+    const bool ignore_npixels = args->ignore_npixels;
+    float thr = NAN;
+    if(args->S_thr >= 0.0f) thr = args->S_thr;
+    pyramid_layout_t layout;
+    pyramid_layout(height, width, &layout);
+    if(layout.levels == 0) return;
+    const size_t w1 = layout.w[0];
+    float *const level = args->hue_pyramid + layout.offset[0];
+    for(size_t j = row_start; j < row_end; j++){
+        for(size_t i = 0; i < w1; i++){
+            float n = 0.0f, c = 0.0f, s = 0.0f;
+            for(size_t y = j * 2; y < j * 2 + 2 && y < height; y++){
+                for(size_t x = i * 2; x < i * 2 + 2 && x < width; x++){
+                    const size_t p4 = (y * width + x) * 4;
+                    color_hsv_t hsv = rgb2hsv_withthr(in_buf[p4], in_buf[p4+1], in_buf[p4+2], thr);
+                    if(ignore_npixels && in_buf[p4+3] == 0) hsv.h = NAN;
+                    if(isnan(hsv.h)) continue;
+                    const float angle = hsv.h * 2.0f * M_PI;
+                    n += 1.0f;
+                    c += cosf(angle);
+                    s += sinf(angle);
+                }
+            }
+            float *const cell = level + (j * w1 + i) * 3;
+            cell[0] = n;
+            cell[1] = c;
+            cell[2] = s;
+        }
+    }
+}
 
+// 金字塔第2层及以上：逐层将2×2个格子求和。计算量约为原图的1/12，单线程完成
+static void hue_pyramid_fill_upper(args_t* args, size_t in_shape[3]){
+    pyramid_layout_t layout;
+    pyramid_layout(in_shape[0], in_shape[1], &layout);
+    for(size_t k = 1; k < layout.levels; k++){
+        const size_t ch = layout.h[k-1], cw = layout.w[k-1];
+        const float *const child = args->hue_pyramid + layout.offset[k-1];
+        float *const level = args->hue_pyramid + layout.offset[k];
+        for(size_t j = 0; j < layout.h[k]; j++){
+            for(size_t i = 0; i < layout.w[k]; i++){
+                float sum[3] = {0.0f, 0.0f, 0.0f};
+                for(size_t y = j * 2; y < j * 2 + 2 && y < ch; y++){
+                    for(size_t x = i * 2; x < i * 2 + 2 && x < cw; x++){
+                        const float *const cell = child + (y * cw + x) * 3;
+                        sum[0] += cell[0];
+                        sum[1] += cell[1];
+                        sum[2] += cell[2];
+                    }
+                }
+                float *const cell = level + (j * layout.w[k] + i) * 3;
+                cell[0] = sum[0];
+                cell[1] = sum[1];
+                cell[2] = sum[2];
+            }
+        }
+    }
+}
+
+// 查询原图(x, y)处的填充色相。所有层都没有色相时返回NaN
+static float hue_pyramid_query(const float* pyramid, const pyramid_layout_t* layout, size_t x, size_t y){
+    for(size_t k = 0; k < layout->levels; k++){
+        const float scale = (float)((size_t)2 << k);
+        const size_t h = layout->h[k], w = layout->w[k];
+        const float *const level = pyramid + layout->offset[k];
+        // 当前像素中心在该层格子坐标系中的位置
+        const float fx = (x + 0.5f) / scale - 0.5f;
+        const float fy = (y + 0.5f) / scale - 0.5f;
+        const float x0f = floorf(fx), y0f = floorf(fy);
+        const float tx = fx - x0f, ty = fy - y0f;
+        const long x0 = (long)x0f, y0 = (long)y0f;
+        const size_t xs[2] = {x0 < 0 ? 0 : (size_t)x0, (size_t)(x0 + 1) >= w ? w - 1 : (size_t)(x0 + 1)};
+        const size_t ys[2] = {y0 < 0 ? 0 : (size_t)y0, (size_t)(y0 + 1) >= h ? h - 1 : (size_t)(y0 + 1)};
+        const float wx[2] = {1.0f - tx, tx};
+        const float wy[2] = {1.0f - ty, ty};
+        float n = 0.0f, c = 0.0f, s = 0.0f;
+        for(int b = 0; b < 2; b++){
+            for(int a = 0; a < 2; a++){
+                const float weight = wx[a] * wy[b];
+                const float *const cell = level + (ys[b] * w + xs[a]) * 3;
+                n += cell[0] * weight;
+                c += cell[1] * weight;
+                s += cell[2] * weight;
+            }
+        }
+        if(n > 0.0f){
+            if(c == 0.0f && s == 0.0f) return NAN; // 无法确定方向
+            return angle_normalize(atan2f(s, c) / (2.0f * M_PI));
+        }
+    }
+    return NAN;
+}
+
+// 主计算：处理[start, end)的像素。若启用缓存，h_buffer必须已经完成预计算
+static int hsv_process(args_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[3], size_t start, size_t end){
     const size_t width = in_shape[1];
     const size_t height = in_shape[0];
 
@@ -397,36 +607,61 @@ SHARED int f1(size_t threads, size_t idx, args_t* args, uint8_t* in_buf, uint8_t
     float thr = NAN;
     if(S_thr >= 0.0f) thr = S_thr;
 
-    if(use_tmp){
-        // 处理自身的像素点范围，并填充到`h_buffer`中。
-        for(size_t p = start * 4, i = start; /* p < end * 4, */i < end; p+=4, i++){
-            uint8_t r = in_buf[p], g = in_buf[p+1], b = in_buf[p+2], a = in_buf[p+3];
-            color_hsv_t hsv = rgb2hsv_withthr(r,g,b, thr);
-            if(ignore_npixels && a == 0) hsv.h = NAN;
-            h_buffer[i] = hsv.h;
-        }
-        // printf("sub atomic_add: %d\n", idx);
-        // 减原子变量
-        atomic_fetch_sub_explicit(args->h_buffer_sync, 1, memory_order_release);
-        // 等待所有线程完成
-        while(atomic_load_explicit(args->h_buffer_sync, memory_order_acquire) != 0){
-            // 忙等待
-            #ifdef __x86_64__
-                __builtin_ia32_pause();  // x86 PAUSE指令，降低功耗
-            #elif defined(__aarch64__)
-                __asm__ __volatile__("yield" ::: "memory");  // ARM YIELD
-            #endif
+    atomic_uint *const rgb_lut = args->rgb_lut;
+
+    // 不需要智能填充时结果只取决于RGB，使用向量化实现，剩余不足一个向量的像素由下面的循环处理。
+    // 向量化实现比查表更快，此时不使用查找表
+    if(hsv_adjust_func != NULL && !(smart_fillH && S_change > 0.0f)){
+        const hsv_adjust_t params = {
+            H_change, S_change, V_change, thr,
+            exception_process == EXCEPT_SET_H ? EXCEPT_SET_H_value : NAN
+        };
+        while(start < end){
+            if(img2arr_is_cancelled != NULL && img2arr_is_cancelled()){
+                return 0;
+            }
+            const size_t n = end - start < 65536 ? end - start : 65536;
+            const size_t done = hsv_adjust_func(in_buf + start * 4, out_buf + start * 4, n, &params);
+            start += done;
+            if(done < n) break;
         }
     }
 
+    // 金字塔算法。金字塔必须已经建立完成
+    const float *const hue_pyramid = args->hue_pyramid;
+    pyramid_layout_t layout;
+    if(smart_fillH && hue_pyramid != NULL) pyramid_layout(height, width, &layout);
+
     for(size_t p = start * 4, i = start; /* p < end * 4, */i < end; p+=4, i++){
+        // 智能填充可能很慢，每处理一批像素检查一次是否已被取消
+        if(unlikely((i & 255) == 0) && img2arr_is_cancelled != NULL && img2arr_is_cancelled()){
+            return 0;
+        }
         uint8_t r = in_buf[p], g = in_buf[p+1], b = in_buf[p+2], a = in_buf[p+3];
+        const uint32_t lut_key = r | (uint32_t)g << 8 | (uint32_t)b << 16;
+        if(rgb_lut != NULL){
+            // 查表。多个线程可能同时写入同一项，但写入的值相同，无需加锁
+            const uint32_t e = atomic_load_explicit(&rgb_lut[lut_key], memory_order_relaxed);
+            if(likely(e & RGB_LUT_VALID)){
+                out_buf[p]   = e;
+                out_buf[p+1] = e >> 8;
+                out_buf[p+2] = e >> 16;
+                out_buf[p+3] = a;
+                continue;
+            }
+        }
         color_hsv_t hsv;
 
         hsv = rgb2hsv_withthr(r,g,b, thr);
 
+        // 该像素是否需要智能填充。不需要时结果只取决于RGB，可以写入查找表
+        const bool smart = smart_fillH && S_change > 0.0f && isnan(hsv.h);
+        if(smart && hue_pyramid != NULL){
+            hsv.h = hue_pyramid_query(hue_pyramid, &layout, i % width, i / width);
+            // 若没有找到，则会自然的跳到备选方案
+        }
         // 运行智能扫描算法
-        if(smart_fillH && S_change > 0.0f && isnan(hsv.h)){
+        else if(smart){
 
             // 获取当前像素的坐标
             int x = i % width;
@@ -681,10 +916,119 @@ SHARED int f1(size_t threads, size_t idx, args_t* args, uint8_t* in_buf, uint8_t
         out_buf[p+1] = rgb.g;
         out_buf[p+2] = rgb.b;
         out_buf[p+3] = a;
+        if(rgb_lut != NULL && !smart){
+            // 需要智能填充的颜色不写入，每次都重新计算
+            const uint32_t e = RGB_LUT_VALID | rgb.r | (uint32_t)rgb.g << 8 | (uint32_t)rgb.b << 16;
+            atomic_store_explicit(&rgb_lut[lut_key], e, memory_order_relaxed);
+        }
     }
     return 0;
 }
 
+// 宿主未提供屏障时的后备方案。要求所有线程同时运行
+static void hsv_fallback_barrier(args_t* args, size_t threads){
+    if(threads <= 1) return;
+    // 计数只增不减，每凑齐threads个线程过一轮，同一份参数可以反复计算。初始值threads是threads的倍数
+    const size_t arrived = atomic_fetch_add_explicit(args->h_buffer_sync, 1, memory_order_acq_rel) + 1;
+    const size_t target = ((arrived - 1) / threads + 1) * threads;
+    while(atomic_load_explicit(args->h_buffer_sync, memory_order_acquire) < target){
+        // 忙等待
+        #ifdef __x86_64__
+            __builtin_ia32_pause();  // x86 PAUSE指令，降低功耗
+        #elif defined(__aarch64__)
+            __asm__ __volatile__("yield" ::: "memory");  // ARM YIELD
+        #endif
+    }
+}
+
+/**
+ * @brief 主函数：多线程实现。
+ * Multi-threaded implementation.
+ * @param threads[in] 任务数。
+ * Number of tasks.
+ * @param idx[in] 任务索引。
+ * Task index.
+ * @param args[in/out] 参数解析结构体。
+ * Parameter parsing structure.
+ * @param in_buf[in] 输入缓冲区，格式为`[*in_shape, 4]`。
+ * Input buffer, format is `[*in_shape, 4]`.
+ * @param out_buf[out] 输出缓冲区。大小由`io_GetOutInfo`指定。
+ * Output buffer. The size is specified by `io_GetOutInfo`.
+ * @param in_shape[in] 输入缓冲区形状。关于具体内容，参考下面的注释说明。
+ * Input buffer shape. For specific content, refer to the comment description below.
+ * @return 错误码，0表示成功，非0表示失败。若函数无返回，则可能返回随机值
+ * Error code, 0 means success, non-0 means failure. If the function has no return, it may return a random value.
+ */
+SHARED int f1(size_t threads, size_t idx, args_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[3]){
+    // 计算该线程处理的像素点范围。如果需要特殊需求，请自行修改。
+    // Calculate the pixel range processed by this thread. If you need special requirements, please modify it yourself.
+    const size_t size = in_shape[0] * in_shape[1];
+    const size_t start = (size * idx / threads);
+    const size_t end = (size * (idx + 1) / threads);
+
+    const bool use_pyramid = args->smart_fillH && args->hue_pyramid != NULL;
+    if(use_pyramid || (args->smart_fillH && args->h_buffer != NULL)){
+        if(use_pyramid){
+            // 金字塔逐层依赖，而屏障只用一次(等待时可能在同一线程中嵌套执行其他任务，连用两次会死锁)，由0号线程建立整个金字塔。
+            // 工作窃取调度下由f1r分阶段并行建立
+            if(idx == 0){
+                hue_pyramid_fill_base(args, in_buf, in_shape, 0, (in_shape[0] + 1) / 2);
+                hue_pyramid_fill_upper(args, in_shape);
+            }
+        }else{
+            // 处理自身的像素点范围，并填充到`h_buffer`中。
+            hsv_fill_h_buffer(args, in_buf, start, end);
+        }
+        // 等待所有线程完成
+        if(img2arr_barrier_wait != NULL){
+            img2arr_barrier_wait();
+        }else{
+            hsv_fallback_barrier(args, threads);
+        }
+    }
+    return hsv_process(args, in_buf, out_buf, in_shape, start, end);
+}
+
+// f1r的阶段数。阶段0预计算h_buffer或金字塔第1层，阶段1建立金字塔的其余层，阶段2为主计算。阶段之间由核心同步，不需要h_buffer_sync
+SHARED const size_t img2arr_f1r_phases = 3;
+
+/**
+ * @brief 主函数：区间实现，用于工作窃取调度。
+ * Range implementation, used by work-stealing scheduling.
+ * @param phase[in] 阶段。
+ * Phase.
+ * @param row_start[in] 起始行。
+ * First row.
+ * @param row_end[in] 结束行(不含)。
+ * Last row (exclusive).
+ * @return 错误码，0表示成功，非0表示失败。
+ * Error code, 0 means success, non-0 means failure.
+ * @note 智能填充的计算量随中性色像素的分布变化很大，静态划分时最慢的线程决定总耗时，因此切成小块动态分配。
+ * @note The cost of smart fill depends on where neutral pixels are, so rows are handed out dynamically instead of statically.
+ */
+SHARED int f1r(size_t phase, size_t row_start, size_t row_end, args_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[3]){
+    const size_t width = in_shape[1];
+    const size_t start = row_start * width;
+    const size_t end = row_end * width;
+    const bool use_pyramid = args->smart_fillH && args->hue_pyramid != NULL;
+    const bool use_tmp = args->smart_fillH && args->h_buffer != NULL && !use_pyramid;
+    switch(phase){
+        case 0:
+            // 第1层的第j行格子对应原图的第2j、2j+1行，由包含第2j行的块负责
+            if(use_pyramid) hue_pyramid_fill_base(args, in_buf, in_shape, (row_start + 1) / 2, (row_end + 1) / 2);
+            else if(use_tmp) hsv_fill_h_buffer(args, in_buf, start, end);
+            return 0;
+        case 1:
+            // 其余层只有原图的1/12，由第一个块完成
+            if(use_pyramid && row_start == 0) hue_pyramid_fill_upper(args, in_shape);
+            return 0;
+        case 2:
+            return hsv_process(args, in_buf, out_buf, in_shape, start, end);
+        default:
+            return -1;
+    }
+}
+
 /**
  * @brief 主函数：单线程实现。
  * Single-threaded implementation.
@@ -0,0 +1,20 @@
+#pragma once
+
+#include <stdint.h>
+#include <stddef.h>
+
+// 逐像素调整(不使用智能填充时)所需的参数
+typedef struct{
+    float H_change; // 色调偏移量
+    float S_change; // 饱和度偏移量
+    float V_change; // 明亮度偏移量，为整数
+    float thr; // 中性色判断阈值。NaN表示严格中性色
+    float set_h; // 中性色的H值。NaN表示不调整中性色的色相和饱和度
+}hsv_adjust_t;
+
+// 向量化的逐像素调整：处理in中的像素，写入out(可以与in相同)。只处理完整的向量块，返回已处理的像素数，剩余的由调用者处理。
+// 结果与main.c中的rgb2hsv、hsv2rgb逐位相同：浮点运算的种类和顺序保持一致，且不使用FMA
+typedef size_t (*hsv_adjust_func_t)(const uint8_t* in, uint8_t* out, size_t n, const hsv_adjust_t* params);
+
+size_t hsv_adjust_sse2(const uint8_t* in, uint8_t* out, size_t n, const hsv_adjust_t* params);
+size_t hsv_adjust_avx2(const uint8_t* in, uint8_t* out, size_t n, const hsv_adjust_t* params);
@@ -0,0 +1,100 @@
+#include <emmintrin.h> // SSE2+
+
+#include "main.h"
+
+// mask为全1的通道取a，否则取b
+static inline __m128i select_si128(__m128i mask, __m128i a, __m128i b){
+    return _mm_or_si128(_mm_and_si128(mask, a), _mm_andnot_si128(mask, b));
+}
+
+static inline __m128 select_ps(__m128 mask, __m128 a, __m128 b){
+    return _mm_or_ps(_mm_and_ps(mask, a), _mm_andnot_ps(mask, b));
+}
+
+// 向下取整，要求|x| < 2^31。SSE2没有roundps，截断后对负数修正
+static inline __m128i floor_epi32(__m128 x){
+    const __m128i t = _mm_cvttps_epi32(x);
+    // t > x时为-1
+    return _mm_add_epi32(t, _mm_castps_si128(_mm_cmpgt_ps(_mm_cvtepi32_ps(t), x)));
+}
+
+// 与angle_normalize相同：a - floorf(a)
+static inline __m128 angle_normalize_ps(__m128 a){
+    return _mm_sub_ps(a, _mm_cvtepi32_ps(floor_epi32(a)));
+}
+
+// 与roundf相同(四舍五入，远离0)，要求0 <= x < 2^23
+static inline __m128i round_epi32(__m128 x){
+    const __m128i t = _mm_cvttps_epi32(x);
+    const __m128 frac = _mm_sub_ps(x, _mm_cvtepi32_ps(t));
+    return _mm_sub_epi32(t, _mm_castps_si128(_mm_cmpge_ps(frac, _mm_set1_ps(0.5f))));
+}
+
+// 处理4个像素
+static inline __m128i hsv_adjust_4(__m128i px, const hsv_adjust_t* params){
+    const __m128i mask8 = _mm_set1_epi32(0xff);
+    const __m128 r = _mm_cvtepi32_ps(_mm_and_si128(px, mask8));
+    const __m128 g = _mm_cvtepi32_ps(_mm_and_si128(_mm_srli_epi32(px, 8), mask8));
+    const __m128 b = _mm_cvtepi32_ps(_mm_and_si128(_mm_srli_epi32(px, 16), mask8));
+    const __m128i alpha = _mm_andnot_si128(_mm_set1_epi32(0xffffff), px);
+
+    // rgb2hsv
+    const __m128 v = _mm_max_ps(_mm_max_ps(r, g), b);
+    const __m128 d = _mm_sub_ps(v, _mm_min_ps(_mm_min_ps(r, g), b));
+    const __m128 gray = _mm_cmpeq_ps(d, _mm_setzero_ps());
+    __m128 s = _mm_andnot_ps(gray, _mm_div_ps(d, v));
+    // 与u8_max3_with_flag相同，相等时取靠前的通道
+    const __m128 r_max = _mm_and_ps(_mm_cmpge_ps(r, g), _mm_cmpge_ps(r, b));
+    const __m128 g_max = _mm_cmpge_ps(g, b);
+    const __m128 h_r = _mm_div_ps(_mm_sub_ps(g, b), d);
+    const __m128 h_g = _mm_add_ps(_mm_set1_ps(2.0f), _mm_div_ps(_mm_sub_ps(b, r), d));
+    const __m128 h_b = _mm_add_ps(_mm_set1_ps(4.0f), _mm_div_ps(_mm_sub_ps(r, g), d));
+    __m128 h = select_ps(r_max, h_r, select_ps(g_max, h_g, h_b));
+    h = angle_normalize_ps(_mm_div_ps(h, _mm_set1_ps(6.0f)));
+    // 中性色：严格中性色，或饱和度低于阈值(阈值为NaN时比较结果恒为假)
+    const __m128 neutral = _mm_or_ps(gray, _mm_cmplt_ps(s, _mm_set1_ps(params->thr)));
+    h = select_ps(neutral, _mm_set1_ps(params->set_h), h);
+    // set_h为NaN时中性色不调整，输出(v, v, v)
+    const __m128 active = _mm_cmpeq_ps(h, h);
+
+    h = angle_normalize_ps(_mm_add_ps(h, _mm_set1_ps(params->H_change)));
+    s = _mm_min_ps(_mm_max_ps(_mm_add_ps(s, _mm_set1_ps(params->S_change)), _mm_setzero_ps()), _mm_set1_ps(1.0f));
+    const __m128 vf = _mm_min_ps(_mm_max_ps(_mm_add_ps(v, _mm_set1_ps(params->V_change)), _mm_setzero_ps()), _mm_set1_ps(255.0f));
+
+    // hsv2rgb
+    const __m128 one = _mm_set1_ps(1.0f);
+    const __m128 h6 = _mm_mul_ps(h, _mm_set1_ps(6.0f));
+    const __m128i i = floor_epi32(h6);
+    const __m128 f = _mm_sub_ps(h6, _mm_cvtepi32_ps(i));
+    const __m128i vi = _mm_cvttps_epi32(vf);
+    const __m128i p = round_epi32(_mm_mul_ps(vf, _mm_sub_ps(one, s)));
+    const __m128i q = round_epi32(_mm_mul_ps(vf, _mm_sub_ps(one, _mm_mul_ps(f, s))));
+    const __m128i t = round_epi32(_mm_mul_ps(vf, _mm_sub_ps(one, _mm_mul_ps(_mm_sub_ps(one, f), s))));
+    const __m128i i0 = _mm_or_si128(_mm_cmpeq_epi32(i, _mm_setzero_si128()), _mm_cmpeq_epi32(i, _mm_set1_epi32(6)));
+    const __m128i i1 = _mm_cmpeq_epi32(i, _mm_set1_epi32(1));
+    const __m128i i2 = _mm_cmpeq_epi32(i, _mm_set1_epi32(2));
+    const __m128i i3 = _mm_cmpeq_epi32(i, _mm_set1_epi32(3));
+    const __m128i i4 = _mm_cmpeq_epi32(i, _mm_set1_epi32(4));
+    const __m128i i5 = _mm_cmpeq_epi32(i, _mm_set1_epi32(5));
+    // 0: v t p, 1: q v p, 2: p v t, 3: p q v, 4: t p v, 5: v p q
+    __m128i ro = select_si128(_mm_or_si128(i0, i5), vi, select_si128(i1, q, select_si128(i4, t, p)));
+    __m128i go = select_si128(i0, t, select_si128(_mm_or_si128(i1, i2), vi, select_si128(i3, q, p)));
+    __m128i bo = select_si128(i2, t, select_si128(_mm_or_si128(i3, i4), vi, select_si128(i5, q, p)));
+    const __m128i act = _mm_castps_si128(active);
+    ro = select_si128(act, ro, vi);
+    go = select_si128(act, go, vi);
+    bo = select_si128(act, bo, vi);
+    return _mm_or_si128(_mm_or_si128(ro, _mm_slli_epi32(go, 8)), _mm_or_si128(_mm_slli_epi32(bo, 16), alpha));
+}
+
+size_t hsv_adjust_sse2(const uint8_t* in, uint8_t* out, size_t n, const hsv_adjust_t* params){
+    size_t i = 0;
+    // 每次处理8个像素
+    for(; i + 8 <= n; i += 8){
+        const __m128i a = _mm_loadu_si128((const __m128i*)(in + i * 4));
+        const __m128i b = _mm_loadu_si128((const __m128i*)(in + i * 4 + 16));
+        _mm_storeu_si128((__m128i*)(out + i * 4), hsv_adjust_4(a, params));
+        _mm_storeu_si128((__m128i*)(out + i * 4 + 16), hsv_adjust_4(b, params));
+    }
+    return i;
+}
@@ -0,0 +1,173 @@
+"""校验逐像素调整的向量化实现(SSE2/AVX2)与原始实现逐位相同。
+
+用法：先用compile.sh(或compile.ps1)编译扩展，然后
+    python verify.py [扩展库路径] [-n 随机参数组数] [--seed 种子]
+扩展库路径默认为本目录下当前平台的预编译库。全部一致时返回0，否则返回1。
+
+每组参数下，输入为全部2^24种RGB颜色，外加几个凑不满一个向量的像素，
+缓冲区起始地址故意不对齐。先在调用init()前计算一次作为参考(此时只有原始实现)，
+再依次检查init()选择的实现、SSE2、AVX2，每种实现都分别以独立输出与原地处理计算。
+只依赖标准库，不需要numpy或PySide6。
+"""
+import argparse
+import ctypes
+import os
+import platform
+import random
+import sys
+from ctypes import CDLL, POINTER, Structure, addressof, byref, c_bool, c_float, c_int, c_int16, c_size_t, c_uint, c_uint8, c_void_p
+
+EXCEPT_SET_H = 0
+EXCEPT_IGNORE_S_H = 1
+
+CUBE = 1 << 24
+TAIL = 7 # 不是8或16的倍数，尾部由原始实现处理
+N = CUBE + TAIL
+MISALIGN = 4 # 像素起始地址模32的余数，既不满足16字节也不满足32字节对齐
+
+IMPLS = [("SSE2", 1), ("AVX2", 2)]
+
+class args_t(Structure):
+    # 与main.c中的args_t相同
+    _fields_ = [
+        ("H_change", c_float),
+        ("S_change", c_float),
+        ("V_change", c_int16),
+        ("exception_process", c_int),
+        ("smart_fillH", c_bool),
+        ("EXCEPT_SET_H_value", c_float),
+        ("h_buffer", POINTER(c_float)),
+        ("h_buffer_sync", POINTER(c_size_t)),
+        ("pre_write_h", c_bool),
+        ("step", c_uint),
+        ("scan_8_ways", c_bool),
+        ("sample_times", c_size_t),
+        ("mad_k", c_float),
+        ("S_thr", c_float),
+        ("ignore_npixels", c_bool),
+        ("rgb_lut", c_void_p),
+        ("hue_pyramid", POINTER(c_float)),
+    ]
+    _pack_ = 1
+
+def default_library() -> str:
+    here = os.path.dirname(os.path.abspath(__file__))
+    if sys.platform == "win32":
+        return os.path.join(here, "main_windows_x86_64.dll")
+    return os.path.join(here, f"main_linux_{platform.machine()}.so")
+
+def make_input() -> bytearray:
+    """全部2^24种颜色，第i个像素的RGB为i的低、中、高字节。透明度只用于检查是否原样保留"""
+    buf = bytearray(N * 4)
+    cube = memoryview(buf)[:CUBE * 4]
+    cube[0::4] = bytes(range(256)) * (CUBE >> 8)
+    cube[1::4] = bytes(g for g in range(256) for _ in range(256)) * (CUBE >> 16)
+    cube[2::4] = bytes(b for b in range(256) for _ in range(1 << 16))
+    cube[3::4] = bytes(range(255, -1, -1)) * (CUBE >> 8)
+    rng = random.Random(0)
+    buf[CUBE * 4:] = bytes(rng.randrange(256) for _ in range(TAIL * 4))
+    return buf
+
+def make_params(n: int, seed: int) -> list[dict]:
+    """边界参数加上n组随机参数。smart_fillH只在S_change <= 0时开启，此时仍使用向量化实现"""
+    params = [
+        dict(H_change=0.0, S_change=0.0, V_change=0, exception_process=EXCEPT_IGNORE_S_H, EXCEPT_SET_H_value=0.0, S_thr=-1.0),
+        dict(H_change=0.5, S_change=1.0, V_change=255, exception_process=EXCEPT_SET_H, EXCEPT_SET_H_value=0.3, S_thr=-1.0),
+        dict(H_change=-0.5, S_change=-1.0, V_change=-255, exception_process=EXCEPT_SET_H, EXCEPT_SET_H_value=1.0, S_thr=0.03),
+        dict(H_change=1 / 3, S_change=0.25, V_change=-17, exception_process=EXCEPT_IGNORE_S_H, EXCEPT_SET_H_value=0.0, S_thr=0.5),
+        dict(H_change=-1 / 12, S_change=-0.5, V_change=40, exception_process=EXCEPT_SET_H, EXCEPT_SET_H_value=0.0, S_thr=0.0, smart_fillH=True),
+    ]
+    rng = random.Random(seed)
+    for _ in range(n):
+        S_change = rng.uniform(-1.0, 1.0)
+        params.append(dict(
+            H_change=rng.uniform(-0.5, 0.5),
+            S_change=S_change,
+            V_change=rng.randint(-255, 255),
+            exception_process=rng.choice((EXCEPT_SET_H, EXCEPT_IGNORE_S_H)),
+            EXCEPT_SET_H_value=rng.random(),
+            S_thr=rng.choice((-1.0, rng.uniform(0.0, 0.2))),
+            smart_fillH=S_change <= 0.0 and rng.random() < 0.5,
+        ))
+    return params
+
+class Buffer:
+    """像素起始地址模32余MISALIGN的缓冲区"""
+    def __init__(self, size: int):
+        self.raw = (c_uint8 * (size + 64))()
+        self.addr = addressof(self.raw) + (MISALIGN - addressof(self.raw)) % 32
+        self.size = size
+    def load(self, data: bytes | bytearray):
+        ctypes.memmove(self.addr, bytes(data), self.size)
+    def read(self) -> bytes:
+        return ctypes.string_at(self.addr, self.size)
+
+def run(ext: CDLL, arg: args_t, src: bytearray, inplace: bool) -> bytes:
+    in_shape = (c_size_t * 3)(1, N, 4)
+    in_buf = Buffer(N * 4)
+    in_buf.load(src)
+    out_buf = in_buf if inplace else Buffer(N * 4)
+    if ext.f0(byref(arg), in_buf.addr, out_buf.addr, in_shape) != 0:
+        raise RuntimeError("f0() failed")
+    return out_buf.read()
+
+def first_diff(src: bytearray, ref: bytes, out: bytes) -> str:
+    """第一个不一致的像素。只在出错时调用"""
+    for i in range(0, len(ref), 4):
+        if ref[i:i+4] != out[i:i+4]:
+            return f"像素{i // 4}: 输入{tuple(src[i:i+4])} 期望{tuple(ref[i:i+4])} 实际{tuple(out[i:i+4])}"
+    return ""
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="verify", description="校验HSV扩展的向量化实现与原始实现逐位相同")
+    parser.add_argument("library", nargs="?", default=default_library(), help="扩展库路径")
+    parser.add_argument("-n", "--sets", type=int, default=8, help="随机参数组数(另有5组固定的边界参数)")
+    parser.add_argument("--seed", type=int, default=1, help="随机参数的种子")
+    ns = parser.parse_args()
+
+    ext = CDLL(os.path.abspath(ns.library))
+    ext.f0.argtypes = [c_void_p, c_void_p, c_void_p, POINTER(c_size_t)]
+    ext.f0.restype = c_int
+    ext.init.restype = c_int
+    if hasattr(ext, "hsv_adjust_select"):
+        ext.hsv_adjust_select.argtypes = [c_int]
+        ext.hsv_adjust_select.restype = c_int
+
+    src = make_input()
+    params = make_params(ns.sets, ns.seed)
+    # 参考结果必须在init()之前计算，此时只有原始实现
+    refs = []
+    for i, p in enumerate(params):
+        refs.append(run(ext, args_t(**p), src, False))
+        print(f"[{i + 1}/{len(params)}] 原始实现: {p}")
+
+    impls = [("init()", None)] + IMPLS
+    ok = True
+    skipped = []
+    for name, level in impls:
+        if level is None:
+            if ext.init() != 0:
+                raise RuntimeError("init() failed")
+        elif not hasattr(ext, "hsv_adjust_select"):
+            # 无法单独校验各实现，视为失败
+            ok = False
+            print(f"无法校验{name}: 扩展没有hsv_adjust_select，请重新编译")
+            continue
+        elif ext.hsv_adjust_select(level) != 0:
+            skipped.append(f"{name}(CPU不支持)")
+            continue
+        for p, ref in zip(params, refs):
+            for inplace in (False, True):
+                out = run(ext, args_t(**p), src, inplace)
+                if out != ref:
+                    ok = False
+                    print(f"不一致: {name}{' 原地' if inplace else ''} {p}\n  {first_diff(src, ref, out)}")
+        print(f"{name}: 完成")
+
+    for s in skipped:
+        print(f"跳过: {s}")
+    print("全部一致" if ok else "存在不一致")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,7 @@
 import json
 import numpy as np
 from numpy.typing import NDArray
-from ctypes import CDLL, c_void_p, c_uint64, c_double, c_size_t, POINTER, addressof, _Pointer
+from ctypes import CDLL, c_void_p, c_uint64, c_double, c_size_t, POINTER, Structure, addressof, byref, sizeof, _Pointer
 import math
 import weakref
 
@@ -23,6 +23,20 @@ logger = logging.getLogger(__name__)
 
 from lib.ExtensionPyABC import abcExt
 
+def make_args(threads: int) -> "UI.args_t":
+    if threads < 1: # OpenCL
+        raise Exception("OpenCL不支持")
+    # 多线程时每个任务各写256个，最后由C端合并到前256个
+    n = 256 * threads
+    arg = UI.args_t((c_uint64 * n)(0), (c_uint64 * n)(0), (c_uint64 * n)(0), (c_uint64 * n)(0), (c_size_t * 1)(0))
+    arg._threads = threads
+    return arg
+
+def batch_update(save: dict | None, arr, threads: int, ext: CDLL):
+    """无界面批处理时生成参数。直方图不会被读取，但C端仍会写入，需要分配"""
+    arg = make_args(threads)
+    return (byref(arg), sizeof(arg))
+
 class HistChartSignal(QObject):
     """用于传递直方图数据的信号"""
     update = Signal(list, list, list, list, 
@@ -32,7 +46,6 @@ class UI(abcExt.UI):
     """主类"""
     def __init__(self):
         """初始化代码。用处不大"""
-        self.threads = 1
         self.r_arr: NDArray[np.float64] = np.array([])
         self.g_arr: NDArray[np.float64] = np.array([])
         self.b_arr: NDArray[np.float64] = np.array([])
@@ -41,6 +54,8 @@ class UI(abcExt.UI):
     def ui_init(self, widget: QWidget, ext: CDLL, save: dict | None):
         self_ref = weakref.ref(self)
         self.ext = ext
+        # 旧版本的扩展(如未重新编译的预编译库)不会合并各任务的结果，由update_end合并
+        self.native_merge = hasattr(ext, "hist_merged")
         # 创建布局
         layout = QVBoxLayout(widget)
         layout.setContentsMargins(10, 10, 10, 10)
@@ -225,70 +240,44 @@ class UI(abcExt.UI):
     
     item_type = type((c_uint64 * 256)(0))
 
+    class args_t(Structure):
+        # [pack]struct{
+        #     uint64_t [out]R[256]; // 直方图求和结果：R
+        #     uint64_t [out]G[256]; // 直方图求和结果：G
+        #     uint64_t [out]B[256]; // 直方图求和结果：B
+        #     uint64_t [out]A[256]; // 直方图求和结果：A
+        # }对于单线程
+        # [pack]struct{
+        #     uint64_t [out]R[256 * thread]; // 每个任务的直方图求和结果：R。计算完成后，前256个为所有任务的总和
+        #     uint64_t [out]G[256 * thread]; // 每个任务的直方图求和结果：G。计算完成后，前256个为所有任务的总和
+        #     uint64_t [out]B[256 * thread]; // 每个任务的直方图求和结果：B。计算完成后，前256个为所有任务的总和
+        #     uint64_t [out]A[256 * thread]; // 每个任务的直方图求和结果：A。计算完成后，前256个为所有任务的总和
+        #     (atomic_)size_t* done; // 已完成的任务数，由最后完成的任务合并结果。初始值应为0
+        # }对于多线程
+        _fields_ = [
+            ("R", POINTER(c_uint64)),
+            ("G", POINTER(c_uint64)),
+            ("B", POINTER(c_uint64)),
+            ("A", POINTER(c_uint64)),
+            ("done", POINTER(c_size_t)),
+        ]
+        _pack_ = 1
+
     def update(self, arr, threads):
-      # [pack]struct{
-      # [pack]struct{
-      #     uint64_t [out]R[256]; // 直方图求和结果：R
-      #     uint64_t [out]G[256]; // 直方图求和结果：G
-      #     uint64_t [out]B[256]; // 直方图求和结果：B
-      #     uint64_t [out]A[256]; // 直方图求和结果：A
-      # }对于单线程
-      # [pack]struct{
-      #     uint64_t [out]R[256 * thread]; // 每个任务的直方图求和结果：R
-      #     uint64_t [out]G[256 * thread]; // 每个任务的直方图求和结果：G
-      #     uint64_t [out]B[256 * thread]; // 每个任务的直方图求和结果：B
-      #     uint64_t [out]A[256 * thread]; // 每个任务的直方图求和结果：A
-      # }对于多线程
-        if threads > 1:# 多线程
-            r = (c_uint64 * (256 * threads))(0)
-            g = (c_uint64 * (256 * threads))(0)
-            b = (c_uint64 * (256 * threads))(0)
-            a = (c_uint64 * (256 * threads))(0)
-            arg = (POINTER(c_uint64) * 4)(r, g, b, a)
-                
-        elif threads == 1: # 单线程
-            r = (c_uint64 * 256)(0)
-            g = (c_uint64 * 256)(0)
-            b = (c_uint64 * 256)(0)
-            a = (c_uint64 * 256)(0)
-            arg = (POINTER(c_uint64) * 4)(r, g, b, a)
-
-        else:# OpenCL
-            raise Exception("OpenCL不支持")
-        
-        self.threads = threads
-
-        return (arg, 8 * 4 * threads)
+        arg = make_args(threads)
+        return (byref(arg), sizeof(arg))
 
     def update_end(self, arg, arglen):
-
-        if self.threads == 1:
-            # 单线程情况
-            r = np.frombuffer((c_uint64 * 256).from_address(addressof(arg[0].contents)), dtype=np.uint64)
-            g = np.frombuffer((c_uint64 * 256).from_address(addressof(arg[1].contents)), dtype=np.uint64)
-            b = np.frombuffer((c_uint64 * 256).from_address(addressof(arg[2].contents)), dtype=np.uint64)
-            a = np.frombuffer((c_uint64 * 256).from_address(addressof(arg[3].contents)), dtype=np.uint64)
-
-            r_result, g_result, b_result, a_result = r, g, b, a
-        else:
-            # 多线程情况
-            threads = self.threads
-            total_size = 256 * threads
-
-            r_flat = np.frombuffer((c_uint64 * total_size).from_address(addressof(arg[0].contents)), dtype=np.uint64, count=total_size)
-            g_flat = np.frombuffer((c_uint64 * total_size).from_address(addressof(arg[1].contents)), dtype=np.uint64, count=total_size)
-            b_flat = np.frombuffer((c_uint64 * total_size).from_address(addressof(arg[2].contents)), dtype=np.uint64, count=total_size)
-            a_flat = np.frombuffer((c_uint64 * total_size).from_address(addressof(arg[3].contents)), dtype=np.uint64, count=total_size)
-
-            r_2d = r_flat.reshape(threads, 256)
-            g_2d = g_flat.reshape(threads, 256)
-            b_2d = b_flat.reshape(threads, 256)
-            a_2d = a_flat.reshape(threads, 256)
-
-            r_result = np.sum(r_2d, axis=0, dtype=np.uint64)
-            g_result = np.sum(g_2d, axis=0, dtype=np.uint64)
-            b_result = np.sum(b_2d, axis=0, dtype=np.uint64)
-            a_result = np.sum(a_2d, axis=0, dtype=np.uint64)
+        arg = arg._obj # update返回的byref
+        # 单线程与多线程的结果都在前256个中。旧版本的扩展在多线程时只留下各任务的结果，需要在这里求和
+        n = 256 if self.native_merge else 256 * arg._threads
+        def result(p) -> NDArray[np.uint64]:
+            arr = np.frombuffer((c_uint64 * n).from_address(addressof(p.contents)), dtype=np.uint64)
+            return arr if n == 256 else arr.reshape(-1, 256).sum(axis=0)
+        r_result = result(arg.R)
+        g_result = result(arg.G)
+        b_result = result(arg.B)
+        a_result = result(arg.A)
 
         # 明确转换
         self.r_arr = np.array(r_result, dtype=np.float64)
@@ -19,6 +19,8 @@
 #endif
 
 SHARED const char img2arr_ext_sign[] = "img2arr.prep.img.Histogram";
+// f1会将各任务的结果合并到前256个中。旧版本没有该导出，需由ext.py合并
+SHARED const int hist_merged = 1;
 
 enum{
     ATTR_NONE = 0, // 不指定任何属性。会为该函数分配独立的输出缓冲区。
@@ -41,34 +43,65 @@ typedef struct{
 }__attribute__((packed)) args_f0_t;
 
 typedef struct{
-    uint64_t *R; // 每个任务的直方图求和结果：R， 256为一间隔
-    uint64_t *G; // 每个任务的直方图求和结果：G， 256为一间隔
-    uint64_t *B; // 每个任务的直方图求和结果：B， 256为一间隔
-    uint64_t *A; // 每个任务的直方图求和结果：A， 256为一间隔
+    uint64_t *R; // 每个任务的直方图求和结果：R， 256为一间隔。计算完成后，前256个为所有任务的总和
+    uint64_t *G; // 每个任务的直方图求和结果：G， 256为一间隔。计算完成后，前256个为所有任务的总和
+    uint64_t *B; // 每个任务的直方图求和结果：B， 256为一间隔。计算完成后，前256个为所有任务的总和
+    uint64_t *A; // 每个任务的直方图求和结果：A， 256为一间隔。计算完成后，前256个为所有任务的总和
+    atomic_size_t *done; // 已完成的任务数，由最后完成的任务合并结果。初始值应为0
 }__attribute__((packed)) args_f1_t;
 
+/*
+统计n个像素的直方图，累加到R、G、B、A中。
+大片相同的颜色会反复自增同一个计数器，每次自增都要等上一次的写入完成(存储转发)，无法并行。
+这里相邻的4个像素轮流使用4组子直方图，使它们的自增互不依赖，最后再合并。
+子直方图为32位以减少缓存占用(4通道×4组×256×4字节=16KB)，每批的像素数不超过UINT32_MAX以免溢出。
+*/
+static void hist_count(const uint8_t* in_buf, size_t n, uint64_t R[256], uint64_t G[256], uint64_t B[256], uint64_t A[256]){
+    uint32_t sub[4][4][256]; // [通道][子直方图][值]
+    while(n > 0){
+        const size_t batch = n < UINT32_MAX ? n : UINT32_MAX;
+        memset(sub, 0, sizeof(sub));
+        size_t i = 0;
+        for(; i + 4 <= batch; i += 4){
+            const uint8_t* p = in_buf + i * 4;
+            for(int k = 0; k < 4; k++, p += 4){
+                // 透明像素不计入RGB
+                if(likely(p[3])){
+                    sub[0][k][p[0]]++;
+                    sub[1][k][p[1]]++;
+                    sub[2][k][p[2]]++;
+                }
+                sub[3][k][p[3]]++;
+            }
+        }
+        for(; i < batch; i++){
+            const uint8_t* p = in_buf + i * 4;
+            if(likely(p[3])){
+                sub[0][0][p[0]]++;
+                sub[1][0][p[1]]++;
+                sub[2][0][p[2]]++;
+            }
+            sub[3][0][p[3]]++;
+        }
+        for(int v = 0; v < 256; v++){
+            R[v] += (uint64_t)sub[0][0][v] + sub[0][1][v] + sub[0][2][v] + sub[0][3][v];
+            G[v] += (uint64_t)sub[1][0][v] + sub[1][1][v] + sub[1][2][v] + sub[1][3][v];
+            B[v] += (uint64_t)sub[2][0][v] + sub[2][1][v] + sub[2][2][v] + sub[2][3][v];
+            A[v] += (uint64_t)sub[3][0][v] + sub[3][1][v] + sub[3][2][v] + sub[3][3][v];
+        }
+        in_buf += batch * 4;
+        n -= batch;
+    }
+}
+
 SHARED int f0(args_f0_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[2]){
     size_t size = in_shape[0] * in_shape[1];
     uint64_t R[256] = {0}, 
              G[256] = {0}, 
              B[256] = {0}, 
              A[256] = {0};
-    for(size_t i = 0; i < size * 4; i += 4){
-        uint8_t a = in_buf[i + 3];
-        if(likely(a)){
-            R[in_buf[i + 0]]++;
-            G[in_buf[i + 1]]++;
-            B[in_buf[i + 2]]++;
-        }
-        A[a]++;
-    }
+    hist_count(in_buf, size, R, G, B, A);
     // 复制到args
-    // for(size_t i = 0; i < 256; i++){
-    //     args->R[i] = R[i];
-    //     args->G[i] = G[i];
-    //     args->B[i] = B[i];
-    //     args->A[i] = A[i];
-    // }
     memcpy(args->R, R, sizeof(R));
     memcpy(args->G, G, sizeof(G));
     memcpy(args->B, B, sizeof(B));
@@ -80,31 +113,27 @@ SHARED int f0(args_f0_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shap
 
 SHARED int f1(size_t threads, size_t idx, args_f1_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[2]){
     size_t size = in_shape[0] * in_shape[1];
-    size_t start_i = (size * idx / threads) * 4;
-    size_t end_i = (size * (idx + 1) / threads) * 4;
+    size_t start = size * idx / threads;
+    size_t end = size * (idx + 1) / threads;
     uint64_t R[256] = {0}, 
              G[256] = {0}, 
              B[256] = {0}, 
              A[256] = {0};
-    for(size_t i = start_i; i < end_i; i += 4){
-        uint8_t a = in_buf[i + 3];
-        if(likely(a)){
-            R[in_buf[i + 0]]++;
-            G[in_buf[i + 1]]++;
-            B[in_buf[i + 2]]++;
-        }
-        A[a]++;
-    }
-    // 复制到args
-    // for(size_t i = 0; i < 256; i++){
-    //     args->R[256 * idx + i] = R[i];
-    //     args->G[256 * idx + i] = G[i];
-    //     args->B[256 * idx + i] = B[i];
-    //     args->A[256 * idx + i] = A[i];
-    // }
+    hist_count(in_buf + start * 4, end - start, R, G, B, A);
     memcpy(args->R + 256 * idx, R, sizeof(R));
     memcpy(args->G + 256 * idx, G, sizeof(G));
     memcpy(args->B + 256 * idx, B, sizeof(B));
     memcpy(args->A + 256 * idx, A, sizeof(A));
+    // 最后完成的任务把其余任务的结果合并到前256个中。计数对threads取模，参数被重复使用时也能正确合并
+    if((atomic_fetch_add_explicit(args->done, 1, memory_order_acq_rel) + 1) % threads == 0){
+        for(size_t t = 1; t < threads; t++){
+            for(size_t v = 0; v < 256; v++){
+                args->R[v] += args->R[256 * t + v];
+                args->G[v] += args->G[256 * t + v];
+                args->B[v] += args->B[256 * t + v];
+                args->A[v] += args->A[256 * t + v];
+            }
+        }
+    }
     return 0;
-}
\ No newline at end of file
+}
@@ -0,0 +1,64 @@
+#include <immintrin.h> // AVX2
+
+#include "main.h"
+
+void hpass_fixed_avx2(const uint8_t* row, int16_t* dst, size_t out_w, int taps, const int32_t* sample_x, const int16_t* wx){
+    const __m256i round = _mm256_set1_epi32(1 << (WEIGHT_BITS - INTER_BITS - 1));
+    size_t x = 0;
+    // AVX2 主循环：每次处理 2 个输出像素，低128位为第一个像素，高128位为第二个像素
+    for(; x + 2 <= out_w; x += 2){
+        const int32_t* sx0 = sample_x + x * taps;
+        const int32_t* sx1 = sx0 + taps;
+        const int16_t* w0 = wx + x * taps;
+        const int16_t* w1 = w0 + taps;
+        __m256i acc = round;
+        for(int di = 0; di < taps; di += 2){
+            // 两个采样点交错成[a0 b0 a1 b1 a2 b2 a3 b3]，两个输出像素各占8字节
+            __m128i p0 = _mm_unpacklo_epi8(_mm_cvtsi32_si128(load_pixel(row + (size_t)sx0[di] * 4)),
+                                           _mm_cvtsi32_si128(load_pixel(row + (size_t)sx0[di + 1] * 4)));
+            __m128i p1 = _mm_unpacklo_epi8(_mm_cvtsi32_si128(load_pixel(row + (size_t)sx1[di] * 4)),
+                                           _mm_cvtsi32_si128(load_pixel(row + (size_t)sx1[di + 1] * 4)));
+            __m256i ab = _mm256_cvtepu8_epi16(_mm_unpacklo_epi64(p0, p1));
+            __m256i w = _mm256_inserti128_si256(_mm256_castsi128_si256(_mm_set1_epi32(weight_pair(w0 + di))),
+                                                _mm_set1_epi32(weight_pair(w1 + di)), 1);
+            acc = _mm256_add_epi32(acc, _mm256_madd_epi16(ab, w));
+        }
+        acc = _mm256_srai_epi32(acc, WEIGHT_BITS - INTER_BITS);
+        __m256i r = _mm256_packs_epi32(acc, acc);
+        _mm_storel_epi64((__m128i*)(dst + x * 4), _mm256_castsi256_si128(r));
+        _mm_storel_epi64((__m128i*)(dst + x * 4 + 4), _mm256_extracti128_si256(r, 1));
+    }
+    // 处理剩余部分
+    for(; x < out_w; x++){
+        hpass_fixed_pixel(row, dst + x * 4, taps, sample_x + x * taps, wx + x * taps);
+    }
+}
+
+void vpass_fixed_avx2(const int16_t* const* rows, const int16_t* wy, int taps, uint8_t* out_row, size_t n){
+    const __m256i round = _mm256_set1_epi32(1 << (WEIGHT_BITS + INTER_BITS - 1));
+    size_t i = 0;
+    // AVX2 主循环：每次处理 16 个通道值
+    for(; i + 16 <= n; i += 16){
+        __m256i acc_lo = round;
+        __m256i acc_hi = round;
+        for(int di = 0; di < taps; di += 2){
+            __m256i a = _mm256_loadu_si256((const __m256i*)(rows[di] + i));
+            __m256i b = _mm256_loadu_si256((const __m256i*)(rows[di + 1] + i));
+            __m256i w = _mm256_set1_epi32(weight_pair(wy + di));
+            acc_lo = _mm256_add_epi32(acc_lo, _mm256_madd_epi16(_mm256_unpacklo_epi16(a, b), w));
+            acc_hi = _mm256_add_epi32(acc_hi, _mm256_madd_epi16(_mm256_unpackhi_epi16(a, b), w));
+        }
+        acc_lo = _mm256_srai_epi32(acc_lo, WEIGHT_BITS + INTER_BITS);
+        acc_hi = _mm256_srai_epi32(acc_hi, WEIGHT_BITS + INTER_BITS);
+        // unpack与pack都在128位内进行，packs后顺序恢复为[0..7 | 8..15]
+        __m256i r16 = _mm256_packs_epi32(acc_lo, acc_hi);
+        __m256i r8 = _mm256_packus_epi16(r16, r16);
+        // 取每个128位的低8字节
+        r8 = _mm256_permute4x64_epi64(r8, 0x08);
+        _mm_storeu_si128((__m128i*)(out_row + i), _mm256_castsi256_si128(r8));
+    }
+    // 处理剩余部分
+    for(; i < n; i++){
+        out_row[i] = vpass_fixed_value(rows, wy, taps, i);
+    }
+}
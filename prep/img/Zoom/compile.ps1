@@ -0,0 +1,18 @@
+﻿# 第一个传入参数是输出文件名
+$OutputFileName = $args[0]
+
+# AVX2 编译
+Write-Host "编译 AVX2 模块..." -ForegroundColor Green
+gcc avx2.c -fPIC -c -o avx2.obj "-mavx2" -O3
+if ($LASTEXITCODE -ne 0) { exit $LASTEXITCODE }
+
+# SSE2 编译
+Write-Host "编译 SSE2 模块..." -ForegroundColor Green
+gcc sse2.c -fPIC -c -o sse2.obj "-msse2" -O3
+if ($LASTEXITCODE -ne 0) { exit $LASTEXITCODE }
+
+Write-Host "链接主程序..." -ForegroundColor Green
+gcc main.c avx2.obj sse2.obj -shared -fPIC -O3 -o $OutputFileName -static
+if ($LASTEXITCODE -ne 0) { exit $LASTEXITCODE }
+
+Write-Host "编译完成: $OutputFileName" -ForegroundColor Green
\ No newline at end of file
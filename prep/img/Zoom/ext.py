@@ -1,7 +1,7 @@
 import json
 from numpy import uint8, nan
 from numpy.typing import NDArray
-from ctypes import CDLL, c_float, c_bool, c_int, c_size_t, Structure, sizeof, byref, POINTER
+from ctypes import CDLL, c_float, c_bool, c_int, c_size_t, c_void_p, Structure, sizeof, byref, POINTER
 import struct
 import time
 import weakref
@@ -15,15 +15,101 @@ from PySide6.QtGui import QPalette, QColor, QFontMetrics
 
 from lib.ExtensionPyABC import abcExt
 
+def bind(ext: CDLL):
+    """设置用到的导出函数的argtypes"""
+    # SHARED atomic_size_t* atomic_init_size_t(atomic_size_t* p, size_t v)
+    ext.atomic_init_size_t.argtypes = [POINTER(c_size_t), c_size_t]
+    ext.atomic_init_size_t.restype = POINTER(c_size_t)
+    if hasattr(ext, "weight_lut_fill"):
+        # SHARED int weight_lut_fill(args_t* args, size_t in_shape[2])
+        ext.weight_lut_fill.argtypes = [c_void_p, POINTER(c_size_t)]
+        ext.weight_lut_fill.restype = c_int
+
+# 各设置的默认值，与界面控件的初始值相同。键与`UI.ui_save()`相同
+DEFAULTS = {
+    "out_w": 1920,
+    "out_h": 1080,
+    "method": 2, # 双三次插值
+    "core_radius": 3,
+    "lut_optimize": True,
+}
+
+def make_args(ext: CDLL, save: dict | None, arr, threads: int, lut_cache: tuple | None) -> tuple["UI.args_t", tuple | None]:
+    """由设置生成参数。lut_cache为已填充的LUT：(键, lut_x_buffer, lut_y_buffer)，键不变时直接复用，不必重新计算权重。
+    返回(参数, 本次的lut_cache)"""
+    save = {**DEFAULTS, **(save or {})}
+    # arr shape: (H, W, C)
+    method_idx = save["method"]
+    if method_idx in (0, 1, 4):
+        core_left = core_right = core_top = core_bottom = 0
+    elif method_idx == 2:
+        core_left = core_top = -2
+        core_right = core_bottom = 2
+    else:
+        core_left = core_top = -save["core_radius"]
+        core_right = core_bottom = save["core_radius"]
+    # normalize
+    # core_left += 1
+    # core_top += 1
+    out_w = save["out_w"]
+    out_h = save["out_h"]
+    lut_optimize = save["lut_optimize"]
+    # 初始化原子变量
+    atm = POINTER(c_size_t)(c_size_t(0))
+    ext.atomic_init_size_t(atm, threads)
+
+    # 不能直接lut_x_buffer lut_y_buffer！不然这些最终会因局部变量会被销毁。
+    lut_key = (arr.shape[0], arr.shape[1], out_w, out_h, method_idx, core_left, core_right, core_top, core_bottom)
+    lut_ready = False
+    if not lut_optimize:
+        lut_x_buffer = None
+        lut_y_buffer = None
+    elif lut_cache is not None and lut_cache[0] == lut_key:
+        # 缩放参数未变，LUT内容仍然有效。计算时只读，可被多次计算共用
+        _, lut_x_buffer, lut_y_buffer = lut_cache
+        lut_ready = True
+    else:
+        lut_x_buffer = (c_float * (out_w * (core_right - core_left + 1)))(nan)
+        lut_y_buffer = (c_float * (out_h * (core_bottom - core_top + 1)))(nan)
+    args = UI.args_t(
+        out_w / arr.shape[1],
+        out_h / arr.shape[0],
+        method_idx,
+        core_left, core_right, core_top, core_bottom,
+        lut_optimize,
+        lut_x_buffer,
+        lut_y_buffer,
+        atm,
+        lut_ready
+    )
+    if lut_optimize and not lut_ready and hasattr(ext, "weight_lut_fill"):
+        # 缩放参数变化，在这里一次性填充LUT，之后的计算跳过权重计算与线程同步。
+        # 旧版本的扩展没有weight_lut_fill，LUT每次都由计算线程填充
+        in_shape = (c_size_t * 2)(arr.shape[0], arr.shape[1])
+        if ext.weight_lut_fill(byref(args), in_shape) == 0:
+            args.lut_ready = True
+            lut_cache = (lut_key, lut_x_buffer, lut_y_buffer)
+    return args, lut_cache
+
+_batch_lut_cache: tuple | None = None
+"""批处理时各图片共用的LUT。尺寸相同的图片不必重新计算权重"""
+
+def batch_update(save: dict | None, arr, threads: int, ext: CDLL):
+    """无界面批处理时生成参数。save为`UI.ui_save()`的返回值"""
+    global _batch_lut_cache
+    bind(ext)
+    args, _batch_lut_cache = make_args(ext, save, arr, threads, _batch_lut_cache)
+    return (byref(args), sizeof(args))
+
 class UI(abcExt.UI):
     def __init__(self):
         pass
     def ui_init(self, widget: QWidget, ext: CDLL, save: dict | None):
         self_ref = weakref.ref(self)
         self.ext = ext
-        # SHARED atomic_size_t* atomic_init_size_t(atomic_size_t* p, size_t v)
-        self.ext.atomic_init_size_t.argtypes = [POINTER(c_size_t), c_size_t]
-        self.ext.atomic_init_size_t.restype = POINTER(c_size_t)
+        bind(ext)
+        # 已填充的LUT：(键, lut_x_buffer, lut_y_buffer)。键不变时直接复用，不必重新计算权重
+        self.lut_cache = None
         # 创建布局
         layout = QVBoxLayout(widget)
         layout.setContentsMargins(10, 10, 10, 10)
@@ -76,7 +162,8 @@ class UI(abcExt.UI):
             "最近邻插值",
             "双线性插值",
             "双三次插值(4×4核)",
-            "Lanczos插值"
+            "Lanczos插值",
+            "区域平均(适合大比例缩小)"
         ]
         self.method.addItems(self.method_list)
         self.method.setCurrentIndex(2) # 默认双三次插值
@@ -113,7 +200,7 @@ class UI(abcExt.UI):
     
     # 更新
     def Update(self, notify=True):
-        has_core = self.method.currentIndex() not in (0, 1, 2)
+        has_core = self.method.currentIndex() == 3
         self.core_widget.setVisible(has_core)
         if notify: self.img2arr_notify_update()
     
@@ -126,6 +213,7 @@ class UI(abcExt.UI):
         #         BILINEAR = 1, // 双线性插值
         #         BICUBIC = 2, // 双三次插值
         #         LANCZOS = 3, // Lanczos插值
+        #         AREA = 4, // 区域平均，适合大比例缩小
         #     }method;
         #     int core_left; // 卷积核左边界，通常是负数。仅对于使用自定义卷积缩放的算法有效。
         #     int core_right; // 卷积核右边界，通常是正数。仅对于使用自定义卷积缩放的算法有效。
@@ -135,6 +223,7 @@ class UI(abcExt.UI):
         #     float *lut_x_buffer; // x轴LUT内存。其大小为：图像宽*(右卷积核索引 - 左卷积核索引 + 1)。
         #     float *lut_y_buffer; // y轴LUT内存。其大小为：图像高*(上卷积核索引 - 下卷积核索引 + 1)。
         #     (atomic_)size_t* thread_lock; // 线程锁。
+        #     bool lut_ready; // LUT是否已由weight_lut_fill填充。为true时跳过LUT填充与线程同步。
         # }
         _fields_ = [
             ("sx", c_float),
@@ -147,46 +236,14 @@ class UI(abcExt.UI):
             ("lut_optimize", c_bool),
             ("lut_x_buffer", POINTER(c_float)),
             ("lut_y_buffer", POINTER(c_float)),
-            ("thread_lock", POINTER(c_size_t))
+            ("thread_lock", POINTER(c_size_t)),
+            ("lut_ready", c_bool)
         ]
         _pack_ = 1
     def update(self, arr, threads):
-        # arr shape: (H, W, C)
-        method_idx = self.method.currentIndex()
-        if method_idx in (0, 1):
-            core_left = core_right = core_top = core_bottom = 0
-        elif method_idx == 2:
-            core_left = core_top = -2
-            core_right = core_bottom = 2
-        else:
-            core_left = core_top = -self.core_radius.value()
-            core_right = core_bottom = self.core_radius.value()
-        # normalize
-        # core_left += 1
-        # core_top += 1
-        out_w = self.spin_outx.value()
-        out_h = self.spin_outy.value()
-        # 初始化原子变量
-        atm = POINTER(c_size_t)(c_size_t(0))
-        self.ext.atomic_init_size_t(atm, threads)
-
-        # 不能直接lut_x_buffer lut_y_buffer！不然这些最终会因局部变量会被销毁。
-        if self.lut_optimize.isChecked():
-            lut_x_buffer = (c_float * (out_w * (core_right - core_left + 1)))(nan)
-            lut_y_buffer = (c_float * (out_h * (core_bottom - core_top + 1)))(nan)
-        else:
-            lut_x_buffer = None
-            lut_y_buffer = None
-        args = self.args_t(
-            out_w / arr.shape[1],
-            out_h / arr.shape[0],
-            method_idx,
-            core_left, core_right, core_top, core_bottom,
-            self.lut_optimize.isChecked(),
-            lut_x_buffer,
-            lut_y_buffer,
-            atm
-        )
+        save = self.ui_save()
+        args, self.lut_cache = make_args(self.ext, save, arr, threads, self.lut_cache)
+        out_w, out_h, method_idx = save["out_w"], save["out_h"], save["method"]
 
         # 刷新提示文本
         self.img2arr_UpdateTiptext(
@@ -201,4 +258,10 @@ class UI(abcExt.UI):
     def __del__(self):
         print("缩放 被__del__")
     def ui_save(self):
-        pass
+        return {
+            "out_w": self.spin_outx.value(),
+            "out_h": self.spin_outy.value(),
+            "method": self.method.currentIndex(),
+            "core_radius": self.core_radius.value(),
+            "lut_optimize": self.lut_optimize.isChecked(),
+        }
@@ -6,6 +6,8 @@
 #include <math.h>
 #include <float.h>
 
+#include "main.h"
+
 #if defined(_WIN32) || defined(_WIN64)
 #define SHARED __declspec(dllexport)
 #else
@@ -45,11 +47,15 @@ enum{
         BILINEAR = 1, // 双线性插值
         BICUBIC = 2, // 双三次插值
         LANCZOS = 3, // Lanczos插值
+        AREA = 4, // 区域平均
     };
     bool lut_optimize; // 是否启用LUT优化。这能够大幅提升性能，但需要一丢丢内存。
 }
 */
 
+// 屏障，加载时由img2arr设置。本次计算的所有任务都调用后才返回，等待期间不占用CPU
+SHARED void (*img2arr_barrier_wait)(void) = NULL;
+
 SHARED atomic_size_t* atomic_init_size_t(atomic_size_t* p, size_t v){
     atomic_init(p, v);
     return p;
@@ -60,6 +66,7 @@ typedef enum {
     SCALE_BILINEAR = 1,
     SCALE_BICUBIC = 2,
     SCALE_LANCZOS = 3,
+    SCALE_AREA = 4,
 }scale_mode;
 
 typedef struct {
@@ -72,7 +79,8 @@ typedef struct {
     bool lut_optimize;
     float *lut_x_buffer;
     float *lut_y_buffer;
-    atomic_size_t* thread_lock;
+    atomic_size_t* thread_lock; // 仅在img2arr_barrier_wait不可用时使用
+    bool lut_ready; // LUT已由weight_lut_fill填充，计算时跳过填充与屏障
 }__attribute__((packed)) args_t;
 
 #define round5(x) ((x) + 0.5f)
@@ -85,6 +93,29 @@ SHARED int io_GetOutInfo(args_t* args, size_t in_shape[2], size_t out_shape[2],
     return 0;
 }
 
+// 输入中[in_start, in_end)变化时，输出中受影响的范围。r为卷积核半径
+static void out_range(size_t in_start, size_t in_end, size_t in_len, float scale, int r, size_t *out_start, size_t *out_end){
+    const size_t out_len = round5(in_len * scale);
+    // 输出坐标y采样floor(y/scale)附近[-r, r]的像素，多留一个像素抵消浮点误差
+    float lo = ((float)in_start - r - 1) * scale;
+    float hi = ((float)in_end + r + 1) * scale + 1;
+    // 超出边界的采样会被限制到边缘像素
+    *out_start = (in_start == 0 || lo <= 0) ? 0 : (size_t)lo;
+    *out_end = (in_end >= in_len || hi >= out_len) ? out_len : (size_t)hi;
+}
+
+// 输入中的区域[y0, x0, y1, x1)变化时，输出中受影响的区域
+SHARED int io_GetOutRegion(args_t* args, size_t in_shape[2], size_t in_region[4], size_t out_region[4]){
+    int r = 1; // 最近邻与双线性
+    if(args->mode == SCALE_BICUBIC || args->mode == SCALE_LANCZOS){
+        r = max(max(-args->core_left, args->core_right), max(-args->core_top, args->core_bottom));
+        r = max(r, 1);
+    }
+    out_range(in_region[0], in_region[2], in_shape[0], args->sy, r, &out_region[0], &out_region[2]);
+    out_range(in_region[1], in_region[3], in_shape[1], args->sx, r, &out_region[1], &out_region[3]);
+    return 0;
+}
+
 int main_nearest(float scale_x, float scale_y, 
                        size_t in_w, size_t in_h, 
                        size_t out_w, size_t out_h, 
@@ -112,55 +143,6 @@ int main_nearest(float scale_x, float scale_y,
     return 0;
 }
 
-int main_bilinear(float scale_x, float scale_y,
-                       size_t in_w, size_t in_h, 
-                       size_t out_w, size_t out_h, 
-                       uint8_t* in_buf, uint8_t* out_buf, 
-                       size_t start_p, size_t end_p) {
-    for(size_t p = start_p; p < end_p; p++) {
-        size_t x = p % out_w;
-        size_t y = p / out_w;
-
-        // 计算源坐标（浮点数）
-        float src_x = x / scale_x;
-        float src_y = y / scale_y;
-        
-        // 获取四个相邻像素的坐标
-        int x0 = (int)floorf(src_x);
-        int y0 = (int)floorf(src_y);
-        int x1 = x0 + 1;
-        int y1 = y0 + 1;
-        
-        // 边界检查
-        x0 = clip(x0, 0, in_w - 1);
-        y0 = clip(y0, 0, in_h - 1);
-        x1 = clip(x1, 0, in_w - 1);
-        y1 = clip(y1, 0, in_h - 1);
-        
-        // 计算权重
-        float dx = src_x - x0;
-        float dy = src_y - y0;
-        float w00 = (1 - dx) * (1 - dy);
-        float w01 = (1 - dx) * dy;
-        float w10 = dx * (1 - dy);
-        float w11 = dx * dy;
-        
-        // 对每个通道进行双线性插值
-        for(int c = 0; c < 4; c++) {
-            // 获取四个相邻像素的值
-            uint8_t p00 = in_buf[(y0 * in_w + x0) * 4 + c];
-            uint8_t p01 = in_buf[(y1 * in_w + x0) * 4 + c];
-            uint8_t p10 = in_buf[(y0 * in_w + x1) * 4 + c];
-            uint8_t p11 = in_buf[(y1 * in_w + x1) * 4 + c];
-            
-            // 计算平均值并四舍五入
-            float result = w00 * p00 + w01 * p01 + w10 * p10 + w11 * p11;
-            out_buf[p * 4 + c] = round5(result);
-        }
-    }
-    return 0;
-}
-
 typedef float (*weight_func)(float dis, int left, int right);
 
 static inline float cubic_weight(float dis, int left, int right) {
@@ -205,194 +187,302 @@ static inline float lanczos_weight(float dis, int left, int right) {
     }
 }
 
-// 自定义卷积核以及范围的卷积缩放。无LUT优化。
-int main_generic_custom_scale_nolut(args_t *args, float scale_x, float scale_y,
+// 计算输出坐标o在某一方向上的采样基准坐标，以及[lo, hi]范围内每个采样点的权重
+static inline int coord_weights(float* w, size_t o, float scale, int lo, int hi, weight_func core){
+    // 计算浮点源坐标
+    float src_float = o / scale;
+    // 获取基准整数坐标
+    int base = floorf(src_float);
+    // 计算相对于基准坐标的小数偏移量
+    float frac = src_float - base;
+    for(int d = lo, di = 0; d <= hi; d++, di++){
+        // 相对于核中心的一维距离
+        w[di] = core(d - frac, lo, hi);
+    }
+    return base;
+}
+
+// 水平方向：把一行输入缩放到out_w宽，结果为未归一化的浮点加权和
+static void hpass_row(const uint8_t* row, float* dst, size_t out_w, int core_width, const int* sample_x, const float* wx){
+    for(size_t x = 0; x < out_w; x++){
+        const int* sx = sample_x + x * core_width;
+        const float* w = wx + x * core_width;
+        float s0 = 0.0f, s1 = 0.0f, s2 = 0.0f, s3 = 0.0f;
+        for(int di = 0; di < core_width; di++){
+            const uint8_t* p = row + (size_t)sx[di] * 4;
+            s0 += w[di] * p[0];
+            s1 += w[di] * p[1];
+            s2 += w[di] * p[2];
+            s3 += w[di] * p[3];
+        }
+        dst[x * 4 + 0] = s0;
+        dst[x * 4 + 1] = s1;
+        dst[x * 4 + 2] = s2;
+        dst[x * 4 + 3] = s3;
+    }
+}
+
+// 可分离的卷积缩放，计算输出的[y0, y1)行。
+// 先在水平方向把需要的输入行缩放为中间行，再在垂直方向合成输出行，每像素的计算量从kw*kh降为kw+kh。
+// 中间行存放在kh行的环形缓冲区中，相邻输出行共用的输入行只计算一次。
+// lut_x、lut_y为预计算的权重，为NULL时自行计算
+static int separable_rows(float scale_x, float scale_y,
                        size_t in_w, size_t in_h,
                        size_t out_w, size_t out_h,
-                       uint8_t* in_buf, uint8_t* out_buf,
-                       size_t start_p, size_t end_p,
+                       const uint8_t* in_buf, uint8_t* out_buf,
+                       size_t y0, size_t y1,
                        int core_left, int core_right, int core_top, int core_bottom,
-                       weight_func core) {
-    for(size_t p = start_p; p < end_p; p++) {
-        size_t x = p % out_w;
-        size_t y = p / out_w;
+                       weight_func core,
+                       const float* lut_x, const float* lut_y) {
+    if(y0 >= y1 || out_w == 0) return 0;
+    // 计算核长宽
+    const int core_width = core_right - core_left + 1;
+    const int core_height = core_bottom - core_top + 1;
 
-        // 计算浮点源坐标
-        float src_x_float = x / scale_x;
-        float src_y_float = y / scale_y;
-        
-        // 获取基准整数坐标
-        int base_x = floorf(src_x_float);
-        int base_y = floorf(src_y_float);
-        
-        // 计算相对于基准坐标的小数偏移量
-        float frac_x = src_x_float - base_x;
-        float frac_y = src_y_float - base_y;
-        
-        for(int c = 0; c < 4; c++) {
+    float* ring = malloc(sizeof(float) * 4 * out_w * core_height); // 中间行
+    long* ring_row = malloc(sizeof(long) * core_height); // 每个槽对应的输入行
+    const float** rows = malloc(sizeof(float*) * core_height); // 当前输出行用到的中间行
+    float* wy = malloc(sizeof(float) * core_height);
+    int* sample_x = malloc(sizeof(int) * out_w * core_width);
+    float* wx_sum = malloc(sizeof(float) * out_w);
+    float* wx = lut_x == NULL ? malloc(sizeof(float) * out_w * core_width) : NULL;
+    if(ring == NULL || ring_row == NULL || rows == NULL || wy == NULL || sample_x == NULL || wx_sum == NULL || (lut_x == NULL && wx == NULL)){
+        free(ring); free(ring_row); free(rows); free(wy); free(sample_x); free(wx_sum); free(wx);
+        return -1;
+    }
+    if(lut_x == NULL) lut_x = wx;
+
+    // 预计算每列的采样点与权重和
+    for(size_t x = 0; x < out_w; x++){
+        int base_x;
+        if(wx != NULL){
+            base_x = coord_weights(wx + x * core_width, x, scale_x, core_left, core_right, core);
+        }else{
+            base_x = floorf(x / scale_x);
+        }
+        float sum = 0.0f;
+        for(int dx = core_left, di = 0; dx <= core_right; dx++, di++){
+            // 边界限制(等效于边缘扩展)
+            sample_x[x * core_width + di] = clip(base_x + dx, 0, (int)in_w - 1);
+            sum += lut_x[x * core_width + di];
+        }
+        wx_sum[x] = sum;
+    }
+    for(int i = 0; i < core_height; i++) ring_row[i] = -1;
+
+    for(size_t y = y0; y < y1; y++){
+        int base_y;
+        const float* w = wy;
+        if(lut_y != NULL){
+            base_y = floorf(y / scale_y);
+            w = lut_y + y * core_height;
+        }else{
+            base_y = coord_weights(wy, y, scale_y, core_top, core_bottom, core);
+        }
+        float wy_sum = 0.0f;
+        for(int dy = core_top, di = 0; dy <= core_bottom; dy++, di++){
+            // 边界限制(等效于边缘扩展)
+            const long r = clip(base_y + dy, 0, (int)in_h - 1);
+            // 采样行是连续的不超过kh行，按行号取模不会冲突
+            const size_t slot = r % core_height;
+            float* dst = ring + slot * 4 * out_w;
+            if(ring_row[slot] != r){
+                hpass_row(in_buf + r * in_w * 4, dst, out_w, core_width, sample_x, lut_x);
+                ring_row[slot] = r;
+            }
+            rows[di] = dst;
+            wy_sum += w[di];
+        }
+        // 垂直方向合成，归一化并限制范围
+        uint8_t* out_row = out_buf + y * out_w * 4;
+        for(size_t i = 0; i < out_w * 4; i++){
             float sum = 0.0f;
-            float weight_sum = 0.0f;
-            for(int dx = core_left; dx <= core_right; dx++) {
-                int sample_x = base_x + dx;
-                sample_x = clip(sample_x, 0, in_w - 1);
-                
-                // 相对于核中心的一维水平距离
-                float dis_x = dx - frac_x;
-                
-                for(int dy = core_left; dy <= core_right; dy++) {
-                    int sample_y = base_y + dy;
-                    sample_y = clip(sample_y, 0, in_h - 1);
-                    
-                    // 相对于核中心的一维垂直距离
-                    float dis_y = dy - frac_y;
-
-                    float weight = core(dis_x, core_left, core_right) * 
-                                  core(dis_y, core_left, core_right);
-
-                    uint8_t pixel = in_buf[(sample_y * in_w + sample_x) * 4 + c];
-                    sum += weight * pixel;
-                    weight_sum += weight;
-                }
+            for(int di = 0; di < core_height; di++){
+                sum += w[di] * rows[di][i];
             }
-
-            float result = sum / weight_sum;
+            float result = sum / (wx_sum[i / 4] * wy_sum);
             result = clip(result, 0.0f, 255.0f);
-            out_buf[p * 4 + c] = round5(result);
+            out_row[i] = round5(result);
         }
     }
+    free(ring); free(ring_row); free(rows); free(wy); free(sample_x); free(wx_sum); free(wx);
     return 0;
 }
 
-// 通用自定义插值缩放函数（带LUT优化，时间复杂度从O(n^2)降至O(n)）
-int main_generic_custom_scale_lut(args_t *args, float scale_x, float scale_y,
+// 双线性插值的权重：三角形核
+static inline float linear_weight(float dis, int left, int right) {
+    dis = fabsf(dis);
+    return dis < 1.0f ? 1.0f - dis : 0.0f;
+}
+
+// 定点实现的非扩展指令集版本
+static void hpass_fixed_default(const uint8_t* row, int16_t* dst, size_t out_w, int taps, const int32_t* sample_x, const int16_t* wx){
+    for(size_t x = 0; x < out_w; x++){
+        hpass_fixed_pixel(row, dst + x * 4, taps, sample_x + x * taps, wx + x * taps);
+    }
+}
+static void vpass_fixed_default(const int16_t* const* rows, const int16_t* wy, int taps, uint8_t* out_row, size_t n){
+    for(size_t i = 0; i < n; i++){
+        out_row[i] = vpass_fixed_value(rows, wy, taps, i);
+    }
+}
+hpass_fixed_func_t hpass_fixed_func = hpass_fixed_default; // 默认值为非扩展指令集实现
+vpass_fixed_func_t vpass_fixed_func = vpass_fixed_default;
+
+// 初始化函数。加载扩展时调用一次，按CPU支持的指令集选择定点实现
+SHARED int init(void){
+    __builtin_cpu_init(); // 初始化CPU检测
+    if(__builtin_cpu_supports("avx2")){
+        hpass_fixed_func = hpass_fixed_avx2;
+        vpass_fixed_func = vpass_fixed_avx2;
+    }
+    else if(__builtin_cpu_supports("sse2")){
+        hpass_fixed_func = hpass_fixed_sse2;
+        vpass_fixed_func = vpass_fixed_sse2;
+    }
+    // 否则，使用原始实现
+    return 0;
+}
+
+// 把n个浮点权重归一化，量化为定点权重，并以0补齐到taps个。
+// 舍入误差补到绝对值最大的权重上，保证权重和恰为1。权重无法用int16表示时返回false
+static bool quantize_weights(const float* w, int n, int16_t* q, int taps){
+    float sum = 0.0f;
+    for(int i = 0; i < n; i++) sum += w[i];
+    if(!(fabsf(sum) > FLT_EPSILON)) return false; // 同时排除NaN
+    int32_t total = 0;
+    int main_i = 0;
+    for(int i = 0; i < n; i++){
+        float v = w[i] / sum * (1 << WEIGHT_BITS);
+        if(!(fabsf(v) <= INT16_MAX)) return false;
+        q[i] = lrintf(v);
+        total += q[i];
+        if(abs(q[i]) > abs(q[main_i])) main_i = i;
+    }
+    int32_t fixed = q[main_i] + (1 << WEIGHT_BITS) - total;
+    if(fixed < INT16_MIN || fixed > INT16_MAX) return false;
+    q[main_i] = fixed;
+    for(int i = n; i < taps; i++) q[i] = 0;
+    return true;
+}
+
+// separable_rows的定点实现，流程相同，中间行为int16。
+// 返回1表示权重无法用定点表示，需改用浮点实现
+static int separable_rows_fixed(float scale_x, float scale_y,
                        size_t in_w, size_t in_h,
                        size_t out_w, size_t out_h,
-                       uint8_t* in_buf, uint8_t* out_buf,
-                       size_t threads, size_t idx,
+                       const uint8_t* in_buf, uint8_t* out_buf,
+                       size_t y0, size_t y1,
                        int core_left, int core_right, int core_top, int core_bottom,
                        weight_func core,
-                       atomic_size_t* weight_lut_nonfill_threads) 
-                     {
-    // 计算当前线程处理的lut的x y坐标范围
-    const size_t lut_x_opstart = out_w * idx / threads;
-    const size_t lut_x_opend = out_w * (idx + 1) / threads;
-    const size_t lut_y_opstart = out_h * idx / threads;
-    const size_t lut_y_opend = out_h * (idx + 1) / threads;
-    // 计算卷积图片时像素的x y坐标范围
-    const size_t pixels = out_w * out_h;
-    const size_t start_p = pixels * idx / threads;
-    const size_t end_p = pixels * (idx + 1) / threads;
+                       const float* lut_x, const float* lut_y) {
+    if(y0 >= y1 || out_w == 0) return 0;
     // 计算核长宽
     const int core_width = core_right - core_left + 1;
     const int core_height = core_bottom - core_top + 1;
+    // 向量化实现每次处理两个采样点，采样数补齐为偶数
+    const int taps_x = (core_width + 1) & ~1;
+    const int taps_y = (core_height + 1) & ~1;
+
+    int16_t* ring = malloc(sizeof(int16_t) * 4 * out_w * core_height); // 中间行
+    long* ring_row = malloc(sizeof(long) * core_height); // 每个槽对应的输入行
+    const int16_t** rows = malloc(sizeof(int16_t*) * taps_y); // 当前输出行用到的中间行
+    float* w = malloc(sizeof(float) * max(core_width, core_height)); // 现算的浮点权重
+    int16_t* wy = malloc(sizeof(int16_t) * taps_y);
+    int32_t* sample_x = malloc(sizeof(int32_t) * out_w * taps_x);
+    int16_t* wx = malloc(sizeof(int16_t) * out_w * taps_x);
+    if(ring == NULL || ring_row == NULL || rows == NULL || w == NULL || wy == NULL || sample_x == NULL || wx == NULL){
+        free(ring); free(ring_row); free(rows); free(w); free(wy); free(sample_x); free(wx);
+        return -1;
+    }
 
-    // 计算x部分
-    for(size_t x = lut_x_opstart; x < lut_x_opend; x++) {
-        // 计算浮点源坐标
-        float src_x_float = x / scale_x;
-        // 获取基准整数坐标
-        int base_x = floorf(src_x_float);
-        // 计算相对于基准坐标的小数偏移量
-        float frac_x = src_x_float - base_x;
-        // 开始
-        for(int dx = core_left, di = 0; dx <= core_right; dx++, di++) {
-            // 采样点
-            int sample_x = base_x + dx;
+    int ret = 0;
+    // 预计算每列的采样点与定点权重。补齐的采样点重复最后一个
+    for(size_t x = 0; x < out_w && ret == 0; x++){
+        int base_x;
+        const float* src = w;
+        if(lut_x != NULL){
+            base_x = floorf(x / scale_x);
+            src = lut_x + x * core_width;
+        }else{
+            base_x = coord_weights(w, x, scale_x, core_left, core_right, core);
+        }
+        if(!quantize_weights(src, core_width, wx + x * taps_x, taps_x)){
+            ret = 1;
+        }
+        for(int di = 0; di < taps_x; di++){
             // 边界限制(等效于边缘扩展)
-            sample_x = clip(sample_x, 0, in_w - 1);
-            // 相对于核中心的一维水平距离
-            float dis_x = dx - frac_x;
-            // 计算权重
-            float weight = core(dis_x, core_left, core_right);
-            // 存入LUT
-            args->lut_x_buffer[x * core_width + di] = weight;
+            sample_x[x * taps_x + di] = clip(base_x + core_left + min(di, core_width - 1), 0, (int)in_w - 1);
         }
     }
-    // 计算y部分
-    for(size_t y = lut_y_opstart; y < lut_y_opend; y++) {
-        // 计算浮点源坐标
-        float src_y_float = y / scale_y;
-        // 获取基准整数坐标
-        int base_y = floorf(src_y_float);
-        // 计算相对于基准坐标的小数偏移量
-        float frac_y = src_y_float - base_y;
-        // 开始
-        for(int dy = core_top, di = 0; dy <= core_bottom; dy++, di++) {
-            // 采样点
-            int sample_y = base_y + dy;
+    for(int i = 0; i < core_height; i++) ring_row[i] = -1;
+
+    for(size_t y = y0; y < y1 && ret == 0; y++){
+        int base_y;
+        const float* src = w;
+        if(lut_y != NULL){
+            base_y = floorf(y / scale_y);
+            src = lut_y + y * core_height;
+        }else{
+            base_y = coord_weights(w, y, scale_y, core_top, core_bottom, core);
+        }
+        if(!quantize_weights(src, core_height, wy, taps_y)){
+            ret = 1;
+            break;
+        }
+        for(int dy = core_top, di = 0; dy <= core_bottom; dy++, di++){
             // 边界限制(等效于边缘扩展)
-            sample_y = clip(sample_y, 0, in_h - 1);
-            // 相对于核中心的一维垂直距离
-            float dis_y = dy - frac_y;
-            // 计算权重
-            float weight = core(dis_y, core_top, core_bottom);
-            // 存入LUT
-            args->lut_y_buffer[y * core_height + di] = weight;
+            const long r = clip(base_y + dy, 0, (int)in_h - 1);
+            // 采样行是连续的不超过kh行，按行号取模不会冲突
+            const size_t slot = r % core_height;
+            int16_t* dst = ring + slot * 4 * out_w;
+            if(ring_row[slot] != r){
+                hpass_fixed_func(in_buf + r * in_w * 4, dst, out_w, taps_x, sample_x, wx);
+                ring_row[slot] = r;
+            }
+            rows[di] = dst;
         }
+        for(int di = core_height; di < taps_y; di++) rows[di] = rows[core_height - 1];
+        vpass_fixed_func(rows, wy, taps_y, out_buf + y * out_w * 4, out_w * 4);
     }
-    // 减原子变量
-    atomic_fetch_sub_explicit(weight_lut_nonfill_threads, 1, memory_order_release);
-    // 等待所有线程完成
-    while(atomic_load_explicit(weight_lut_nonfill_threads, memory_order_acquire) != 0){
-        // 忙等待
-        #ifdef __x86_64__
-            __builtin_ia32_pause();  // x86 PAUSE指令，降低功耗
-        #elif defined(__aarch64__)
-            __asm__ __volatile__("yield" ::: "memory");  // ARM YIELD
-        #endif
-    }
-    
-    // 开始卷积，使用预计算好的LUT
-    // 遍历输出像素
-    for(size_t p = start_p; p < end_p; p++) {
-        size_t x = p % out_w;
-        size_t y = p / out_w;
-
-        // 计算浮点源坐标
-        float src_x_float = x / scale_x;
-        float src_y_float = y / scale_y;
-        
-        // 获取基准整数坐标
-        int base_x = floorf(src_x_float);
-        int base_y = floorf(src_y_float);
+    free(ring); free(ring_row); free(rows); free(w); free(wy); free(sample_x); free(wx);
+    return ret;
+}
 
-        // 开始
-        for(int c = 0; c < 4; c++) {
-            // 开始卷积
-            float sum = 0.0f;
-            float weight_sum = 0.0f;
-            for(int dx = core_left, dxi = 0; dx <= core_right; dx++, dxi++) {
-                // 采样点
-                int sample_x = base_x + dx;
-                // 边界限制(等效于边缘扩展)
-                sample_x = clip(sample_x, 0, in_w - 1);
-
-                for(int dy = core_top, dyi = 0; dy <= core_bottom; dy++, dyi++) {
-                    // 采样点
-                    int sample_y = base_y + dy;
-                    // 边界限制(等效于边缘扩展)
-                    sample_y = clip(sample_y, 0, in_h - 1);
-
-                    // 计算权重
-                    float weight = args->lut_x_buffer[x * core_width + dxi] * args->lut_y_buffer[y * core_height + dyi];
-
-                    // 获取像素并加权求和
-                    uint8_t pixel = in_buf[(sample_y * in_w + sample_x) * 4 + c];
-                    sum += weight * pixel;
-                    weight_sum += weight;
-                }
-            }
+// 可分离缩放，优先使用定点实现
+static int separable_scale(float scale_x, float scale_y,
+                       size_t in_w, size_t in_h,
+                       size_t out_w, size_t out_h,
+                       const uint8_t* in_buf, uint8_t* out_buf,
+                       size_t y0, size_t y1,
+                       int core_left, int core_right, int core_top, int core_bottom,
+                       weight_func core,
+                       const float* lut_x, const float* lut_y) {
+    int ret = separable_rows_fixed(scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf, y0, y1,
+        core_left, core_right, core_top, core_bottom, core, lut_x, lut_y);
+    if(ret == 1){
+        ret = separable_rows(scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf, y0, y1,
+            core_left, core_right, core_top, core_bottom, core, lut_x, lut_y);
+    }
+    return ret;
+}
 
-            // 归一化并限制范围
-            float result = sum / weight_sum;
-            result = clip(result, 0.0f, 255.0f);
-            out_buf[p * 4 + c] = round5(result);
-        }
+// 填充LUT中输出列[x0, x1)与输出行[y0, y1)的权重
+static void lut_fill_range(args_t *args, float scale_x, float scale_y,
+                       size_t x0, size_t x1, size_t y0, size_t y1,
+                       int core_left, int core_right, int core_top, int core_bottom,
+                       weight_func core) {
+    const int core_width = core_right - core_left + 1;
+    const int core_height = core_bottom - core_top + 1;
+    for(size_t x = x0; x < x1; x++){
+        coord_weights(args->lut_x_buffer + x * core_width, x, scale_x, core_left, core_right, core);
+    }
+    for(size_t y = y0; y < y1; y++){
+        coord_weights(args->lut_y_buffer + y * core_height, y, scale_y, core_top, core_bottom, core);
     }
-    return 0;
 }
 
-// 通用自定义插值缩放函数
+// 通用自定义插值缩放函数。每个线程处理连续的一段输出行
 int main_generic_custom_scale(args_t *args, float scale_x, float scale_y,
                        size_t in_w, size_t in_h,
                        size_t out_w, size_t out_h,
@@ -400,16 +490,103 @@ int main_generic_custom_scale(args_t *args, float scale_x, float scale_y,
                        size_t threads, size_t idx,
                        int core_left, int core_right, int core_top, int core_bottom,
                        weight_func core) {
-    if(args->lut_optimize){
+    // 当前线程处理的输出行
+    const size_t y0 = out_h * idx / threads;
+    const size_t y1 = out_h * (idx + 1) / threads;
+    if(!args->lut_optimize){
+        return separable_scale(scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf, y0, y1,
+            core_left, core_right, core_top, core_bottom, core, NULL, NULL);
+    }
+    if(args->lut_ready){
+        // LUT已预先填充，直接使用
+        return separable_scale(scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf, y0, y1,
+            core_left, core_right, core_top, core_bottom, core, args->lut_x_buffer, args->lut_y_buffer);
+    }
+    // LUT优化：各线程先分别填充一部分LUT，全部完成后再共用
+    lut_fill_range(args, scale_x, scale_y, out_w * idx / threads, out_w * (idx + 1) / threads, y0, y1,
+        core_left, core_right, core_top, core_bottom, core);
+    // 等待所有线程完成
+    if(img2arr_barrier_wait != NULL){
+        img2arr_barrier_wait();
+    }else if(threads > 1){
+        // 宿主未提供屏障时的后备方案。要求所有线程同时运行。
+        // 计数只增不减，每凑齐threads个线程过一轮，同一份参数可以反复计算。初始值threads是threads的倍数
+        atomic_size_t* weight_lut_fill_threads = args->thread_lock;
+        const size_t arrived = atomic_fetch_add_explicit(weight_lut_fill_threads, 1, memory_order_acq_rel) + 1;
+        const size_t target = ((arrived - 1) / threads + 1) * threads;
+        while(atomic_load_explicit(weight_lut_fill_threads, memory_order_acquire) < target){
+            // 忙等待
+            #ifdef __x86_64__
+                __builtin_ia32_pause();  // x86 PAUSE指令，降低功耗
+            #elif defined(__aarch64__)
+                __asm__ __volatile__("yield" ::: "memory");  // ARM YIELD
+            #endif
+        }
+    }
+    return separable_scale(scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf, y0, y1,
+        core_left, core_right, core_top, core_bottom, core, args->lut_x_buffer, args->lut_y_buffer);
+}
 
-        return main_generic_custom_scale_lut(args, scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf, threads, idx, core_left, core_right, core_top, core_bottom, core, args->thread_lock);
+// 输出坐标o覆盖的输入区间[*lo, *hi)
+static inline void area_span(size_t o, float scale, size_t in_len, double* lo, double* hi){
+    *lo = o / (double)scale;
+    *hi = (o + 1) / (double)scale;
+    if(*hi > in_len) *hi = in_len;
+    // 舍入导致区间越界时取最后一个像素
+    if(*lo >= *hi){
+        *hi = in_len;
+        *lo = *hi - 1;
     }
-    else{
-        const size_t pixels = out_w * out_h;
-        const size_t start_p = pixels * idx / threads;
-        const size_t end_p = pixels * (idx + 1) / threads;
-        return main_generic_custom_scale_nolut(args, scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf, start_p, end_p, core_left, core_right, core_top, core_bottom, core);
+}
+
+// 区域平均缩放，计算输出的[y0, y1)行。
+// 每个输出像素取其覆盖的输入区域(边缘按覆盖比例加权)的平均值。
+// 先把一个输出行覆盖的输入行按行累加，再在累加行上按列累加，总计算量只与输入大小有关，与缩放比例无关
+static int main_area(float scale_x, float scale_y,
+                       size_t in_w, size_t in_h,
+                       size_t out_w, size_t out_h,
+                       const uint8_t* in_buf, uint8_t* out_buf,
+                       size_t y0, size_t y1) {
+    if(y0 >= y1 || out_w == 0) return 0;
+    double* acc = malloc(sizeof(double) * 4 * in_w); // 当前输出行覆盖的输入行之和
+    if(acc == NULL) return -1;
+
+    for(size_t y = y0; y < y1; y++){
+        double ylo, yhi;
+        area_span(y, scale_y, in_h, &ylo, &yhi);
+        for(size_t i = 0; i < in_w * 4; i++) acc[i] = 0.0;
+        // 按行累加，首尾两行按覆盖比例加权
+        for(size_t r = (size_t)ylo; r < yhi; r++){
+            const double w = min(r + 1.0, yhi) - max((double)r, ylo);
+            const uint8_t* row = in_buf + r * in_w * 4;
+            for(size_t i = 0; i < in_w * 4; i++){
+                acc[i] += w * row[i];
+            }
+        }
+        uint8_t* out_row = out_buf + y * out_w * 4;
+        for(size_t x = 0; x < out_w; x++){
+            double xlo, xhi;
+            area_span(x, scale_x, in_w, &xlo, &xhi);
+            // 按列累加，首尾两列按覆盖比例加权
+            double s0 = 0.0, s1 = 0.0, s2 = 0.0, s3 = 0.0;
+            for(size_t c = (size_t)xlo; c < xhi; c++){
+                const double w = min(c + 1.0, xhi) - max((double)c, xlo);
+                const double* p = acc + c * 4;
+                s0 += w * p[0];
+                s1 += w * p[1];
+                s2 += w * p[2];
+                s3 += w * p[3];
+            }
+            // 除以覆盖面积
+            const double inv = 1.0 / ((xhi - xlo) * (yhi - ylo));
+            out_row[x * 4 + 0] = round5(clip(s0 * inv, 0.0, 255.0));
+            out_row[x * 4 + 1] = round5(clip(s1 * inv, 0.0, 255.0));
+            out_row[x * 4 + 2] = round5(clip(s2 * inv, 0.0, 255.0));
+            out_row[x * 4 + 3] = round5(clip(s3 * inv, 0.0, 255.0));
+        }
     }
+    free(acc);
+    return 0;
 }
 
 static int main_enum(args_t *args, float scale_x, float scale_y, size_t in_w, size_t in_h, size_t out_w, size_t out_h, uint8_t* in_buf, uint8_t* out_buf, size_t threads, size_t idx){
@@ -422,30 +599,55 @@ static int main_enum(args_t *args, float scale_x, float scale_y, size_t in_w, si
             main_nearest(scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf, start_p, end_p);
             break;
         case SCALE_BILINEAR:
-            main_bilinear(scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf, start_p, end_p);
-            break;
+            // 双线性插值即核为[0, 1]的三角形核的可分离缩放，不使用LUT
+            return separable_scale(scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf,
+                out_h * idx / threads, out_h * (idx + 1) / threads,
+                0, 1, 0, 1, linear_weight, NULL, NULL);
         case SCALE_BICUBIC:
-            main_generic_custom_scale(args, scale_x, scale_y, 
+            return main_generic_custom_scale(args, scale_x, scale_y, 
                 in_w, in_h, out_w, out_h, 
                 in_buf, out_buf, 
                 threads, idx,
                 args->core_left, args->core_right, args->core_top, args->core_bottom,
-
                 cubic_weight);
-            break;
         case SCALE_LANCZOS:
-            main_generic_custom_scale(args, scale_x, scale_y, 
+            return main_generic_custom_scale(args, scale_x, scale_y, 
                 in_w, in_h, out_w, out_h, 
                 in_buf, out_buf, 
                 threads, idx,
                 args->core_left, args->core_right, args->core_top, args->core_bottom,
                 lanczos_weight);
+        case SCALE_AREA:
+            return main_area(scale_x, scale_y, in_w, in_h, out_w, out_h, in_buf, out_buf,
+                out_h * idx / threads, out_h * (idx + 1) / threads);
         default:
             return -1;
     }
     return 0;
 }
 
+// 单线程填充整个LUT。ext.py在缩放参数变化时调用一次并设置lut_ready，缩放参数不变时的刷新不必再计算权重
+SHARED int weight_lut_fill(args_t* args, size_t in_shape[2]){
+    const size_t out_w = round5(in_shape[1] * args->sx);
+    const size_t out_h = round5(in_shape[0] * args->sy);
+    weight_func core;
+    switch(args->mode){
+        case SCALE_BICUBIC:
+            core = cubic_weight;
+            break;
+        case SCALE_LANCZOS:
+            core = lanczos_weight;
+            break;
+        default:
+            // 其余算法不使用LUT
+            return 0;
+    }
+    if(!args->lut_optimize) return -1;
+    lut_fill_range(args, args->sx, args->sy, 0, out_w, 0, out_h,
+        args->core_left, args->core_right, args->core_top, args->core_bottom, core);
+    return 0;
+}
+
 SHARED int f1(size_t threads, size_t idx, args_t* args, uint8_t* in_buf, uint8_t* out_buf, size_t in_shape[2]){
     const size_t out_w = round5(in_shape[1] * args->sx);
     const size_t out_h = round5(in_shape[0] * args->sy);
@@ -454,10 +656,7 @@ SHARED int f1(size_t threads, size_t idx, args_t* args, uint8_t* in_buf, uint8_t
     const size_t start_p = pixels * idx / threads;
     const size_t end_p = pixels * (idx + 1) / threads;
 
-    main_enum(args, args->sx, args->sy, in_shape[1], in_shape[0], out_w, out_h, in_buf, out_buf, threads, idx);
-
-
-    return 0;
+    return main_enum(args, args->sx, args->sy, in_shape[1], in_shape[0], out_w, out_h, in_buf, out_buf, threads, idx);
 }
 
 SHARED int f0(args_t* args, uint8_t *in_buf, uint8_t *out_buf, size_t in_shape[2]){
@@ -465,7 +664,5 @@ SHARED int f0(args_t* args, uint8_t *in_buf, uint8_t *out_buf, size_t in_shape[2
     const size_t out_w = round5(in_shape[1] * args->sx);
     const size_t out_h = round5(in_shape[0] * args->sy);
 
-    main_enum(args, args->sx, args->sy, in_shape[1], in_shape[0], out_w, out_h, in_buf, out_buf, 1, 0);
-
-    return 0;
+    return main_enum(args, args->sx, args->sy, in_shape[1], in_shape[0], out_w, out_h, in_buf, out_buf, 1, 0);
 }
\ No newline at end of file
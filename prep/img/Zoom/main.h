@@ -0,0 +1,66 @@
+#pragma once
+
+#include <stdint.h>
+#include <stddef.h>
+#include <string.h>
+
+// 定点实现的精度：权重为14位小数的int16，水平方向的中间行为6位小数的int16，累加器为int32
+// 与浮点实现相比，每个通道的误差不超过1
+#define WEIGHT_BITS 14
+#define INTER_BITS 6
+
+// 水平方向：把一行输入缩放到out_w宽，写入中间行。
+// taps为每个输出像素的采样数(偶数，不足时以权重0补齐)，sample_x与wx的大小均为out_w*taps
+typedef void (*hpass_fixed_func_t)(const uint8_t* row, int16_t* dst, size_t out_w, int taps, const int32_t* sample_x, const int16_t* wx);
+// 垂直方向：按wy合成taps个中间行，写入n个通道值到输出行。taps为偶数
+typedef void (*vpass_fixed_func_t)(const int16_t* const* rows, const int16_t* wy, int taps, uint8_t* out_row, size_t n);
+
+void hpass_fixed_sse2(const uint8_t* row, int16_t* dst, size_t out_w, int taps, const int32_t* sample_x, const int16_t* wx);
+void hpass_fixed_avx2(const uint8_t* row, int16_t* dst, size_t out_w, int taps, const int32_t* sample_x, const int16_t* wx);
+void vpass_fixed_sse2(const int16_t* const* rows, const int16_t* wy, int taps, uint8_t* out_row, size_t n);
+void vpass_fixed_avx2(const int16_t* const* rows, const int16_t* wy, int taps, uint8_t* out_row, size_t n);
+
+// 中间值饱和到int16
+static inline int16_t sat16(int32_t v){
+    return v < INT16_MIN ? INT16_MIN : (v > INT16_MAX ? INT16_MAX : v);
+}
+
+// 非扩展指令集实现，也用于处理向量化后剩余的部分
+static inline void hpass_fixed_pixel(const uint8_t* row, int16_t* dst, int taps, const int32_t* sx, const int16_t* w){
+    int32_t s0, s1, s2, s3;
+    s0 = s1 = s2 = s3 = 1 << (WEIGHT_BITS - INTER_BITS - 1);
+    for(int di = 0; di < taps; di++){
+        const uint8_t* p = row + (size_t)sx[di] * 4;
+        s0 += w[di] * p[0];
+        s1 += w[di] * p[1];
+        s2 += w[di] * p[2];
+        s3 += w[di] * p[3];
+    }
+    dst[0] = sat16(s0 >> (WEIGHT_BITS - INTER_BITS));
+    dst[1] = sat16(s1 >> (WEIGHT_BITS - INTER_BITS));
+    dst[2] = sat16(s2 >> (WEIGHT_BITS - INTER_BITS));
+    dst[3] = sat16(s3 >> (WEIGHT_BITS - INTER_BITS));
+}
+
+static inline uint8_t vpass_fixed_value(const int16_t* const* rows, const int16_t* wy, int taps, size_t i){
+    int32_t s = 1 << (WEIGHT_BITS + INTER_BITS - 1);
+    for(int di = 0; di < taps; di++){
+        s += wy[di] * rows[di][i];
+    }
+    s >>= WEIGHT_BITS + INTER_BITS;
+    return s < 0 ? 0 : (s > 255 ? 255 : s);
+}
+
+// 把相邻两个权重(w[0], w[1])作为一个32位整数读出，用于madd
+static inline int32_t weight_pair(const int16_t* w){
+    int32_t v;
+    memcpy(&v, w, sizeof(v));
+    return v;
+}
+
+// 读出一个像素(4字节)
+static inline int32_t load_pixel(const uint8_t* p){
+    int32_t v;
+    memcpy(&v, p, sizeof(v));
+    return v;
+}
@@ -0,0 +1,48 @@
+#include <emmintrin.h> // SSE2+
+
+#include "main.h"
+
+void hpass_fixed_sse2(const uint8_t* row, int16_t* dst, size_t out_w, int taps, const int32_t* sample_x, const int16_t* wx){
+    const __m128i zero = _mm_setzero_si128();
+    const __m128i round = _mm_set1_epi32(1 << (WEIGHT_BITS - INTER_BITS - 1));
+    for(size_t x = 0; x < out_w; x++){
+        const int32_t* sx = sample_x + x * taps;
+        const int16_t* w = wx + x * taps;
+        __m128i acc = round;
+        // 每次处理两个采样点：交错成[a0 b0 a1 b1 a2 b2 a3 b3]后与(wa, wb)做madd
+        for(int di = 0; di < taps; di += 2){
+            __m128i a = _mm_cvtsi32_si128(load_pixel(row + (size_t)sx[di] * 4));
+            __m128i b = _mm_cvtsi32_si128(load_pixel(row + (size_t)sx[di + 1] * 4));
+            __m128i ab = _mm_unpacklo_epi8(_mm_unpacklo_epi8(a, b), zero);
+            acc = _mm_add_epi32(acc, _mm_madd_epi16(ab, _mm_set1_epi32(weight_pair(w + di))));
+        }
+        acc = _mm_srai_epi32(acc, WEIGHT_BITS - INTER_BITS);
+        _mm_storel_epi64((__m128i*)(dst + x * 4), _mm_packs_epi32(acc, acc));
+    }
+}
+
+void vpass_fixed_sse2(const int16_t* const* rows, const int16_t* wy, int taps, uint8_t* out_row, size_t n){
+    const __m128i round = _mm_set1_epi32(1 << (WEIGHT_BITS + INTER_BITS - 1));
+    size_t i = 0;
+    // SSE2 主循环：每次处理 8 个通道值
+    for(; i + 8 <= n; i += 8){
+        __m128i acc_lo = round;
+        __m128i acc_hi = round;
+        for(int di = 0; di < taps; di += 2){
+            __m128i a = _mm_loadu_si128((const __m128i*)(rows[di] + i));
+            __m128i b = _mm_loadu_si128((const __m128i*)(rows[di + 1] + i));
+            __m128i w = _mm_set1_epi32(weight_pair(wy + di));
+            acc_lo = _mm_add_epi32(acc_lo, _mm_madd_epi16(_mm_unpacklo_epi16(a, b), w));
+            acc_hi = _mm_add_epi32(acc_hi, _mm_madd_epi16(_mm_unpackhi_epi16(a, b), w));
+        }
+        acc_lo = _mm_srai_epi32(acc_lo, WEIGHT_BITS + INTER_BITS);
+        acc_hi = _mm_srai_epi32(acc_hi, WEIGHT_BITS + INTER_BITS);
+        // 饱和打包，同时限制到[0, 255]
+        __m128i r16 = _mm_packs_epi32(acc_lo, acc_hi);
+        _mm_storel_epi64((__m128i*)(out_row + i), _mm_packus_epi16(r16, r16));
+    }
+    // 处理剩余部分
+    for(; i < n; i++){
+        out_row[i] = vpass_fixed_value(rows, wy, taps, i);
+    }
+}